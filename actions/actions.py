@@ -1,11 +1,15 @@
-from typing import Any, Text, Dict, List, Optional
+from typing import Any, Callable, Text, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, time, timedelta, date
-from dateparser import parse
-from pytz import timezone
+from functools import lru_cache, partial
+from zoneinfo import ZoneInfo
+import asyncio
+import contextvars
 import logging
-import sqlite3
 import os
 import re
+import threading
 import unicodedata
 from rasa_sdk import Action, Tracker, FormValidationAction
 from rasa_sdk.executor import CollectingDispatcher
@@ -18,8 +22,25 @@ from rasa_sdk.events import (
     EventType,
 )
 
+from database import (
+    DB_PATH,
+    ESQUEMA_CITAS,
+    VERSION_ESQUEMA,
+    HorarioOcupadoError,
+    IndiceDisponibilidad,
+    PoolConexiones,
+    abrir_conexion,
+    aplicar_migraciones,
+    guardar_cita,
+    transaccion_inmediata,
+    version_esquema,
+)
+from perfil_consultas import activar_desde_entorno, unidad_perfil
+
 logger = logging.getLogger(__name__)
-TZ = timezone("America/La_Paz")
+TZ = ZoneInfo("America/La_Paz")
+# Debe activarse antes de abrir cualquier conexión (incluida la de _init_db).
+perfil_consultas = activar_desde_entorno("acciones")
 
 PM_INDICATORS = {
     "pm",
@@ -44,19 +65,19 @@ SPANISH_WEEKDAYS = {
 }
 
 SPANISH_MONTHS = {
-    "enero",
-    "febrero",
-    "marzo",
-    "abril",
-    "mayo",
-    "junio",
-    "julio",
-    "agosto",
-    "septiembre",
-    "setiembre",
-    "octubre",
-    "noviembre",
-    "diciembre",
+    "enero": 1,
+    "febrero": 2,
+    "marzo": 3,
+    "abril": 4,
+    "mayo": 5,
+    "junio": 6,
+    "julio": 7,
+    "agosto": 8,
+    "septiembre": 9,
+    "setiembre": 9,
+    "octubre": 10,
+    "noviembre": 11,
+    "diciembre": 12,
 }
 
 AM_INDICATORS = {
@@ -97,7 +118,65 @@ NUMERIC_WORDS = {
 }
 
 
+# dateparser tarda en importarse y en cargar sus datos de idioma; se carga la
+# primera vez que hace falta o, antes, en el hilo de precalentamiento.
+_dateparser_parse = None
+_dateparser_lock = threading.Lock()
+
+
+def parse(*args, **kwargs):
+    """``dateparser.parse``, importado bajo demanda."""
+    global _dateparser_parse
+    if _dateparser_parse is None:
+        with _dateparser_lock:
+            if _dateparser_parse is None:
+                from dateparser import parse as dateparser_parse
+
+                _dateparser_parse = dateparser_parse
+    return _dateparser_parse(*args, **kwargs)
+
+
+def _precalentar() -> None:
+    """Importa dateparser y carga el español sin bloquear el arranque."""
+    retraso = float(os.environ.get("ACCIONES_PRECALENTAR_RETRASO_S", "1"))
+    if retraso:
+        threading.Event().wait(retraso)
+    try:
+        parse("20 de noviembre", languages=["es"], settings={"TIMEZONE": TZ.key})
+    except Exception as exc:
+        logger.warning(f"No se pudo precalentar dateparser: {exc}")
+
+
+# rasa_sdk atiende todas las conversaciones en un único bucle de eventos: las
+# consultas a SQLite y las llamadas a dateparser se hacen en este pool acotado
+# para que una sentencia lenta no detenga al resto. Con ``ACCIONES_HILOS=0`` se
+# ejecutan en línea, como antes.
+ACCIONES_HILOS = int(os.environ.get("ACCIONES_HILOS", "8"))
+_ejecutor = (
+    ThreadPoolExecutor(max_workers=ACCIONES_HILOS, thread_name_prefix="acciones")
+    if ACCIONES_HILOS > 0
+    else None
+)
+
+
+async def en_hilo(funcion: Callable, *args, **kwargs):
+    """Ejecuta ``funcion`` en el pool de las acciones sin bloquear el bucle.
+
+    Se copia el contexto actual para que el perfilador atribuya las consultas
+    a la acción que las originó.
+    """
+    if _ejecutor is None:
+        return funcion(*args, **kwargs)
+    contexto = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _ejecutor, partial(contexto.run, funcion, *args, **kwargs)
+    )
+
+
 def _strip_accents(value: Text) -> Text:
+    if value.isascii():
+        return value
     return "".join(
         char
         for char in unicodedata.normalize("NFD", value)
@@ -106,13 +185,32 @@ def _strip_accents(value: Text) -> Text:
 
 
 def _texto_a_numero(token: Text) -> Optional[int]:
-    token = _strip_accents(token.lower())
-    return NUMERIC_WORDS.get(token)
+    token = token.lower()
+    numero = NUMERIC_WORDS.get(token)
+    if numero is None and not token.isascii():
+        numero = NUMERIC_WORDS.get(_strip_accents(token))
+    return numero
+
+
+# Patrones de parse_hora_es, compilados una sola vez.
+_RE_H_MINUTOS = re.compile(r"(\d{1,2})\s*h\s*(\d{2})")
+_RE_H_SOLA = re.compile(r"(\d{1,2})\s*h\b")
+_RE_CUARTO_PARA = re.compile(r"cuarto\s+para\s+las?\s+([\wáéíóúñ]+)")
+_RE_Y_MEDIA = re.compile(r"([\wáéíóúñ]+)\s+y\s+media")
+_RE_Y_CUARTO = re.compile(r"([\wáéíóúñ]+)\s+y\s+cuarto")
+_RE_PALABRA = re.compile(r"\b[\wáéíóúñ]+\b")
+_RE_HORA_NUMERICA = re.compile(r"(\d{1,2})(?:[:](\d{1,2}))?")
+_RE_ESPACIO_O_PUNTO = re.compile(r"[\s\.]")
+_SIN_PUNTUACION = str.maketrans({".": " ", ",": " "})
+# Marca que la entrada no se reconoce sin dateparser (no se guarda en caché,
+# porque dateparser puede depender de la hora actual).
+_USAR_DATEPARSER = object()
+PARSE_HORA_CACHE = int(os.environ.get("PARSE_HORA_CACHE", "2048"))
 
 
 def _detectar_periodo(texto: Text) -> Dict[str, bool]:
     texto_normalizado = texto.lower()
-    compacto = re.sub(r"[\s\.]", "", texto_normalizado)
+    compacto = _RE_ESPACIO_O_PUNTO.sub("", texto_normalizado)
     indicadores_pm = any(ind in texto_normalizado for ind in PM_INDICATORS) or "pm" in compacto
     indicadores_am = any(ind in texto_normalizado for ind in AM_INDICATORS) or "am" in compacto
     return {"pm": indicadores_pm, "am": indicadores_am}
@@ -133,92 +231,141 @@ def _aplicar_periodo(base_hour: int, minute: int, texto: Text) -> time:
     return time(hour, minute)
 
 
-def _replace_text_numbers(texto: Text) -> Text:
-    def reemplazar(match: re.Match) -> Text:
-        palabra = match.group(0)
-        numero = _texto_a_numero(palabra)
-        if numero is not None:
-            return str(numero)
-        return palabra
-
-    return re.sub(r"\b[\wáéíóúñ]+\b", reemplazar, texto)
+def _reemplazar_numero(match: re.Match) -> Text:
+    palabra = match.group(0)
+    numero = _texto_a_numero(palabra)
+    if numero is not None:
+        return str(numero)
+    return palabra
 
 
-def parse_hora_es(value: Optional[Text]) -> Optional[time]:
-    if not value:
-        return None
+def _replace_text_numbers(texto: Text) -> Text:
+    return _RE_PALABRA.sub(_reemplazar_numero, texto)
 
-    texto = value.strip().lower()
-    if not texto:
-        return None
 
-    texto = texto.replace("\u200b", "")
-    texto = texto.replace("hrs", "")
-    texto = texto.replace("horas", "")
-    texto = texto.replace("hora", "")
-    texto = texto.replace("hs", "")
-    texto = re.sub(r"(\d{1,2})\s*h\s*(\d{2})", r"\1:\2", texto)
-    texto = re.sub(r"(\d{1,2})\s*h\b", r"\1", texto)
-    texto = texto.replace("p.m.", " pm ")
-    texto = texto.replace("a.m.", " am ")
-    texto = texto.replace("p.m", " pm ")
-    texto = texto.replace("a.m", " am ")
-    texto = re.sub(r"[\.\,]", " ", texto)
-    texto = re.sub(r"\s+", " ", texto).strip()
+def _normalizar_hora(texto: Text) -> Text:
+    """Limpia la hora escrita (ya en minúsculas y sin espacios en los extremos).
 
+    Cada reemplazo solo se intenta si aparece el carácter que lo dispara; el
+    orden se mantiene porque quitar un sufijo puede formar otro ("hhorasrs").
+    """
+    if "\u200b" in texto:
+        texto = texto.replace("\u200b", "")
+    if "h" in texto:
+        texto = texto.replace("hrs", "")
+        texto = texto.replace("horas", "")
+        texto = texto.replace("hora", "")
+        texto = texto.replace("hs", "")
+        if "h" in texto:
+            texto = _RE_H_MINUTOS.sub(r"\1:\2", texto)
+            texto = _RE_H_SOLA.sub(r"\1", texto)
+    if "." in texto:
+        texto = texto.replace("p.m.", " pm ")
+        texto = texto.replace("a.m.", " am ")
+        texto = texto.replace("p.m", " pm ")
+        texto = texto.replace("a.m", " am ")
+    return " ".join(texto.translate(_SIN_PUNTUACION).split())
+
+
+def _numero_de_token(token: Text) -> Optional[int]:
+    numero = _texto_a_numero(token)
+    if numero is None and token.isdigit():
+        numero = int(token)
+    return numero
+
+
+@lru_cache(maxsize=PARSE_HORA_CACHE)
+def _parse_hora_normalizada(texto: Text):
+    """Reconoce la hora en ``texto`` ya normalizado, sin recurrir a dateparser."""
     if not texto:
         return None
 
     texto_sin_acentos = _strip_accents(texto)
-
-    if "medianoche" in texto_sin_acentos or "media noche" in texto_sin_acentos:
-        return time(0, 0)
-    if "mediodia" in texto_sin_acentos or "medio dia" in texto_sin_acentos:
-        return time(12, 0)
-
-    match = re.search(r"cuarto\s+para\s+las?\s+([\wáéíóúñ]+)", texto)
-    if match:
-        objetivo = match.group(1)
-        numero = _texto_a_numero(objetivo) or (int(objetivo) if objetivo.isdigit() else None)
-        if numero is not None:
-            base_hour = (numero - 1) % 24
-            return _aplicar_periodo(base_hour, 45, texto)
-
-    match = re.search(r"([\wáéíóúñ]+)\s+y\s+media", texto)
-    if match:
-        numero = _texto_a_numero(match.group(1))
-        if numero is None and match.group(1).isdigit():
-            numero = int(match.group(1))
-        if numero is not None:
-            return _aplicar_periodo(numero, 30, texto)
-
-    match = re.search(r"([\wáéíóúñ]+)\s+y\s+cuarto", texto)
-    if match:
-        numero = _texto_a_numero(match.group(1))
-        if numero is None and match.group(1).isdigit():
-            numero = int(match.group(1))
-        if numero is not None:
-            return _aplicar_periodo(numero, 15, texto)
-
-    reemplazado = _replace_text_numbers(texto)
-    match = re.search(r"(\d{1,2})(?:[:](\d{1,2}))?", reemplazado)
+    if "medi" in texto_sin_acentos:
+        if "medianoche" in texto_sin_acentos or "media noche" in texto_sin_acentos:
+            return time(0, 0)
+        if "mediodia" in texto_sin_acentos or "medio dia" in texto_sin_acentos:
+            return time(12, 0)
+
+    if "cuarto" in texto:
+        match = _RE_CUARTO_PARA.search(texto)
+        if match:
+            objetivo = match.group(1)
+            numero = _texto_a_numero(objetivo) or (int(objetivo) if objetivo.isdigit() else None)
+            if numero is not None:
+                base_hour = (numero - 1) % 24
+                return _aplicar_periodo(base_hour, 45, texto)
+
+    # Tras normalizar, los espacios son simples: basta buscar la frase literal.
+    y_media = "y media" in texto
+    y_cuarto = "y cuarto" in texto
+    if y_media:
+        match = _RE_Y_MEDIA.search(texto)
+        if match:
+            numero = _numero_de_token(match.group(1))
+            if numero is not None:
+                return _aplicar_periodo(numero, 30, texto)
+
+    if y_cuarto:
+        match = _RE_Y_CUARTO.search(texto)
+        if match:
+            numero = _numero_de_token(match.group(1))
+            if numero is not None:
+                return _aplicar_periodo(numero, 15, texto)
+
+    match = _RE_HORA_NUMERICA.search(_replace_text_numbers(texto))
     if match:
         hour = int(match.group(1))
         minute = int(match.group(2)) if match.group(2) else 0
-        if "y media" in texto:
+        if y_media:
             minute = 30
-        elif "y cuarto" in texto:
+        elif y_cuarto:
             minute = 15
         if minute >= 60:
             return None
         return _aplicar_periodo(hour, minute, texto)
 
+    return _USAR_DATEPARSER
+
+
+def parse_hora_es(value: Optional[Text]) -> Optional[time]:
+    if not value:
+        return None
+
+    texto = value.strip().lower()
+    if not texto:
+        return None
+
+    texto = _normalizar_hora(texto)
+    resultado = _parse_hora_normalizada(texto)
+    if resultado is not _USAR_DATEPARSER:
+        return resultado
+    return _hora_con_dateparser(value, texto)
+
+
+async def parse_hora_es_async(value: Optional[Text]) -> Optional[time]:
+    """``parse_hora_es`` que solo sale del bucle cuando necesita dateparser."""
+    if not value:
+        return None
+
+    texto = value.strip().lower()
+    if not texto:
+        return None
+
+    texto = _normalizar_hora(texto)
+    resultado = _parse_hora_normalizada(texto)
+    if resultado is not _USAR_DATEPARSER:
+        return resultado
+    return await en_hilo(_hora_con_dateparser, value, texto)
+
+
+def _hora_con_dateparser(value: Text, texto: Text) -> Optional[time]:
     try:
         parsed = parse(
             value,
             languages=["es"],
             settings={
-                "TIMEZONE": TZ.zone,
+                "TIMEZONE": TZ.key,
                 "RETURN_AS_TIMEZONE_AWARE": False,
             },
         )
@@ -230,8 +377,8 @@ def parse_hora_es(value: Optional[Text]) -> Optional[time]:
     return None
 
 
-def _proxima_fecha_por_dia_semana(weekday: int) -> date:
-    hoy = datetime.now(TZ).date()
+def _proxima_fecha_por_dia_semana(weekday: int, hoy: Optional[date] = None) -> date:
+    hoy = hoy or datetime.now(TZ).date()
     delta = (weekday - hoy.weekday() + 7) % 7
     if delta == 0:
         delta = 7
@@ -250,99 +397,207 @@ def _ajustar_fecha_futura(fecha_objetivo: date, referencia: date) -> date:
             fecha = fecha + timedelta(days=1)
     return fecha
 
+
+# --- Fechas en español sin dateparser ---
+# Las formas habituales ("mañana", "el viernes", "15/11", "20 de noviembre",
+# "2025-11-20") se reconocen directamente; dateparser queda para el resto.
+
+_MESES_ABREVIADOS = {
+    **SPANISH_MONTHS,
+    **{mes[:3]: numero for mes, numero in SPANISH_MONTHS.items()},
+    "sept": 9,
+}
+_DIAS_SEMANA_SIN_ACENTO = {_strip_accents(dia): n for dia, n in SPANISH_WEEKDAYS.items()}
+_PATRON_DIA_SEMANA = "|".join(sorted(_DIAS_SEMANA_SIN_ACENTO, key=len, reverse=True))
+_RE_RELLENO_FECHA = re.compile(
+    r"\b(?:para|el|la|este|esta|proximo|proxima|que viene|de esta semana)\b"
+)
+_RE_DIA_FECHA = re.compile(r"\bdia\b")
+_RE_DIA_SEMANA = re.compile(rf"\b({_PATRON_DIA_SEMANA})\b")
+_RE_DIA_SEMANA_INICIAL = re.compile(rf"^(?:{_PATRON_DIA_SEMANA}) ")
+_RE_FECHA_ISO = re.compile(r"^(\d{4})[-/](\d{1,2})[-/](\d{1,2})$")
+_RE_FECHA_NUMERICA = re.compile(r"^(\d{1,2})[/-](\d{1,2})(?:[/-](\d{4}|\d{2}))?$")
+_RE_FECHA_CON_MES = re.compile(r"^(\d{1,2}) (?:de )?([a-z]+)(?: (?:de |del )?(\d{4}))?$")
+_RE_SOLO_DIA = re.compile(r"^(\d{1,2})$")
+_SIN_PUNTUACION_FECHA = str.maketrans({",": " ", ".": " "})
+
+ESTADISTICAS_FECHA = {"rapida": 0, "dateparser": 0, "sin_reconocer": 0}
+
+
+def _contar_fecha(resultado: str) -> None:
+    ESTADISTICAS_FECHA[resultado] += 1
+
+
+def _crear_fecha(anio: int, mes: int, dia: int) -> Optional[date]:
+    try:
+        return date(anio, mes, dia)
+    except ValueError:
+        return None
+
+
+def reconocer_fecha_es(texto: Optional[Text], hoy: date) -> Optional[date]:
+    """Reconoce las formas de fecha más comunes sin recurrir a dateparser.
+
+    Las fechas sin año se interpretan hacia el futuro, como hace dateparser con
+    ``PREFER_DATES_FROM=future``. Devuelve ``None`` si la forma no se reconoce.
+    """
+    if not texto:
+        return None
+    normalizado = _strip_accents(texto.lower()).translate(_SIN_PUNTUACION_FECHA)
+    normalizado = " ".join(normalizado.split())
+
+    if normalizado == "hoy":
+        return hoy
+    if normalizado == "manana":
+        return hoy + timedelta(days=1)
+    if normalizado == "pasado manana":
+        return hoy + timedelta(days=2)
+
+    match = _RE_FECHA_ISO.match(normalizado)
+    if match:
+        return _crear_fecha(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+    # Un día de la semana sin números ni mes ("el próximo viernes por la
+    # tarde") es el siguiente día con ese nombre.
+    dia_semana = _RE_DIA_SEMANA.search(normalizado)
+    if (
+        dia_semana
+        and not any(ch.isdigit() for ch in normalizado)
+        and not any(mes in normalizado for mes in SPANISH_MONTHS)
+    ):
+        return _proxima_fecha_por_dia_semana(_DIAS_SEMANA_SIN_ACENTO[dia_semana.group(1)], hoy)
+
+    sin_relleno = _RE_RELLENO_FECHA.sub(" ", _RE_DIA_FECHA.sub(" ", normalizado))
+    con_relleno = sin_relleno != normalizado
+    normalizado = " ".join(sin_relleno.split())
+    # "viernes 20 de noviembre": el día de la semana no aporta nada más.
+    normalizado = _RE_DIA_SEMANA_INICIAL.sub("", normalizado)
+
+    match = _RE_FECHA_NUMERICA.match(normalizado)
+    if match:
+        dia, mes, anio = match.groups()
+        if anio:
+            return _crear_fecha(int(anio) + (2000 if len(anio) == 2 else 0), int(mes), int(dia))
+        fecha = _crear_fecha(hoy.year, int(mes), int(dia))
+        return _ajustar_fecha_futura(fecha, hoy) if fecha else None
+
+    match = _RE_FECHA_CON_MES.match(normalizado)
+    if match:
+        dia, nombre_mes, anio = match.groups()
+        mes = _MESES_ABREVIADOS.get(nombre_mes)
+        if mes is None:
+            return None
+        if anio:
+            return _crear_fecha(int(anio), mes, int(dia))
+        fecha = _crear_fecha(hoy.year, mes, int(dia))
+        return _ajustar_fecha_futura(fecha, hoy) if fecha else None
+
+    # "el 20" o "el día 20": ese día de este mes, o del siguiente si ya pasó.
+    match = _RE_SOLO_DIA.match(normalizado)
+    if match and con_relleno:
+        dia = int(match.group(1))
+        fecha = _crear_fecha(hoy.year, hoy.month, dia)
+        if fecha is None or fecha < hoy:
+            siguiente = (hoy.replace(day=1) + timedelta(days=32)).replace(day=1)
+            fecha = _crear_fecha(siguiente.year, siguiente.month, dia)
+        return fecha
+
+    return None
+
+
+def parse_fecha_es(texto: Optional[Text]) -> Optional[date]:
+    """Fecha indicada por el cliente: primero la vía rápida, luego dateparser."""
+    ahora = datetime.now(TZ)
+    fecha = reconocer_fecha_es(texto, ahora.date())
+    if fecha is not None:
+        _contar_fecha("rapida")
+        return fecha
+    return _fecha_con_dateparser(texto, ahora)
+
+
+async def parse_fecha_es_async(texto: Optional[Text]) -> Optional[date]:
+    """``parse_fecha_es`` que solo sale del bucle cuando necesita dateparser."""
+    ahora = datetime.now(TZ)
+    fecha = reconocer_fecha_es(texto, ahora.date())
+    if fecha is not None:
+        _contar_fecha("rapida")
+        return fecha
+    return await en_hilo(_fecha_con_dateparser, texto, ahora)
+
+
+def _fecha_con_dateparser(texto: Optional[Text], ahora: datetime) -> Optional[date]:
+    if not texto:
+        _contar_fecha("sin_reconocer")
+        return None
+
+    try:
+        parsed = parse(
+            texto,
+            languages=["es"],
+            settings={
+                "TIMEZONE": TZ.key,
+                "PREFER_DATES_FROM": "future",
+                "RELATIVE_BASE": ahora,
+            },
+        )
+    except Exception:
+        parsed = None
+    _contar_fecha("dateparser" if parsed else "sin_reconocer")
+    return parsed.date() if parsed else None
+
 # Reuse la misma base de datos que utiliza el backend para almacenar
 # usuarios. Aquí agregamos una tabla simple para las citas de cada
 # usuario. La columna "id_usuario" actúa como identificador del cliente
 # ya que el frontend envía el ID de usuario como `sender` al conectarse
 # al socket de Rasa.
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "usuarios.db")
 
 def _init_db() -> None:
-    """Asegúrese de que la tabla de citas exista con las columnas adecuadas."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS citas (
-                id_citas TEXT PRIMARY KEY,
-                id_usuario TEXT NOT NULL,
-                servicio TEXT NOT NULL,
-                fecha TEXT NOT NULL,
-                hora TEXT NOT NULL,
-                estado TEXT NOT NULL CHECK (
-                    estado IN ('confirmada','reprogramada','en progreso','cancelada','completada')
-                ),
-                id_mecanico TEXT,
-                FOREIGN KEY(id_usuario) REFERENCES usuarios(id_usuario),
-                FOREIGN KEY(id_mecanico) REFERENCES mecanicos(id_mecanico)
-            )
-        ''')
-        cursor.execute(
-            "SELECT sql FROM sqlite_master WHERE type='table' AND name='citas'"
-        )
-        row = cursor.fetchone()
-        schema_sql = row[0] if row else ""
-        if "estado IN" in schema_sql and "en progreso" not in schema_sql:
-            cursor.execute("PRAGMA table_info(citas)")
-            cols = [c[1] for c in cursor.fetchall()]
-            id_mecanico_select = "id_mecanico" if "id_mecanico" in cols else "NULL"
-            cursor.execute("ALTER TABLE citas RENAME TO citas_old")
-            cursor.execute(
-                '''
-                CREATE TABLE citas (
-                    id_citas TEXT PRIMARY KEY,
-                    id_usuario TEXT NOT NULL,
-                    servicio TEXT NOT NULL,
-                    fecha TEXT NOT NULL,
-                    hora TEXT NOT NULL,
-                    estado TEXT NOT NULL CHECK (
-                        estado IN ('confirmada','reprogramada','en progreso','cancelada','completada')
-                    ),
-                    id_mecanico TEXT,
-                    FOREIGN KEY(id_usuario) REFERENCES usuarios(id_usuario),
-                    FOREIGN KEY(id_mecanico) REFERENCES mecanicos(id_mecanico)
-                )
-                '''
-            )
-            cursor.execute(
-                f"""
-                INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado, id_mecanico)
-                SELECT id_citas, id_usuario, servicio, fecha, hora, estado, {id_mecanico_select}
-                FROM citas_old
-                """
-            )
-            cursor.execute("DROP TABLE citas_old")
+    """Asegúrese de que la tabla de citas exista con las columnas adecuadas.
+
+    Con el esquema ya en ``VERSION_ESQUEMA`` (lo habitual) solo lee
+    ``PRAGMA user_version``; la reconstrucción de tablas antiguas es una
+    migración más (ver ``database.MIGRACIONES``).
+    """
+    conn = abrir_conexion(DB_PATH)
+    try:
+        if version_esquema(conn) >= VERSION_ESQUEMA:
+            return
+        conn.execute(ESQUEMA_CITAS.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
         # Add the column id_mecanico if the table already existed
-        cursor.execute("PRAGMA table_info(citas)")
-        cols = [c[1] for c in cursor.fetchall()]
+        cols = [c[1] for c in conn.execute("PRAGMA table_info(citas)").fetchall()]
         if "id_mecanico" not in cols:
-            cursor.execute(
+            conn.execute(
                 "ALTER TABLE citas ADD COLUMN id_mecanico TEXT REFERENCES mecanicos(id_mecanico)"
             )
         conn.commit()
+        aplicar_migraciones(conn)
+    finally:
+        conn.close()
 
 
 # Create the table on module import so actions can write de inmediato
 _init_db()
 
+# Ocupación por día en memoria; se invalida sola cuando el backend u otro
+# worker confirma cambios en la base (ver ``IndiceDisponibilidad``).
+indice_disponibilidad = IndiceDisponibilidad(DB_PATH)
+
+# Conexiones reutilizables para los hilos de ``en_hilo``, como el
+# ``pool_db`` del backend: abrir una por llamada cuesta un ``connect`` más
+# los PRAGMA de ``abrir_conexion``.
+pool_db = PoolConexiones(DB_PATH, tamano=max(1, ACCIONES_HILOS))
+
+if os.environ.get("ACCIONES_PRECALENTAR", "1") != "0":
+    threading.Thread(target=_precalentar, name="precalentar-acciones", daemon=True).start()
+
 
 def obtener_horarios_disponibles(fecha: Text) -> List[Text]:
     """Return available 2-hour time slots for the given date."""
-    ocupados: set = set()
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute("PRAGMA foreign_keys = ON")
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT hora FROM citas WHERE fecha = ? AND estado IN ('confirmada','reprogramada')",
-                (fecha,),
-            )
-            ocupados = {row[0] for row in cursor.fetchall()}
+        return indice_disponibilidad.horarios_libres(fecha)
     except Exception as exc:
         logger.error(f"Error consultando horarios: {exc}")
-
-    horarios = sorted(hora for hora in HORARIOS_PERMITIDOS if hora not in ocupados)
-    return horarios
+        return sorted(HORARIOS_PERMITIDOS)
 
 
 def tabla_horarios(horarios: List[Text], html: bool = False) -> Text:
@@ -368,6 +623,105 @@ def _get_horarios_disponibles(fecha: Text, servicio: Optional[Text] = None) -> L
     return obtener_horarios_disponibles(fecha)
 
 
+# --- Acceso a la base desde las acciones ---
+# Funciones bloqueantes: las acciones las llaman con ``en_hilo``. Las fechas se
+# comparan con ``citas.inicio_ts`` (ver ``database.DESFASE_UTC_S``), de modo que
+# cada consulta es un recorrido acotado de ``idx_citas_usuario_inicio``.
+
+HISTORIAL_MAX_CITAS = int(os.environ.get("HISTORIAL_MAX_CITAS", "20"))
+
+_SQL_PROXIMA_CITA = """
+    SELECT id_citas, servicio, fecha, hora FROM citas
+    WHERE id_usuario = ?
+      AND estado IN ('confirmada','reprogramada')
+      AND inicio_ts >= ?
+    ORDER BY inicio_ts ASC
+    LIMIT 1
+"""
+
+
+def _ahora_ts() -> int:
+    return int(datetime.now(TZ).timestamp())
+
+
+@contextmanager
+def _conexion():
+    """Presta una conexión de ``pool_db`` y la devuelve al salir."""
+    conn = pool_db.adquirir()
+    try:
+        yield conn
+    finally:
+        pool_db.liberar(conn)
+
+
+def _insertar_cita(id_cita: Text, id_usuario: Text, servicio: Text, fecha: Text, hora: Text) -> None:
+    with _conexion() as conn:
+        # El índice único de bloques activos decide qué reserva gana
+        # cuando varias conversaciones piden el mismo horario a la vez.
+        with transaccion_inmediata(conn):
+            guardar_cita(
+                conn,
+                "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado) VALUES (?, ?, ?, ?, ?, ?)",
+                (id_cita, id_usuario, servicio, fecha, hora, "confirmada"),
+            )
+
+
+def _reprogramar_proxima_cita(id_usuario: Text, nueva_fecha: Text, nueva_hora: Text):
+    """Mueve la próxima cita activa del usuario; devuelve la fila original o ``None``."""
+    with _conexion() as conn:
+        with transaccion_inmediata(conn):
+            cursor = conn.cursor()
+            cursor.execute(_SQL_PROXIMA_CITA, (id_usuario, _ahora_ts()))
+            row = cursor.fetchone()
+            if row:
+                guardar_cita(
+                    conn,
+                    "UPDATE citas SET fecha = ?, hora = ?, estado = 'reprogramada' WHERE id_citas = ?",
+                    (nueva_fecha, nueva_hora, row[0]),
+                )
+            return row
+
+
+def _cancelar_proxima_cita(id_usuario: Text):
+    """Cancela la próxima cita activa del usuario; devuelve su fila o ``None``."""
+    with _conexion() as conn:
+        with transaccion_inmediata(conn):
+            cursor = conn.cursor()
+            cursor.execute(_SQL_PROXIMA_CITA, (id_usuario, _ahora_ts()))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute(
+                    "UPDATE citas SET estado = 'cancelada' WHERE id_citas = ?",
+                    (row[0],),
+                )
+            return row
+
+
+def _proxima_cita(id_usuario: Text):
+    with _conexion() as conn:
+        return conn.execute(_SQL_PROXIMA_CITA, (id_usuario, _ahora_ts())).fetchone()
+
+
+def _historial_citas(id_usuario: Text) -> List[tuple]:
+    """Últimas ``HISTORIAL_MAX_CITAS`` citas ya pasadas, de la más reciente a la más antigua.
+
+    Lee ``citas_todas`` para incluir también las citas archivadas.
+    """
+    with _conexion() as conn:
+        filas = conn.execute(
+            """
+            SELECT servicio, fecha, hora FROM citas_todas
+            WHERE id_usuario = ?
+              AND estado IN ('confirmada','reprogramada','completada')
+              AND inicio_ts < ?
+            ORDER BY inicio_ts DESC
+            LIMIT ?
+            """,
+            (id_usuario, _ahora_ts(), HISTORIAL_MAX_CITAS),
+        ).fetchall()
+        return [tuple(fila) for fila in filas]
+
+
 class ActionSessionStart(Action):
     """Greets the user once when a new session starts."""
 
@@ -399,7 +753,8 @@ class ActionAgendarCita(Action):
     def name(self) -> str:
         return "action_agendar_cita"
 
-    def run(
+    @unidad_perfil(perfil_consultas)
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -426,21 +781,10 @@ class ActionAgendarCita(Action):
 
         id_cita = generar_id_cita()
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute("PRAGMA foreign_keys = ON")
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT 1 FROM citas WHERE fecha = ? AND hora = ? AND estado IN ('confirmada','reprogramada')",
-                    (fecha, hora),
-                )
-                if cursor.fetchone():
-                    dispatcher.utter_message(response="utter_hora_ocupada")
-                    return []
-                cursor.execute(
-                     "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado) VALUES (?, ?, ?, ?, ?, ?)",
-                    (id_cita, id_usuario, servicio, fecha, hora, "confirmada"),
-                )
-                conn.commit()
+            await en_hilo(_insertar_cita, id_cita, id_usuario, servicio, fecha, hora)
+        except HorarioOcupadoError:
+            dispatcher.utter_message(response="utter_hora_ocupada")
+            return []
         except Exception as exc:
             logger.error(f"Error al guardar la cita: {exc}")
             dispatcher.utter_message(text="⚠️ Ocurrió un error al guardar tu cita.")
@@ -459,6 +803,7 @@ class ValidateReprogramarCitaForm(FormValidationAction):
     def name(self) -> Text:
         return "validate_reprogramar_cita_form"
 
+    @unidad_perfil(perfil_consultas)
     async def validate_fecha(self, slot_value, dispatcher, tracker, domain):
         texto = (slot_value or "").strip()
         requested_slot = tracker.get_slot("requested_slot")
@@ -478,57 +823,22 @@ class ValidateReprogramarCitaForm(FormValidationAction):
                 "tabla_horarios_html": "",
             }
 
-        texto_normalizado = _strip_accents(texto.lower())
         hoy = datetime.now(TZ).date()
-
-        fecha_objetivo = None
-
-        dias_encontrados = [
-            dia
-            for dia in SPANISH_WEEKDAYS
-            if re.search(rf"\b{dia}\b", texto_normalizado)
-        ]
-        contiene_mes = any(mes in texto_normalizado for mes in SPANISH_MONTHS)
-        contiene_digitos = any(ch.isdigit() for ch in texto_normalizado)
-        solo_dia_semana = (
-            bool(dias_encontrados)
-            and not contiene_mes
-            and not contiene_digitos
-        )
-
-        if solo_dia_semana:
-            weekday = SPANISH_WEEKDAYS[dias_encontrados[0]]
-            fecha_objetivo = _proxima_fecha_por_dia_semana(weekday)
-        else:
-            try:
-                parsed = parse(
-                    texto,
-                    languages=["es"],
-                    settings={
-                        "TIMEZONE": TZ.zone,
-                        "PREFER_DATES_FROM": "future",
-                        "RELATIVE_BASE": datetime.now(TZ),
-                    },
-                )
-            except Exception:
-                parsed = None
-
-            if not parsed:
-                dispatcher.utter_message(response="utter_error_fecha")
-                return {
-                    "fecha": None,
-                    "horarios_disponibles": [],
-                    "tabla_horarios_html": "",
-                }
-
-            fecha_objetivo = parsed.date()
-            if fecha_objetivo < hoy:
-                fecha_objetivo = _ajustar_fecha_futura(fecha_objetivo, hoy)
+        fecha_objetivo = await parse_fecha_es_async(texto)
+        if not fecha_objetivo:
+            dispatcher.utter_message(response="utter_error_fecha")
+            return {
+                "fecha": None,
+                "horarios_disponibles": [],
+                "tabla_horarios_html": "",
+            }
+        if fecha_objetivo < hoy:
+            fecha_objetivo = _ajustar_fecha_futura(fecha_objetivo, hoy)
 
         fecha_str = fecha_objetivo.isoformat()
 
         servicio = tracker.get_slot("servicio")
-        horarios = _get_horarios_disponibles(fecha_str, servicio)
+        horarios = await en_hilo(_get_horarios_disponibles, fecha_str, servicio)
         if not horarios:
             dispatcher.utter_message(
                 text="No hay horarios disponibles para esa fecha. Por favor elige otra."
@@ -547,6 +857,7 @@ class ValidateReprogramarCitaForm(FormValidationAction):
             "tabla_horarios_html": tabla,
         }
 
+    @unidad_perfil(perfil_consultas)
     async def validate_hora(self, slot_value, dispatcher, tracker, domain):
         value = (slot_value or "").strip()
         horarios = tracker.get_slot("horarios_disponibles") or []
@@ -573,7 +884,8 @@ class ActionReprogramarCita(Action):
     def name(self) -> str:
         return "action_reprogramar_cita"
 
-    def run(
+    @unidad_perfil(perfil_consultas)
+    async def run(
         self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict
     ) -> List[Dict[Text, Any]]:
         nueva_fecha = tracker.get_slot("fecha")
@@ -593,50 +905,19 @@ class ActionReprogramarCita(Action):
             )
             return events
 
-        row = None
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute("PRAGMA foreign_keys = ON")
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT id_citas, servicio, fecha, hora
-                    FROM citas
-                    WHERE id_usuario = ?
-                      AND estado IN ('confirmada','reprogramada')
-                    ORDER BY fecha ASC, hora ASC
-                    """,
-                    (id_usuario,),
-                )
-                row = cursor.fetchone()
-                if row:
-                    id_cita, servicio_registrado, fecha_actual, hora_actual = row
-                    if not servicio_actual:
-                        servicio_actual = servicio_registrado
-                    if (nueva_fecha, nueva_hora) != (fecha_actual, hora_actual):
-                        cursor.execute(
-                            """
-                            SELECT 1 FROM citas
-                            WHERE fecha = ? AND hora = ?
-                              AND estado IN ('confirmada','reprogramada')
-                              AND id_citas != ?
-                            """,
-                            (nueva_fecha, nueva_hora, id_cita),
-                        )
-                        if cursor.fetchone():
-                            dispatcher.utter_message(response="utter_hora_ocupada")
-                            return events
-                    cursor.execute(
-                        "UPDATE citas SET fecha = ?, hora = ?, estado = 'reprogramada' WHERE id_citas = ?",
-                        (nueva_fecha, nueva_hora, id_cita),
-                    )
-                    conn.commit()
+            row = await en_hilo(_reprogramar_proxima_cita, id_usuario, nueva_fecha, nueva_hora)
+        except HorarioOcupadoError:
+            dispatcher.utter_message(response="utter_hora_ocupada")
+            return events
         except Exception as exc:
             logger.error(f"Error reprogramando cita: {exc}")
             dispatcher.utter_message(text="⚠️ Ocurrió un error al reprogramar tu cita.")
             return events
 
         if row:
+            if not servicio_actual:
+                servicio_actual = row[1]
             dispatcher.utter_message(
                 response="utter_reprogramacion_exitosa",
                 fecha=nueva_fecha,
@@ -694,25 +975,18 @@ class ValidateAgendarCitaForm(FormValidationAction):
         dispatcher.utter_message(response="utter_ask_servicio")
         return {"servicio": None}
 
+    @unidad_perfil(perfil_consultas)
     async def validate_fecha(self, slot_value, dispatcher, tracker, domain):
         try:
-            parsed = parse(
-                slot_value,
-                settings={
-                    'TIMEZONE': TZ.zone,
-                    'PREFER_DATES_FROM': 'future',
-                    'RELATIVE_BASE': datetime.now(TZ),
-                },
-            )
-            if not parsed:
+            fecha = await parse_fecha_es_async(slot_value)
+            if not fecha:
                 raise ValueError("Formato no reconocido")
-            fecha = parsed.date()
             hoy = datetime.now(TZ).date()
             if fecha < hoy:
                 dispatcher.utter_message(response="utter_error_fecha")
                 return {"fecha": None}
             fecha_str = fecha.isoformat()
-            horarios = obtener_horarios_disponibles(fecha_str)
+            horarios = await en_hilo(obtener_horarios_disponibles, fecha_str)
             tabla = tabla_horarios(horarios, html=True)
             dispatcher.utter_message(text=tabla)
             if not horarios:
@@ -727,12 +1001,13 @@ class ValidateAgendarCitaForm(FormValidationAction):
             dispatcher.utter_message(response="utter_error_fecha")
             return {"fecha": None, "horarios_disponibles": []}
 
+    @unidad_perfil(perfil_consultas)
     async def validate_hora(self, slot_value, dispatcher, tracker, domain):
         if not slot_value:
             dispatcher.utter_message(response="utter_error_hora")
             return {"hora": None}
 
-        hora = parse_hora_es(slot_value)
+        hora = await parse_hora_es_async(slot_value)
         if not hora:
             dispatcher.utter_message(response="utter_error_hora")
             return {"hora": None}
@@ -754,16 +1029,9 @@ class ValidateAgendarCitaForm(FormValidationAction):
 
         if fecha:
             try:
-                with sqlite3.connect(DB_PATH) as conn:
-                    conn.execute("PRAGMA foreign_keys = ON")
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "SELECT 1 FROM citas WHERE fecha = ? AND hora = ? AND estado IN ('confirmada','reprogramada')",
-                        (fecha, hora_str),
-                    )
-                    if cursor.fetchone():
-                        dispatcher.utter_message(response="utter_hora_ocupada")
-                        return {"hora": None}
+                if await en_hilo(indice_disponibilidad.esta_ocupado, fecha, hora_str):
+                    dispatcher.utter_message(response="utter_hora_ocupada")
+                    return {"hora": None}
             except Exception as exc:
                 logger.error(f"Error validando hora ocupada: {exc}")
 
@@ -773,29 +1041,13 @@ class ActionCancelarCita(Action):
     def name(self) -> str:
         return "action_cancelar_cita"
 
-    def run(self, dispatcher, tracker, domain):
+    @unidad_perfil(perfil_consultas)
+    async def run(self, dispatcher, tracker, domain):
         id_usuario = tracker.sender_id
 
         row = None
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute("PRAGMA foreign_keys = ON")
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT id_citas, servicio, fecha, hora FROM citas
-                    WHERE id_usuario = ? AND estado IN ('confirmada','reprogramada')
-                    ORDER BY fecha ASC, hora ASC
-                    """,
-                    (id_usuario,),
-                )
-                row = cursor.fetchone()
-                if row:
-                    cursor.execute(
-                        "UPDATE citas SET estado = 'cancelada' WHERE id_citas = ?",
-                        (row[0],),
-                    )
-                    conn.commit()
+            row = await en_hilo(_cancelar_proxima_cita, id_usuario)
         except Exception as exc:
             logger.error(f"Error cancelando cita: {exc}")
 
@@ -816,37 +1068,15 @@ class ActionMostrarHistorial(Action):
     def name(self) -> str:
         return "action_mostrar_historial"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict) -> List[Dict[Text, Any]]:
+    @unidad_perfil(perfil_consultas)
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: DomainDict) -> List[Dict[Text, Any]]:
         id_usuario = tracker.sender_id
 
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute("PRAGMA foreign_keys = ON")
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT servicio, fecha, hora FROM citas
-                    WHERE id_usuario = ? AND estado IN ('confirmada','reprogramada','completada')
-                    ORDER BY fecha DESC, hora DESC
-                    """,
-                    (id_usuario,),
-                )
-                rows = cursor.fetchall()
+            citas_pasadas = await en_hilo(_historial_citas, id_usuario)
         except Exception as exc:
             logger.error(f"Error consultando historial: {exc}")
-            rows = []
-
-        ahora = datetime.now(TZ)
-        citas_pasadas: List[tuple] = []
-        for s, f, h in rows:
-            try:
-                fecha_dt = datetime.fromisoformat(f)
-                hora_dt = datetime.strptime(h, "%H:%M").time()
-                cita_dt = TZ.localize(datetime.combine(fecha_dt, hora_dt))
-                if cita_dt < ahora:
-                    citas_pasadas.append((s, f, h))
-            except Exception as exc:
-                logger.error(f"Error procesando cita almacenada: {exc}")
+            citas_pasadas = []
 
         if citas_pasadas:
             mensajes = ["\n".join([f"Servicio: {s}", f"Fecha: {f}", f"Hora: {h}"]) for s, f, h in citas_pasadas]
@@ -863,43 +1093,21 @@ class ActionConsultarCita(Action):
     def name(self) -> str:
         return "action_consultar_cita"
 
-    def run(self, dispatcher, tracker, domain):
+    @unidad_perfil(perfil_consultas)
+    async def run(self, dispatcher, tracker, domain):
         # Utilizar el sender_id persistente como identificador del usuario
         # Este valor coincide con el número de teléfono que el frontend envía
         # como session_id al conectarse con el bot
         id_usuario = tracker.sender_id
 
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute("PRAGMA foreign_keys = ON")
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT servicio, fecha, hora FROM citas
-                    WHERE id_usuario = ? AND estado IN ('confirmada','reprogramada')
-                    ORDER BY fecha ASC, hora ASC
-                    """,
-                    (id_usuario,),
-                )
-                rows = cursor.fetchall()
+            row = await en_hilo(_proxima_cita, id_usuario)
         except Exception as exc:
             logger.error(f"Error consultando cita: {exc}")
-            rows = []
+            row = None
 
-        servicio = fecha = hora = None
-        ahora = datetime.now(TZ)
-        for s, f, h in rows:
-            try:
-                fecha_dt = datetime.fromisoformat(f)
-                hora_dt = datetime.strptime(h, "%H:%M").time()
-                cita_dt = TZ.localize(datetime.combine(fecha_dt, hora_dt))
-                if cita_dt >= ahora:
-                    servicio, fecha, hora = s, f, h
-                    break
-            except Exception as exc:
-                logger.error(f"Error procesando cita almacenada: {exc}")
-
-        if servicio and fecha and hora:
+        if row:
+            _, servicio, fecha, hora = row
             dispatcher.utter_message(
                 text=f"📋 Tu próxima cita:\nServicio: {servicio}\nFecha: {fecha}\nHora: {hora}"
             )
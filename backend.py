@@ -8,17 +8,48 @@ from flask import (
     session,
     make_response,
     flash,
+    g,
+    has_request_context,
 )
-import requests
+import click
 from flask_cors import CORS
 import sqlite3
+import base64
+import csv
 import hashlib
+import hmac
+import io
+import json
 import os
 import random
 import string
+import threading
+from collections import OrderedDict
 from datetime import datetime, date, time, timedelta
+from functools import lru_cache
+from time import perf_counter
 from dotenv import load_dotenv
 
+from cliente_rasa import ClienteRasa
+from database import (
+    BIT_HORARIO,
+    DB_PATH,
+    DURACION_BLOQUE_S,
+    ESTADOS_ACTIVOS,
+    HorarioOcupadoError,
+    IndiceDisponibilidad,
+    PoolConexiones,
+    aplicar_migraciones,
+    archivar_citas,
+    barrer_citas_vencidas,
+    guardar_cita,
+    observar_consultas,
+    transaccion_inmediata,
+)
+from historial_chat import HISTORIAL_LIMITE, HISTORIAL_LIMITE_MAX, LectorHistorial, historial_json
+from metricas import BUCKETS_CONSULTAS, CONTENT_TYPE, REGISTRO
+from perfil_consultas import activar_desde_entorno
+
 load_dotenv()
 
 SECRET_KEY = os.environ.get("SECRET_KEY")
@@ -33,9 +64,118 @@ app = Flask(
 app.secret_key = SECRET_KEY
 CORS(app)
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "usuarios.db")
 HORARIOS_ADMIN_PERMITIDOS = {"08:00", "10:00", "12:00", "14:00", "16:00", "18:00"}
 
+# Con PERFIL_CONSULTAS=1 las conexiones se abren perfiladas (ver perfil_consultas.py);
+# tiene que activarse antes de crear el pool y el índice.
+perfil_consultas = activar_desde_entorno("backend")
+
+# Un pool por proceso: cada petición toma una conexión ya abierta (en modo
+# WAL y con los PRAGMA aplicados) y la devuelve al terminar.
+pool_db = PoolConexiones(DB_PATH, tamano=int(os.environ.get("DB_POOL_SIZE", "8")))
+# Ocupación de la agenda en memoria, compartida por las vistas del calendario.
+indice_disponibilidad = IndiceDisponibilidad(DB_PATH)
+# Historial del chat leído de tracker.db (solo lectura); si no está, se pide a Rasa.
+lector_historial = LectorHistorial()
+# Sesión HTTP compartida con Rasa, con caché del historial y cortocircuito.
+cliente_rasa = ClienteRasa()
+
+
+def get_db():
+    """Devuelve la conexión de la petición actual, tomándola del pool."""
+    if "db" not in g:
+        g.db = pool_db.adquirir()
+    return g.db
+
+
+@app.teardown_appcontext
+def liberar_db(_exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        pool_db.liberar(conn)
+
+
+# --- Métricas (expuestas en /metrics) ---
+METRICAS_TOKEN = os.environ.get("METRICAS_TOKEN")
+
+metrica_peticiones = REGISTRO.contador(
+    "http_peticiones_total", "Peticiones atendidas por endpoint, método y código de estado.",
+    ("endpoint", "metodo", "estado"),
+)
+metrica_latencia = REGISTRO.histograma(
+    "http_duracion_segundos", "Latencia de las peticiones por endpoint.", ("endpoint",)
+)
+metrica_consultas_peticion = REGISTRO.histograma(
+    "db_consultas_por_peticion", "Sentencias SQLite ejecutadas en cada petición.", ("endpoint",),
+    buckets=BUCKETS_CONSULTAS,
+)
+metrica_tiempo_db_peticion = REGISTRO.histograma(
+    "db_duracion_por_peticion_segundos", "Tiempo dentro de SQLite en cada petición.", ("endpoint",)
+)
+metrica_consultas = REGISTRO.contador("db_consultas_total", "Sentencias SQLite ejecutadas.")
+metrica_tiempo_db = REGISTRO.contador("db_duracion_segundos_total", "Tiempo acumulado dentro de SQLite.")
+metrica_rasa = REGISTRO.histograma(
+    "rasa_historial_duracion_segundos", "Duración de la consulta del historial al servidor de Rasa.",
+    ("resultado",),
+)
+metrica_historial_rasa = REGISTRO.contador(
+    "rasa_historial_total",
+    "Historiales pedidos a Rasa: servidos de caché, descargados, fallidos o rechazados por el cortocircuito.",
+    ("resultado",),
+)
+metrica_pool = REGISTRO.medidor("db_pool", "Estado del pool de conexiones SQLite.", ("dato",))
+metrica_barrido = REGISTRO.contador(
+    "citas_barridas_total", "Citas vencidas que el barrido pasó a 'completada'."
+)
+metrica_barrido_pasada = REGISTRO.histograma(
+    "barrido_citas_por_pasada", "Citas actualizadas en cada pasada del barrido.",
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000),
+)
+metrica_barrido_duracion = REGISTRO.histograma(
+    "barrido_citas_duracion_segundos", "Duración de cada pasada del barrido de citas vencidas."
+)
+metrica_archivo = REGISTRO.contador(
+    "citas_archivadas_total", "Citas terminadas movidas a citas_archivo."
+)
+metrica_archivo_duracion = REGISTRO.histograma(
+    "archivo_citas_duracion_segundos", "Duración de cada pasada del archivado de citas."
+)
+
+
+@observar_consultas
+def medir_consulta(_sql, segundos, _cursor):
+    metrica_consultas.inc()
+    metrica_tiempo_db.inc(segundos)
+    if has_request_context():
+        g.consultas_db = g.get("consultas_db", 0) + 1
+        g.tiempo_db = g.get("tiempo_db", 0.0) + segundos
+
+
+@app.before_request
+def iniciar_medicion():
+    g.inicio_peticion = perf_counter()
+    if perfil_consultas is not None:
+        g.unidad_perfil = perfil_consultas.iniciar_unidad(f"{request.method} {request.endpoint}")
+
+
+@app.teardown_request
+def cerrar_unidad_perfil(_exc):
+    token = g.pop("unidad_perfil", None)
+    if token is not None:
+        perfil_consultas.cerrar_unidad(token)
+
+
+@app.after_request
+def registrar_medicion(response):
+    inicio = g.get("inicio_peticion")
+    if inicio is not None:
+        endpoint = request.endpoint or "desconocido"
+        metrica_latencia.observar(perf_counter() - inicio, endpoint=endpoint)
+        metrica_peticiones.inc(endpoint=endpoint, metodo=request.method, estado=response.status_code)
+        metrica_consultas_peticion.observar(g.get("consultas_db", 0), endpoint=endpoint)
+        metrica_tiempo_db_peticion.observar(g.get("tiempo_db", 0.0), endpoint=endpoint)
+    return response
+
 
 def normalizar_hora_admin(valor_hora: str):
     """Normaliza la hora recibida y valida que esté en la lista permitida."""
@@ -54,54 +194,31 @@ def normalizar_hora_admin(valor_hora: str):
     return None
 
 
-def existe_conflicto_horario(cursor, fecha: str, hora: str, excluir_id_cita: str | None = None):
-    """Valida si ya existe una cita ocupando el mismo bloque de fecha y hora."""
-    query = """
-        SELECT 1
-        FROM citas
-        WHERE fecha = ?
-          AND hora = ?
-          AND lower(trim(estado)) IN ('confirmada', 'reprogramada', 'en progreso')
-    """
-    parametros = [fecha, hora]
-
-    if excluir_id_cita:
-        query += " AND id_citas <> ?"
-        parametros.append(excluir_id_cita)
-
-    query += " LIMIT 1"
-    cursor.execute(query, parametros)
-    return cursor.fetchone() is not None
-
 def generar_id_aleatorio(longitud=8):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=longitud))
 
 def obtener_historial(id_usuario: str):
-    """Get conversation history for a user from the Rasa server."""
-    rasa_url = os.environ.get("RASA_URL", "http://localhost:5005")
-    try:
-        resp = requests.get(
-            f"{rasa_url}/conversations/{id_usuario}/tracker",
-            params={"include_events": "after_restart"},
-            timeout=5,
-        )
-        if resp.status_code != 200:
-            return []
-        data = resp.json()
-        messages = []
-        for ev in data.get("events", []):
-            if ev.get("event") == "user" and ev.get("text"):
-                messages.append({"sender": "user", "text": ev.get("text")})
-            elif ev.get("event") == "bot" and ev.get("text"):
-                messages.append({"sender": "bot", "text": ev.get("text")})
-        return messages
-    except Exception:
-        return []
+    """Get conversation history for a user from the Rasa server.
+
+    Solo se usa cuando ``tracker.db`` no está disponible (ver ``/historial``).
+    Pasa por ``cliente_rasa``: sirve de caché si el historial es reciente y no
+    llama a Rasa mientras el cortocircuito esté abierto.
+    """
+    inicio = perf_counter()
+    mensajes, origen = cliente_rasa.historial(id_usuario)
+    if origen == "cache":
+        metrica_historial_rasa.inc(resultado="acierto")
+    elif origen == "circuito_abierto":
+        metrica_historial_rasa.inc(resultado="rechazo_circuito")
+    else:
+        # Se pidió a Rasa: "descarga" si respondió bien, "fallo" si no.
+        metrica_historial_rasa.inc(resultado="descarga" if origen == "ok" else "fallo")
+        metrica_rasa.observar(perf_counter() - inicio, resultado=origen)
+    return mensajes
 
 def crear_bd():
     """Ensure DB schema exists and create a default admin user."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    with app.app_context(), get_db() as conn:
         cursor = conn.cursor()
         # Tabla de usuarios con columna es_admin para privilegios
         cursor.execute(
@@ -145,6 +262,7 @@ def crear_bd():
             )
             """
         )
+        aplicar_migraciones(conn)
     
         # Si la base ya existía sin la columna es_admin la añadimos
         cursor.execute("PRAGMA table_info(usuarios)")
@@ -187,13 +305,12 @@ def crear_bd():
         
 
 def obtener_citas(id_usuario: str):
-    """Return all appointments associated with a user."""
+    """Return all appointments associated with a user, archived ones included."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute("PRAGMA foreign_keys = ON")
+        with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT id_citas, servicio, fecha, hora, estado, id_mecanico FROM citas WHERE id_usuario = ? ORDER BY fecha ASC, hora ASC",
+                "SELECT id_citas, servicio, fecha, hora, estado, id_mecanico FROM citas_todas WHERE id_usuario = ? ORDER BY fecha ASC, hora ASC",
                 (id_usuario,),
             )
             rows = cursor.fetchall()
@@ -212,6 +329,17 @@ def obtener_citas(id_usuario: str):
     ]
 
 
+# Horas del calendario ya convertidas, para no repetir strptime por bloque.
+HORAS_CALENDARIO = tuple(
+    (hora, datetime.strptime(hora, "%H:%M").time())
+    for hora in sorted(HORARIOS_ADMIN_PERMITIDOS)
+)
+HORAS_CALENDARIO_POR_TEXTO = dict(HORAS_CALENDARIO)
+CALENDARIO_CACHE_MAX = int(os.environ.get("CALENDARIO_CACHE_MAX", "32"))
+_cache_calendario = OrderedDict()
+_cache_calendario_lock = threading.Lock()
+
+
 def combinar_fecha_hora(fecha_str: str, hora_str: str):
     """Combina fecha y hora almacenadas en DB en un datetime válido."""
     try:
@@ -219,23 +347,53 @@ def combinar_fecha_hora(fecha_str: str, hora_str: str):
     except ValueError:
         return None
 
+    hora_limpia = (hora_str or "").strip()
+    hora = HORAS_CALENDARIO_POR_TEXTO.get(hora_limpia)
+    if hora is not None:
+        return datetime.combine(fecha, hora)
+
     for fmt in ("%H:%M", "%H:%M:%S"):
         try:
-            hora = datetime.strptime((hora_str or "").strip(), fmt).time()
+            hora = datetime.strptime(hora_limpia, fmt).time()
             return datetime.combine(fecha, hora)
         except ValueError:
             continue
     return None
 
 
+@lru_cache(maxsize=64)
+def rejilla_horarios(fecha_inicio: date, fecha_fin: date):
+    """Bloques hábiles (lunes a sábado) del rango ya formateados.
+
+    Devuelve tuplas ``(fecha iso, hora, inicio iso, fin iso)`` que no dependen
+    de las citas, por lo que se calculan una sola vez por rango.
+    """
+    bloques = []
+    cursor_fecha = fecha_inicio
+    while cursor_fecha <= fecha_fin:
+        # Lunes (0) a sábado (5)
+        if cursor_fecha.weekday() <= 5:
+            for hora_str, hora in HORAS_CALENDARIO:
+                inicio = datetime.combine(cursor_fecha, hora)
+                bloques.append(
+                    (
+                        cursor_fecha.isoformat(),
+                        hora_str,
+                        inicio.isoformat(),
+                        (inicio + timedelta(hours=1)).isoformat(),
+                    )
+                )
+        cursor_fecha += timedelta(days=1)
+    return tuple(bloques)
+
+
 def generar_eventos_disponibilidad(fecha_inicio: date, fecha_fin: date):
     """Construye eventos para FullCalendar con bloques disponibles y ocupados."""
     estados_ocupados = {"confirmada", "reprogramada", "en progreso"}
     eventos_ocupados = []
-    bloques_ocupados = set()
+    ocupacion = indice_disponibilidad.ocupacion(fecha_inicio, fecha_fin)
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -260,9 +418,6 @@ def generar_eventos_disponibilidad(fecha_inicio: date, fecha_fin: date):
             estado = (fila["estado"] or "").lower().strip()
             es_ocupada = estado in estados_ocupados
 
-            if es_ocupada:
-                bloques_ocupados.add(inicio)
-
             eventos_ocupados.append(
                 {
                     "id": fila["id_citas"],
@@ -279,35 +434,214 @@ def generar_eventos_disponibilidad(fecha_inicio: date, fecha_fin: date):
                 }
             )
 
-    eventos_disponibles = []
-    cursor_fecha = fecha_inicio
-    while cursor_fecha <= fecha_fin:
-        # Lunes (0) a sábado (5)
-        if cursor_fecha.weekday() <= 5:
-            for hora_str in sorted(HORARIOS_ADMIN_PERMITIDOS):
-                inicio = datetime.combine(
-                    cursor_fecha,
-                    datetime.strptime(hora_str, "%H:%M").time(),
-                )
-                if inicio not in bloques_ocupados:
-                    eventos_disponibles.append(
-                        {
-                            "title": "Disponible",
-                            "start": inicio.isoformat(),
-                            "end": (inicio + timedelta(hours=1)).isoformat(),
-                            "display": "background",
-                            "backgroundColor": "#86efac",
-                            "borderColor": "#86efac",
-                            "extendedProps": {"tipo": "disponible"},
-                        }
-                    )
-        cursor_fecha += timedelta(days=1)
+    eventos_disponibles = [
+        {
+            "title": "Disponible",
+            "start": inicio,
+            "end": fin,
+            "display": "background",
+            "backgroundColor": "#86efac",
+            "borderColor": "#86efac",
+            "extendedProps": {"tipo": "disponible"},
+        }
+        for fecha_iso, hora_str, inicio, fin in rejilla_horarios(fecha_inicio, fecha_fin)
+        if not ocupacion[fecha_iso] & BIT_HORARIO[hora_str]
+    ]
 
     return eventos_disponibles + eventos_ocupados
 
+
+def eventos_calendario_serializados(fecha_inicio: date, fecha_fin: date):
+    """Devuelve ``(cuerpo JSON, etag)`` del calendario, usando una caché LRU.
+
+    La clave incluye la versión del índice de disponibilidad, que cambia cada
+    vez que se confirma una escritura en la base; mientras no cambie ninguna
+    cita, repetir la misma vista no vuelve a consultar ni a serializar nada.
+    """
+    clave = (fecha_inicio, fecha_fin, indice_disponibilidad.version_actual())
+    with _cache_calendario_lock:
+        if clave in _cache_calendario:
+            _cache_calendario.move_to_end(clave)
+            return _cache_calendario[clave]
+
+    cuerpo = app.json.dumps(generar_eventos_disponibilidad(fecha_inicio, fecha_fin))
+    # El ETag depende del contenido para que sea válido entre procesos.
+    entrada = (cuerpo, hashlib.sha1(cuerpo.encode("utf-8")).hexdigest())
+    with _cache_calendario_lock:
+        _cache_calendario[clave] = entrada
+        while len(_cache_calendario) > CALENDARIO_CACHE_MAX:
+            _cache_calendario.popitem(last=False)
+    return entrada
+
 def hash_contrasena(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
+
+ESTADOS_CITA = ("confirmada", "reprogramada", "en progreso", "cancelada", "completada")
+TIPOS_IMPORTACION = ("usuarios", "mecanicos", "citas")
+IMPORTACION_LOTE = int(os.environ.get("IMPORTACION_LOTE", "2000"))
+
+
+def leer_registros(contenido: str, formato: str):
+    """Convierte el contenido CSV o JSON recibido en una lista de diccionarios."""
+    if formato == "json":
+        datos = json.loads(contenido)
+        if isinstance(datos, dict):
+            datos = datos.get("registros", [])
+        if not isinstance(datos, list) or not all(isinstance(r, dict) for r in datos):
+            raise ValueError("El JSON debe ser una lista de objetos")
+        return datos
+    return list(csv.DictReader(io.StringIO(contenido)))
+
+
+def _texto(registro: dict, campo: str) -> str:
+    return str(registro.get(campo) or "").strip()
+
+
+class ImportadorLotes:
+    """Valida e inserta registros en lotes ``executemany`` transaccionales.
+
+    El estado necesario para validar (teléfonos, mecánicos y bloques ocupados)
+    se mantiene en memoria, de modo que cada fila no consulta la base. Si un
+    lote falla por una restricción (por ejemplo, otra escritura concurrente),
+    ese lote se reintenta fila por fila para informar el error exacto.
+    """
+
+    def __init__(self, conn, tipo: str):
+        self.conn = conn
+        self.tipo = tipo
+        self.errores = []
+        self.insertados = 0
+        self.telefonos_usuarios = {
+            str(tel): id_u for id_u, tel in conn.execute("SELECT id_usuario, telefono FROM usuarios")
+        }
+        self.telefonos_mecanicos = {str(t) for (t,) in conn.execute("SELECT telefono FROM mecanicos")}
+        self.mecanicos = {m for (m,) in conn.execute("SELECT id_mecanico FROM mecanicos")}
+
+    def error(self, fila: int, mensaje: str) -> None:
+        self.errores.append({"fila": fila, "error": mensaje})
+
+    def validar_usuario(self, fila: int, r: dict):
+        telefono = _texto(r, "telefono")
+        contrasena = _texto(r, "contrasena")
+        if not telefono.isdigit() or len(telefono) != 8:
+            return self.error(fila, "El teléfono debe tener exactamente 8 dígitos")
+        if len(contrasena) < 6:
+            return self.error(fila, "La contraseña debe tener al menos 6 caracteres")
+        if telefono in self.telefonos_usuarios:
+            return self.error(fila, "Número ya registrado")
+        id_usuario = _texto(r, "id_usuario") or generar_id_aleatorio()
+        es_admin = 1 if _texto(r, "es_admin").lower() in {"1", "true", "on", "si", "sí"} else 0
+        self.telefonos_usuarios[telefono] = id_usuario
+        return (id_usuario, telefono, hash_contrasena(contrasena), es_admin)
+
+    def validar_mecanico(self, fila: int, r: dict):
+        nombre = _texto(r, "nombre")
+        telefono = _texto(r, "telefono")
+        if not nombre or not telefono:
+            return self.error(fila, "Nombre y teléfono son obligatorios")
+        if telefono in self.telefonos_mecanicos:
+            return self.error(fila, "Teléfono de mecánico ya registrado")
+        id_mecanico = _texto(r, "id_mecanico") or generar_id_aleatorio()
+        self.telefonos_mecanicos.add(telefono)
+        self.mecanicos.add(id_mecanico)
+        return (id_mecanico, nombre, telefono)
+
+    def validar_cita(self, fila: int, r: dict, ocupados: set):
+        id_usuario = _texto(r, "id_usuario") or self.telefonos_usuarios.get(_texto(r, "telefono"))
+        if not id_usuario:
+            return self.error(fila, "Usuario no encontrado")
+        servicio = _texto(r, "servicio")
+        if not servicio:
+            return self.error(fila, "El servicio es obligatorio")
+        fecha = _texto(r, "fecha")
+        try:
+            datetime.strptime(fecha, "%Y-%m-%d")
+        except ValueError:
+            return self.error(fila, "Fecha inválida; use AAAA-MM-DD")
+        hora = normalizar_hora_admin(_texto(r, "hora"))
+        if not hora:
+            return self.error(fila, "Hora no permitida. Use: 08:00, 10:00, 12:00, 14:00, 16:00 o 18:00.")
+        estado = _texto(r, "estado").lower() or "confirmada"
+        if estado not in ESTADOS_CITA:
+            return self.error(fila, f"Estado inválido: {estado}")
+        id_mecanico = _texto(r, "id_mecanico") or None
+        if id_mecanico and id_mecanico not in self.mecanicos:
+            return self.error(fila, "Mecánico no encontrado")
+        if estado in ESTADOS_ACTIVOS:
+            if (fecha, hora) in ocupados:
+                return self.error(fila, "Ya existe una cita registrada en ese horario.")
+            ocupados.add((fecha, hora))
+        id_cita = _texto(r, "id_citas") or generar_id_aleatorio()
+        return (id_cita, id_usuario, servicio, fecha, hora, estado, id_mecanico)
+
+    def _bloques_ocupados(self, lote) -> set:
+        fechas = [_texto(r, "fecha") for _, r in lote if _texto(r, "fecha")]
+        if not fechas:
+            return set()
+        marcadores = ", ".join("?" for _ in ESTADOS_ACTIVOS)
+        return {
+            (f, h)
+            for f, h in self.conn.execute(
+                f"SELECT fecha, hora FROM citas WHERE fecha BETWEEN ? AND ? AND estado IN ({marcadores})",
+                (min(fechas), max(fechas), *ESTADOS_ACTIVOS),
+            )
+        }
+
+    def _insertar(self, sql: str, filas) -> None:
+        """``executemany`` del lote; si falla, reintenta fila por fila."""
+        self.conn.execute("SAVEPOINT lote_importacion")
+        try:
+            self.conn.executemany(sql, [valores for _, valores in filas])
+            self.conn.execute("RELEASE lote_importacion")
+            self.insertados += len(filas)
+            return
+        except sqlite3.IntegrityError:
+            self.conn.execute("ROLLBACK TO lote_importacion")
+            self.conn.execute("RELEASE lote_importacion")
+
+        for fila, valores in filas:
+            try:
+                self.conn.execute(sql, valores)
+                self.insertados += 1
+            except sqlite3.IntegrityError as exc:
+                self.error(fila, f"Restricción de la base de datos: {exc}")
+
+    def importar(self, registros) -> dict:
+        sql = {
+            "usuarios": "INSERT INTO usuarios (id_usuario, telefono, contrasena, es_admin) VALUES (?, ?, ?, ?)",
+            "mecanicos": "INSERT INTO mecanicos (id_mecanico, nombre, telefono) VALUES (?, ?, ?)",
+            "citas": "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado, id_mecanico) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        }[self.tipo]
+
+        numerados = list(enumerate(registros, start=1))
+        for inicio in range(0, len(numerados), IMPORTACION_LOTE):
+            lote = numerados[inicio:inicio + IMPORTACION_LOTE]
+            # Un lote = una transacción; la ocupación se lee con el bloqueo de
+            # escritura tomado, así que no puede cambiar antes del INSERT.
+            with transaccion_inmediata(self.conn):
+                ocupados = self._bloques_ocupados(lote) if self.tipo == "citas" else None
+                filas = []
+                for fila, registro in lote:
+                    if self.tipo == "usuarios":
+                        valores = self.validar_usuario(fila, registro)
+                    elif self.tipo == "mecanicos":
+                        valores = self.validar_mecanico(fila, registro)
+                    else:
+                        valores = self.validar_cita(fila, registro, ocupados)
+                    if valores:
+                        filas.append((fila, valores))
+                if filas:
+                    self._insertar(sql, filas)
+
+        return {
+            "tipo": self.tipo,
+            "recibidos": len(numerados),
+            "insertados": self.insertados,
+            "errores": self.errores,
+        }
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -335,8 +669,7 @@ def registro():
         return jsonify({"error": "La contraseña debe tener al menos 6 caracteres"}), 400
 
     
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    with get_db() as conn:
         cursor = conn.cursor()
         intentos = 0
         while True:
@@ -349,8 +682,7 @@ def registro():
                 return jsonify({"error": "No se pudo generar un ID único"}), 500
 
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute("PRAGMA foreign_keys = ON")
+        with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "INSERT INTO usuarios (id_usuario, telefono, contrasena, es_admin) VALUES (?, ?, ?, 0)",
@@ -367,9 +699,7 @@ def login():
     telefono = datos.get("telefono")
     contrasena = datos.get("contrasena")
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.row_factory = sqlite3.Row
+    with get_db() as conn:
         cursor = conn.cursor()
 
         cursor.execute(
@@ -425,32 +755,218 @@ def chatbot_view():
 
 @app.route("/admin")
 def admin_panel():
-    """Muestra todas las tablas si el usuario es administrador."""
+    """Muestra el panel de administración.
+
+    Usuarios, citas y mecánicos se cargan por páginas desde ``/admin/api/*``;
+    aquí solo se envía la lista de mecánicos para los selectores.
+    """
     if not session.get("es_admin"):
         return redirect(url_for("login_page"))
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT id_usuario, telefono, es_admin FROM usuarios")
-        usuarios = cursor.fetchall()
-        cursor.execute(
-            """
-            SELECT c.id_citas, c.id_usuario, u.telefono, c.servicio,
-                   c.fecha, c.hora, c.estado, c.id_mecanico,
-                   m.nombre AS nombre_mecanico
-            FROM citas AS c
-            JOIN usuarios AS u ON c.id_usuario = u.id_usuario
-            LEFT JOIN mecanicos AS m ON c.id_mecanico = m.id_mecanico
-            """
+    with get_db() as conn:
+        mecanicos = [
+            dict(fila)
+            for fila in conn.execute(
+                "SELECT id_mecanico, nombre, telefono FROM mecanicos ORDER BY nombre"
+            )
+        ]
+
+    return render_template("admin.html", mecanicos=mecanicos)
+
+
+API_LIMITE_DEFECTO = 25
+API_LIMITE_MAX = 200
+
+# Ordenamientos permitidos por recurso: (expresión SQL, clave en la fila).
+# La última columna es única para que el cursor identifique una sola fila.
+ORDENES_USUARIOS = {
+    "telefono": (("u.telefono", "telefono"),),
+    "id_usuario": (("u.id_usuario", "id_usuario"),),
+}
+ORDENES_CITAS = {
+    "fecha": (("c.fecha", "fecha"), ("c.hora", "hora"), ("c.id_citas", "id_citas")),
+    "servicio": (("c.servicio", "servicio"), ("c.id_citas", "id_citas")),
+    "estado": (("c.estado", "estado"), ("c.fecha", "fecha"), ("c.hora", "hora"), ("c.id_citas", "id_citas")),
+}
+ORDENES_MECANICOS = {
+    "nombre": (("m.nombre", "nombre"), ("m.id_mecanico", "id_mecanico")),
+    "id_mecanico": (("m.id_mecanico", "id_mecanico"),),
+}
+
+
+def codificar_cursor(valores) -> str:
+    return base64.urlsafe_b64encode(json.dumps(valores).encode("utf-8")).decode("ascii")
+
+
+def decodificar_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+
+def paginar_keyset(consulta: str, condiciones, parametros, orden, descendente: bool, cursor, limite: int):
+    """Ejecuta ``consulta`` paginando por *keyset* sobre las columnas de ``orden``.
+
+    En lugar de ``OFFSET`` se filtra por las filas posteriores a la última
+    entregada, así que pedir la página 1000 cuesta lo mismo que la primera.
+    Devuelve ``(filas, cursor_siguiente)``; el cursor es ``None`` al final.
+    """
+    condiciones = list(condiciones)
+    parametros = list(parametros)
+    if cursor:
+        valores = decodificar_cursor(cursor)
+        if not isinstance(valores, list) or len(valores) != len(orden):
+            raise ValueError("Cursor inválido")
+        columnas = ", ".join(expr for expr, _ in orden)
+        marcadores = ", ".join("?" for _ in orden)
+        comparador = "<" if descendente else ">"
+        condiciones.append(f"({columnas}) {comparador} ({marcadores})")
+        parametros.extend(valores)
+
+    sql = consulta
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    direccion = "DESC" if descendente else "ASC"
+    sql += " ORDER BY " + ", ".join(f"{expr} {direccion}" for expr, _ in orden)
+    sql += " LIMIT ?"
+    parametros.append(limite + 1)
+
+    filas = [dict(fila) for fila in get_db().execute(sql, parametros)]
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor([filas[-1][clave] for _, clave in orden])
+    return filas, siguiente
+
+
+def parametros_paginacion(ordenes, orden_defecto: str):
+    """Lee ``orden``, ``dir``, ``cursor`` y ``limite`` de la petición."""
+    orden = request.args.get("orden", orden_defecto)
+    if orden not in ordenes:
+        raise ValueError("Orden no permitido")
+    descendente = request.args.get("dir", "asc").lower() == "desc"
+    try:
+        limite = int(request.args.get("limite", API_LIMITE_DEFECTO))
+    except ValueError:
+        raise ValueError("Límite inválido")
+    limite = max(1, min(limite, API_LIMITE_MAX))
+    return ordenes[orden], descendente, request.args.get("cursor") or None, limite
+
+
+CONSULTA_CITAS_ADMIN = """
+    SELECT c.id_citas, c.id_usuario, u.telefono, c.servicio,
+           c.fecha, c.hora, c.estado, c.id_mecanico,
+           m.nombre AS nombre_mecanico
+    FROM citas AS c
+    JOIN usuarios AS u ON c.id_usuario = u.id_usuario
+    LEFT JOIN mecanicos AS m ON c.id_mecanico = m.id_mecanico
+"""
+# La exportación recorre también las citas archivadas.
+CONSULTA_CITAS_EXPORTACION = CONSULTA_CITAS_ADMIN.replace("FROM citas AS c", "FROM citas_todas AS c")
+COLUMNAS_EXPORTACION = (
+    "id_citas",
+    "id_usuario",
+    "telefono",
+    "servicio",
+    "fecha",
+    "hora",
+    "estado",
+    "id_mecanico",
+    "nombre_mecanico",
+)
+EXPORTACION_LOTE = 500
+
+
+def filtros_citas():
+    """Condiciones SQL para los filtros de citas recibidos en la query string."""
+    condiciones, parametros = [], []
+    desde = request.args.get("desde")
+    hasta = request.args.get("hasta")
+    estado = (request.args.get("estado") or "").strip().lower()
+    id_mecanico = request.args.get("id_mecanico")
+    servicio = (request.args.get("servicio") or "").strip()
+    busqueda = (request.args.get("q") or "").strip()
+    if desde:
+        condiciones.append("c.fecha >= ?")
+        parametros.append(desde)
+    if hasta:
+        condiciones.append("c.fecha <= ?")
+        parametros.append(hasta)
+    if estado:
+        condiciones.append("c.estado = ?")
+        parametros.append(estado)
+    if id_mecanico:
+        condiciones.append("c.id_mecanico = ?")
+        parametros.append(id_mecanico)
+    if servicio:
+        condiciones.append("c.servicio LIKE ?")
+        parametros.append(f"%{servicio}%")
+    if busqueda:
+        condiciones.append("(c.id_usuario LIKE ? OR CAST(u.telefono AS TEXT) LIKE ?)")
+        parametros.extend([f"%{busqueda}%", f"%{busqueda}%"])
+    return condiciones, parametros
+
+
+@app.route("/admin/api/usuarios")
+def admin_api_usuarios():
+    """Lista paginada de usuarios, con búsqueda por ID o teléfono (``q``)."""
+    if not session.get("es_admin"):
+        return jsonify({"error": "No autorizado"}), 401
+
+    condiciones, parametros = [], []
+    busqueda = (request.args.get("q") or "").strip()
+    if busqueda:
+        condiciones.append("(u.id_usuario LIKE ? OR CAST(u.telefono AS TEXT) LIKE ?)")
+        parametros.extend([f"{busqueda}%", f"{busqueda}%"])
+
+    try:
+        orden, descendente, cursor, limite = parametros_paginacion(ORDENES_USUARIOS, "telefono")
+        filas, siguiente = paginar_keyset(
+            "SELECT u.id_usuario, u.telefono, u.es_admin FROM usuarios AS u",
+            condiciones, parametros, orden, descendente, cursor, limite,
         )
-        citas = cursor.fetchall()
-        cursor.execute(
-            "SELECT id_mecanico, nombre, telefono FROM mecanicos"
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    return jsonify({"datos": filas, "siguiente": siguiente})
+
+
+@app.route("/admin/api/citas")
+def admin_api_citas():
+    """Lista paginada de citas con filtros de fecha, estado, mecánico y texto."""
+    if not session.get("es_admin"):
+        return jsonify({"error": "No autorizado"}), 401
+
+    condiciones, parametros = filtros_citas()
+    try:
+        orden, descendente, cursor, limite = parametros_paginacion(ORDENES_CITAS, "fecha")
+        filas, siguiente = paginar_keyset(
+            CONSULTA_CITAS_ADMIN,
+            condiciones, parametros, orden, descendente, cursor, limite,
+        )
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    return jsonify({"datos": filas, "siguiente": siguiente})
+
+
+@app.route("/admin/api/mecanicos")
+def admin_api_mecanicos():
+    """Lista paginada de mecánicos."""
+    if not session.get("es_admin"):
+        return jsonify({"error": "No autorizado"}), 401
+
+    try:
+        orden, descendente, cursor, limite = parametros_paginacion(ORDENES_MECANICOS, "nombre")
+        filas, siguiente = paginar_keyset(
+            "SELECT m.id_mecanico, m.nombre, m.telefono FROM mecanicos AS m",
+            [], [], orden, descendente, cursor, limite,
         )
-        mecanicos = cursor.fetchall()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
 
-    return render_template("admin.html", usuarios=usuarios, citas=citas, mecanicos=mecanicos)
+    return jsonify({"datos": filas, "siguiente": siguiente})
 
 
 @app.route("/admin/calendario")
@@ -477,7 +993,203 @@ def admin_calendario():
     if fecha_fin > max_rango:
         fecha_fin = max_rango
 
-    return jsonify(generar_eventos_disponibilidad(fecha_inicio, fecha_fin))
+    cuerpo, etag = eventos_calendario_serializados(fecha_inicio, fecha_fin)
+    resp = app.response_class(cuerpo, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
+
+
+def lotes_exportacion(condiciones, parametros):
+    """Recorre las citas filtradas en lotes de ``EXPORTACION_LOTE`` filas.
+
+    Usa su propia conexión del pool porque el generador sigue ejecutándose
+    después de que la vista retorna y se libera la conexión de la petición.
+    """
+    sql = CONSULTA_CITAS_EXPORTACION
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    sql += " ORDER BY c.fecha ASC, c.hora ASC, c.id_citas ASC"
+
+    conn = pool_db.adquirir()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, parametros)
+        while True:
+            lote = cursor.fetchmany(EXPORTACION_LOTE)
+            if not lote:
+                break
+            yield lote
+    finally:
+        cursor.close()
+        pool_db.liberar(conn)
+
+
+def exportar_csv(lotes):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUMNAS_EXPORTACION)
+    for lote in lotes:
+        escritor.writerows(lote)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def exportar_ndjson(lotes):
+    for lote in lotes:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNAS_EXPORTACION, fila)), ensure_ascii=False) + "\n"
+            for fila in lote
+        )
+
+
+@app.route("/admin/exportar_citas")
+def admin_exportar_citas():
+    """Exporta las citas filtradas como CSV o NDJSON, en streaming."""
+    if not session.get("es_admin"):
+        return jsonify({"error": "No autorizado"}), 401
+
+    formato = request.args.get("formato", "csv").lower()
+    if formato not in {"csv", "ndjson"}:
+        return jsonify({"error": "Formato no soportado. Use csv o ndjson."}), 400
+
+    condiciones, parametros = filtros_citas()
+    lotes = lotes_exportacion(condiciones, parametros)
+    if formato == "csv":
+        cuerpo, mimetype = exportar_csv(lotes), "text/csv"
+    else:
+        cuerpo, mimetype = exportar_ndjson(lotes), "application/x-ndjson"
+
+    resp = app.response_class(cuerpo, mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f"attachment; filename=citas.{formato}"
+    return resp
+
+
+@app.route("/admin/importar/<tipo>", methods=["POST"])
+def admin_importar(tipo):
+    """Importa usuarios, mecánicos o citas desde un archivo CSV o JSON."""
+    if not session.get("es_admin"):
+        return jsonify({"error": "No autorizado"}), 401
+    if tipo not in TIPOS_IMPORTACION:
+        return jsonify({"error": "Tipo de importación no válido"}), 404
+
+    archivo = request.files.get("archivo")
+    nombre = (archivo.filename or "") if archivo else ""
+    formato = request.args.get("formato") or (
+        "json" if nombre.lower().endswith(".json") or request.is_json else "csv"
+    )
+
+    try:
+        # Un archivo que no es UTF-8 da UnicodeDecodeError (un ValueError).
+        contenido = archivo.read().decode("utf-8-sig") if archivo else request.get_data(as_text=True)
+        registros = leer_registros(contenido, formato)
+    except ValueError as exc:
+        return jsonify({"error": f"No se pudo leer el archivo: {exc}"}), 400
+
+    resultado = ImportadorLotes(get_db(), tipo).importar(registros)
+    return jsonify(resultado), 200
+
+
+@app.cli.command("importar")
+@click.argument("tipo", type=click.Choice(TIPOS_IMPORTACION))
+@click.argument("archivo", type=click.Path(exists=True, dir_okay=False))
+def importar_cli(tipo, archivo):
+    """Importa TIPO (usuarios, mecanicos o citas) desde ARCHIVO (.csv o .json)."""
+    with open(archivo, encoding="utf-8-sig") as fh:
+        registros = leer_registros(fh.read(), "json" if archivo.lower().endswith(".json") else "csv")
+
+    inicio = perf_counter()
+    resultado = ImportadorLotes(get_db(), tipo).importar(registros)
+    duracion = perf_counter() - inicio
+
+    for error in resultado["errores"]:
+        click.echo(f"Fila {error['fila']}: {error['error']}", err=True)
+    click.echo(
+        f"{resultado['insertados']} de {resultado['recibidos']} {tipo} importados "
+        f"en {duracion:.2f} s ({resultado['recibidos'] / max(duracion, 1e-9):.0f} filas/s)"
+    )
+
+
+# --- Barrido de citas vencidas ---
+# Las citas confirmadas o reprogramadas cuya hora ya pasó se marcan como
+# completadas, así las consultas de disponibilidad, historial y el panel del
+# mecánico solo ven citas pendientes de verdad. Corre en un hilo del backend
+# cada BARRIDO_INTERVALO_S segundos (0 lo desactiva) o con ``flask barrer-citas``.
+BARRIDO_INTERVALO_S = float(os.environ.get("BARRIDO_INTERVALO_S", "900"))
+BARRIDO_LOTE = int(os.environ.get("BARRIDO_LOTE", "500"))
+BARRIDO_MARGEN_S = int(os.environ.get("BARRIDO_MARGEN_S", str(DURACION_BLOQUE_S)))
+
+
+def barrer_citas(conn) -> int:
+    """Una pasada del barrido, con sus métricas."""
+    inicio = perf_counter()
+    barridas = barrer_citas_vencidas(conn, margen_s=BARRIDO_MARGEN_S, lote=BARRIDO_LOTE)
+    metrica_barrido_duracion.observar(perf_counter() - inicio)
+    metrica_barrido_pasada.observar(barridas)
+    metrica_barrido.inc(barridas)
+    return barridas
+
+
+# Las citas canceladas o completadas de hace más de ARCHIVO_RETENCION_DIAS días
+# pasan a ``citas_archivo`` en la misma pasada (0 lo desactiva). El historial
+# del bot, ``/citas`` y la exportación leen la vista ``citas_todas``.
+ARCHIVO_RETENCION_DIAS = int(os.environ.get("ARCHIVO_RETENCION_DIAS", "365"))
+ARCHIVO_LOTE = int(os.environ.get("ARCHIVO_LOTE", "2000"))
+
+
+def archivar(conn, retencion_dias: int = None) -> int:
+    """Una pasada del archivado, con sus métricas."""
+    inicio = perf_counter()
+    archivadas = archivar_citas(
+        conn,
+        retencion_dias=ARCHIVO_RETENCION_DIAS if retencion_dias is None else retencion_dias,
+        lote=ARCHIVO_LOTE,
+    )
+    metrica_archivo_duracion.observar(perf_counter() - inicio)
+    metrica_archivo.inc(archivadas)
+    return archivadas
+
+
+def _bucle_barrido(parar: threading.Event) -> None:
+    while not parar.wait(BARRIDO_INTERVALO_S):
+        conn = pool_db.adquirir()
+        try:
+            barrer_citas(conn)
+            if ARCHIVO_RETENCION_DIAS > 0:
+                archivar(conn)
+        except Exception:
+            app.logger.exception("Falló el mantenimiento de citas")
+        finally:
+            pool_db.liberar(conn)
+
+
+def iniciar_barrido():
+    """Arranca el hilo del barrido; devuelve el evento que lo detiene."""
+    if BARRIDO_INTERVALO_S <= 0:
+        return None
+    parar = threading.Event()
+    threading.Thread(target=_bucle_barrido, args=(parar,), name="barrido-citas", daemon=True).start()
+    return parar
+
+
+@app.cli.command("barrer-citas")
+def barrer_citas_cli():
+    """Marca como completadas las citas pendientes cuya hora ya pasó."""
+    inicio = perf_counter()
+    barridas = barrer_citas(get_db())
+    click.echo(f"{barridas} citas vencidas marcadas como completadas en {perf_counter() - inicio:.2f} s")
+
+
+@app.cli.command("archivar-citas")
+@click.option("--retencion", type=int, default=None, help="días que las citas terminadas siguen en citas")
+def archivar_citas_cli(retencion):
+    """Mueve a citas_archivo las citas terminadas más antiguas que la retención."""
+    inicio = perf_counter()
+    archivadas = archivar(get_db(), retencion)
+    click.echo(f"{archivadas} citas archivadas en {perf_counter() - inicio:.2f} s")
 
 
 @app.route("/admin/agregar_usuario", methods=["POST"])
@@ -497,8 +1209,7 @@ def agregar_usuario_admin():
     if len(contrasena) < 6:
         return jsonify({"error": "La contraseña debe tener al menos 6 caracteres"}), 400
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    with get_db() as conn:
         cursor = conn.cursor()
 
         intentos = 0
@@ -540,9 +1251,7 @@ def actualizar_usuario_admin(id_usuario):
     if contrasena and len(contrasena) < 6:
         return jsonify({"error": "La contraseña debe tener al menos 6 caracteres"}), 400
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.row_factory = sqlite3.Row
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT es_admin FROM usuarios WHERE id_usuario = ?",
@@ -593,9 +1302,7 @@ def eliminar_usuario_admin(id_usuario):
     if id_usuario == session.get("id_usuario"):
         return jsonify({"error": "No puede eliminar su propio usuario"}), 400
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.row_factory = sqlite3.Row
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT es_admin FROM usuarios WHERE id_usuario = ?",
@@ -626,26 +1333,220 @@ def actualizar_cita(id_cita):
     servicio = request.form.get("servicio")
     fecha = request.form.get("fecha")
     hora = request.form.get("hora")
-    estado = request.form.get("estado")
+    estado = (request.form.get("estado") or "").strip().lower()
     id_mecanico = request.form.get("id_mecanico")
     hora_normalizada = normalizar_hora_admin(hora)
     if not hora_normalizada:
         return jsonify({"error": "Hora no permitida. Use: 08:00, 10:00, 12:00, 14:00, 16:00 o 18:00."}), 400
+    if estado not in ESTADOS_CITA:
+        return jsonify({"error": f"Estado inválido: {estado}"}), 400
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
-        cursor = conn.cursor()
-        if existe_conflicto_horario(cursor, fecha, hora_normalizada, excluir_id_cita=id_cita):
-            return jsonify({"error": "Ya existe una cita registrada en ese horario."}), 409
-
-        cursor.execute(
-            "UPDATE citas SET servicio = ?, fecha = ?, hora = ?, estado = ?, id_mecanico = ? WHERE id_citas = ?",
-            (servicio, fecha, hora_normalizada, estado, id_mecanico, id_cita),
-        )
-        conn.commit()
+    conn = get_db()
+    try:
+        with transaccion_inmediata(conn):
+            guardar_cita(
+                conn,
+                "UPDATE citas SET servicio = ?, fecha = ?, hora = ?, estado = ?, id_mecanico = ? WHERE id_citas = ?",
+                (servicio, fecha, hora_normalizada, estado, id_mecanico, id_cita),
+            )
+    except HorarioOcupadoError:
+        return jsonify({"error": "Ya existe una cita registrada en ese horario."}), 409
 
     return redirect(url_for("admin_panel"))
 
+CAMBIOS_LOTE_MAX = int(os.environ.get("CAMBIOS_LOTE_MAX", "500"))
+CAMPOS_CAMBIO_CITA = ("servicio", "fecha", "hora", "estado", "id_mecanico")
+
+
+def _en_trozos(valores, tamano=500):
+    for inicio in range(0, len(valores), tamano):
+        yield valores[inicio:inicio + tamano]
+
+
+def _escribir_cambios_citas(conn, aceptados) -> dict:
+    """Escribe los cambios ya resueltos; devuelve ``{id_citas: error}`` de los que fallan.
+
+    El índice único se comprueba fila a fila: primero se aparcan como
+    ``cancelada`` (un estado válido que no ocupa bloque) las citas que se
+    mueven, para que un intercambio de horarios no choque consigo mismo a
+    mitad del lote. Si alguna fila viola otra restricción (``NOT NULL``,
+    ``CHECK``, claves ajenas), no se escribe nada y se prueban una a una para
+    saber cuáles fallan.
+    """
+    sql = "UPDATE citas SET servicio = ?, fecha = ?, hora = ?, estado = ?, id_mecanico = ? WHERE id_citas = ?"
+    aparcadas = [(id_cita,) for id_cita in aceptados]
+    filas = [
+        (f["servicio"], f["fecha"], f["hora"], f["estado"], f["id_mecanico"], id_cita)
+        for id_cita, (_, f) in aceptados.items()
+    ]
+    conn.execute("SAVEPOINT cambios_citas")
+    try:
+        conn.executemany("UPDATE citas SET estado = 'cancelada' WHERE id_citas = ?", aparcadas)
+        guardar_cita(conn, sql, filas, muchos=True)
+        conn.execute("RELEASE cambios_citas")
+        return {}
+    except (sqlite3.IntegrityError, HorarioOcupadoError) as exc:
+        conn.execute("ROLLBACK TO cambios_citas")
+        error_lote = exc
+
+    errores = {}
+    try:
+        conn.executemany("UPDATE citas SET estado = 'cancelada' WHERE id_citas = ?", aparcadas)
+        for valores in filas:
+            try:
+                guardar_cita(conn, sql, valores)
+            except HorarioOcupadoError:
+                errores[valores[-1]] = "Ya existe una cita registrada en ese horario."
+            except sqlite3.IntegrityError as exc:
+                errores[valores[-1]] = f"Restricción de la base de datos: {exc}"
+    finally:
+        conn.execute("ROLLBACK TO cambios_citas")
+        conn.execute("RELEASE cambios_citas")
+    if not errores:
+        raise error_lote
+    return errores
+
+
+def aplicar_cambios_citas(conn, cambios):
+    """Aplica una lista de cambios de citas dentro de la transacción abierta.
+
+    Cada cambio es un diccionario con ``id_citas`` y los campos a modificar.
+    Los conflictos de horario se resuelven en memoria contra el conjunto de
+    bloques ocupados, considerando el lote completo: dos citas pueden
+    intercambiar horarios y una cita puede ocupar el bloque que otra libera.
+    Devuelve una lista de resultados en el mismo orden que ``cambios``.
+    """
+    resultados = [{"id_citas": c.get("id_citas") if isinstance(c, dict) else None} for c in cambios]
+    ids = [r["id_citas"] for r in resultados if r["id_citas"]]
+    actuales = {}
+    for trozo in _en_trozos(ids):
+        marcadores = ", ".join("?" for _ in trozo)
+        for fila in conn.execute(
+            f"SELECT id_citas, servicio, fecha, hora, estado, id_mecanico FROM citas WHERE id_citas IN ({marcadores})",
+            trozo,
+        ):
+            actuales[fila["id_citas"]] = dict(fila)
+    mecanicos = {m for (m,) in conn.execute("SELECT id_mecanico FROM mecanicos")}
+
+    finales = {}
+    for posicion, cambio in enumerate(cambios):
+        resultado = resultados[posicion]
+        if not isinstance(cambio, dict) or not cambio.get("id_citas"):
+            resultado.update(ok=False, error="Falta id_citas")
+            continue
+        id_cita = cambio["id_citas"]
+        if id_cita in finales:
+            resultado.update(ok=False, error="Cita repetida en el lote")
+            continue
+        actual = actuales.get(id_cita)
+        if actual is None:
+            resultado.update(ok=False, error="Cita no encontrada")
+            continue
+
+        final = dict(actual)
+        final.update({campo: cambio[campo] for campo in CAMPOS_CAMBIO_CITA if campo in cambio})
+        final["estado"] = str(final["estado"] or "").strip().lower()
+        final["id_mecanico"] = final["id_mecanico"] or None
+        hora = normalizar_hora_admin(str(final["hora"] or ""))
+        try:
+            datetime.strptime(str(final["fecha"]), "%Y-%m-%d")
+        except ValueError:
+            resultado.update(ok=False, error="Fecha inválida; use AAAA-MM-DD")
+            continue
+        if not hora:
+            resultado.update(ok=False, error="Hora no permitida. Use: 08:00, 10:00, 12:00, 14:00, 16:00 o 18:00.")
+            continue
+        if final["estado"] not in ESTADOS_CITA:
+            resultado.update(ok=False, error=f"Estado inválido: {final['estado']}")
+            continue
+        if final["id_mecanico"] and final["id_mecanico"] not in mecanicos:
+            resultado.update(ok=False, error="Mecánico no encontrado")
+            continue
+        final["hora"] = hora
+        finales[id_cita] = (posicion, final)
+
+    def bloque(cita):
+        return (cita["fecha"], cita["hora"]) if cita["estado"] in ESTADOS_ACTIVOS else None
+
+    # Bloques ocupados por citas que no forman parte del lote.
+    fechas = [c["fecha"] for c in actuales.values()] + [f["fecha"] for _, f in finales.values()]
+    ocupados_fijos = set()
+    if fechas:
+        marcadores = ", ".join("?" for _ in ESTADOS_ACTIVOS)
+        for fila in conn.execute(
+            f"SELECT id_citas, fecha, hora FROM citas WHERE fecha BETWEEN ? AND ? AND estado IN ({marcadores})",
+            (min(fechas), max(fechas), *ESTADOS_ACTIVOS),
+        ):
+            if fila["id_citas"] not in finales:
+                ocupados_fijos.add((fila["fecha"], fila["hora"]))
+
+    # Un cambio rechazado conserva su bloque original, lo que puede dejar sin
+    # sitio a otro cambio; se repite hasta que el conjunto aceptado es estable.
+    # Los cambios que la base rechaza al escribir (``fallidos``) también
+    # conservan su bloque, así que se vuelve a resolver sin ellos.
+    fallidos = set()
+    while True:
+        aceptados = {id_cita: dato for id_cita, dato in finales.items() if id_cita not in fallidos}
+        while True:
+            ocupados = set(ocupados_fijos)
+            for id_cita in finales.keys() - aceptados.keys():
+                original = bloque(actuales[id_cita])
+                if original:
+                    ocupados.add(original)
+            rechazados = []
+            for id_cita, (_, final) in sorted(aceptados.items(), key=lambda item: item[1][0]):
+                nuevo = bloque(final)
+                if nuevo is None:
+                    continue
+                if nuevo in ocupados:
+                    rechazados.append(id_cita)
+                else:
+                    ocupados.add(nuevo)
+            if not rechazados:
+                break
+            for id_cita in rechazados:
+                posicion, _ = aceptados.pop(id_cita)
+                resultados[posicion].update(ok=False, error="Ya existe una cita registrada en ese horario.")
+
+        if not aceptados:
+            break
+        errores = _escribir_cambios_citas(conn, aceptados)
+        if not errores:
+            for posicion, _ in aceptados.values():
+                resultados[posicion]["ok"] = True
+            break
+        for id_cita, error in errores.items():
+            fallidos.add(id_cita)
+            resultados[finales[id_cita][0]].update(ok=False, error=error)
+
+    return resultados
+
+
+@app.route("/admin/citas/lote", methods=["POST"])
+def actualizar_citas_lote():
+    """Actualiza varias citas (estado, mecánico, fecha/hora) en una sola transacción."""
+    if not session.get("es_admin"):
+        return jsonify({"error": "No autorizado"}), 401
+
+    datos = request.get_json(silent=True) or {}
+    cambios = datos.get("cambios") if isinstance(datos, dict) else None
+    if not isinstance(cambios, list) or not cambios:
+        return jsonify({"error": "Envíe una lista 'cambios' con al menos un elemento"}), 400
+    if len(cambios) > CAMBIOS_LOTE_MAX:
+        return jsonify({"error": f"Máximo {CAMBIOS_LOTE_MAX} cambios por lote"}), 400
+
+    conn = get_db()
+    try:
+        with transaccion_inmediata(conn):
+            resultados = aplicar_cambios_citas(conn, cambios)
+    except HorarioOcupadoError:
+        return jsonify({"error": "Ya existe una cita registrada en ese horario."}), 409
+
+    return jsonify({
+        "actualizadas": sum(1 for r in resultados if r.get("ok")),
+        "resultados": resultados,
+    }), 200
+
 @app.route("/admin/agregar_cita", methods=["POST"])
 def agregar_cita():
     """Agregar una nueva cita desde el panel de administración."""
@@ -656,24 +1557,25 @@ def agregar_cita():
     servicio = request.form.get("servicio")
     fecha = request.form.get("fecha")
     hora = request.form.get("hora")
-    estado = request.form.get("estado") or "confirmada"
+    estado = (request.form.get("estado") or "confirmada").strip().lower()
     id_mecanico = request.form.get("id_mecanico")
     hora_normalizada = normalizar_hora_admin(hora)
     if not hora_normalizada:
         return jsonify({"error": "Hora no permitida. Use: 08:00, 10:00, 12:00, 14:00, 16:00 o 18:00."}), 400
+    if estado not in ESTADOS_CITA:
+        return jsonify({"error": f"Estado inválido: {estado}"}), 400
 
     id_cita = generar_id_aleatorio()
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
-        cursor = conn.cursor()
-        if existe_conflicto_horario(cursor, fecha, hora_normalizada):
-            return jsonify({"error": "Ya existe una cita registrada en ese horario."}), 409
-
-        cursor.execute(
-            "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado, id_mecanico) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (id_cita, id_usuario, servicio, fecha, hora_normalizada, estado, id_mecanico),
-        )
-        conn.commit()
+    conn = get_db()
+    try:
+        with transaccion_inmediata(conn):
+            guardar_cita(
+                conn,
+                "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado, id_mecanico) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (id_cita, id_usuario, servicio, fecha, hora_normalizada, estado, id_mecanico),
+            )
+    except HorarioOcupadoError:
+        return jsonify({"error": "Ya existe una cita registrada en ese horario."}), 409
 
     return redirect(url_for("admin_panel"))
 
@@ -683,8 +1585,7 @@ def eliminar_cita(id_cita):
     if not session.get("es_admin"):
         return redirect(url_for("login_page"))
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "DELETE FROM citas WHERE id_citas = ?",
@@ -706,8 +1607,7 @@ def agregar_mecanico():
         return redirect(url_for("admin_panel"))
 
     id_mecanico = generar_id_aleatorio()
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO mecanicos (id_mecanico, nombre, telefono) VALUES (?, ?, ?)",
@@ -725,8 +1625,7 @@ def actualizar_mecanico(id_mecanico):
 
     nombre = request.form.get("nombre")
     telefono = request.form.get("telefono")
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE mecanicos SET nombre = ?, telefono = ? WHERE id_mecanico = ?",
@@ -742,8 +1641,7 @@ def eliminar_mecanico(id_mecanico):
     if not session.get("es_admin"):
         return redirect(url_for("login_page"))
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "DELETE FROM mecanicos WHERE id_mecanico = ?",
@@ -762,9 +1660,7 @@ def mecanico_panel():
             return jsonify({"ok": False, "message": "No autorizado."}), 401
         return redirect(url_for("login_page"))
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.row_factory = sqlite3.Row
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT nombre FROM mecanicos WHERE id_mecanico = ?",
@@ -838,8 +1734,7 @@ def mecanico_actualizar_estado(id_cita):
             return jsonify({"ok": False, "message": "Estado inválido."}), 400
         return redirect(url_for("mecanico_panel"))
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT 1 FROM citas WHERE id_citas = ? AND id_mecanico = ?",
@@ -850,11 +1745,17 @@ def mecanico_actualizar_estado(id_cita):
                 return jsonify({"ok": False, "message": "Cita no encontrada."}), 404
             return redirect(url_for("mecanico_panel"))
 
-        cursor.execute(
-            "UPDATE citas SET estado = ? WHERE id_citas = ?",
-            (nuevo_estado, id_cita),
-        )
-        conn.commit()
+        try:
+            with transaccion_inmediata(conn):
+                guardar_cita(
+                    conn,
+                    "UPDATE citas SET estado = ? WHERE id_citas = ?",
+                    (nuevo_estado, id_cita),
+                )
+        except HorarioOcupadoError:
+            if request.is_json:
+                return jsonify({"ok": False, "message": "Ya existe otra cita activa en ese horario."}), 409
+            return redirect(url_for("mecanico_panel"))
 
     mensaje_exito = f"El estado de la cita se actualizó a '{nuevo_estado.capitalize()}'."
 
@@ -876,6 +1777,45 @@ def mecanico_actualizar_estado(id_cita):
     return redirect(url_for("mecanico_panel"))
 
 
+@app.route("/admin/estadisticas_db")
+def admin_estadisticas_db():
+    """Estadísticas del pool de conexiones y del índice de disponibilidad."""
+    if not session.get("es_admin"):
+        return jsonify({"error": "No autorizado"}), 401
+    return jsonify(
+        {
+            "pool": pool_db.estadisticas(),
+            "disponibilidad": indice_disponibilidad.estadisticas(),
+            "rasa": cliente_rasa.estadisticas(),
+        }
+    )
+
+
+@app.route("/admin/perfil_consultas")
+def admin_perfil_consultas():
+    """Informe del perfilador de consultas, si está activo."""
+    if not session.get("es_admin"):
+        return jsonify({"error": "No autorizado"}), 401
+    if perfil_consultas is None:
+        return jsonify({"error": "El perfilador está desactivado (PERFIL_CONSULTAS=1)"}), 404
+    return jsonify(perfil_consultas.informe())
+
+
+@app.route("/metrics")
+def exponer_metricas():
+    """Métricas en formato Prometheus (sesión de administrador o ``METRICAS_TOKEN``)."""
+    autorizacion = request.headers.get("Authorization", "")
+    token_valido = bool(METRICAS_TOKEN) and hmac.compare_digest(
+        autorizacion.encode(), f"Bearer {METRICAS_TOKEN}".encode()
+    )
+    if not (session.get("es_admin") or token_valido):
+        return jsonify({"error": "No autorizado"}), 401
+
+    for dato, valor in pool_db.estadisticas().items():
+        metrica_pool.set(valor, dato=dato)
+    return app.response_class(REGISTRO.exponer(), content_type=CONTENT_TYPE)
+
+
 @app.route("/logout")
 def logout():
     session.pop("id_usuario", None)
@@ -886,15 +1826,51 @@ def logout():
 
 @app.route("/historial", methods=["GET"])
 def historial():
-    """Return chat history for the authenticated user."""
+    """Return chat history for the authenticated user.
+
+    Lee los mensajes de ``tracker.db`` y los envía en streaming, en orden
+    cronológico. ``limit`` fija cuántos (por defecto ``HISTORIAL_LIMITE``),
+    ``before=<id>`` pide los anteriores a un mensaje ya mostrado y
+    ``since=<id>`` solo los nuevos desde el último recibido.
+    """
     id_usuario = session.get("id_usuario")
     if not id_usuario:
         # If the user is not logged in, return empty history with 401 status
         return jsonify([]), 401
 
+    try:
+        antes_de, desde = (
+            int(request.args[nombre]) if request.args.get(nombre) else None
+            for nombre in ("before", "since")
+        )
+        limite = int(request.args.get("limit", HISTORIAL_LIMITE))
+    except ValueError:
+        return jsonify({"error": "Parámetros de paginación inválidos"}), 400
+    limite = max(1, min(limite, HISTORIAL_LIMITE_MAX))
+
+    if lector_historial.disponible():
+        try:
+            mensajes = lector_historial.mensajes(id_usuario, limite, antes_de, desde)
+        except sqlite3.Error:
+            mensajes = None
+        if mensajes is not None:
+            resp = app.response_class(historial_json(mensajes), mimetype="application/json")
+            resp.headers["X-Historial-Origen"] = "tracker_db"
+            return resp
+
     history = obtener_historial(id_usuario)
     return jsonify(history)
 
+
+@app.route("/historial/invalidar", methods=["POST"])
+def invalidar_historial():
+    """El chat avisa de que el usuario envió un mensaje: su historial cambió."""
+    id_usuario = session.get("id_usuario")
+    if not id_usuario:
+        return jsonify({"error": "No autorizado"}), 401
+    cliente_rasa.invalidar(id_usuario)
+    return "", 204
+
 @app.route("/citas")
 def citas():
     """Devolver todas las citas del usuario autenticado."""
@@ -905,4 +1881,5 @@ def citas():
 
 if __name__ == "__main__":
     crear_bd()
+    iniciar_barrido()
     app.run(debug=True, port=8000)
\ No newline at end of file
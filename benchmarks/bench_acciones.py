@@ -0,0 +1,196 @@
+"""Conversaciones simultáneas contra las acciones de Rasa.
+
+Simula ``--conversaciones`` clientes que, a la vez y en el mismo bucle de
+eventos (como ocurre en el servidor de acciones), validan una fecha y una hora,
+agendan una cita, consultan la próxima, piden el historial y cancelan. Cada
+configuración de ``ACCIONES_HILOS`` se ejecuta en un proceso nuevo sobre una
+copia de la misma base sintética; ``0`` reproduce el comportamiento anterior,
+con todo el trabajo bloqueante dentro del bucle::
+
+    python benchmarks/bench_acciones.py --conversaciones 100 --hilos 0 4 8 16
+
+Para cada configuración muestra conversaciones por segundo, latencias p50/p95
+de cada acción y el mayor retraso observado en el bucle de eventos.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Fechas tal como las escriben los clientes; las dos últimas pasan por dateparser.
+FECHAS = ("mañana", "el viernes", "20 de noviembre", "15/12", "dentro de 3 días", "la próxima semana")
+HORAS = ("a las 10", "14:00", "8 am", "cuatro de la tarde")
+
+
+class _Tracker:
+    """Lo mínimo de ``rasa_sdk.Tracker`` que usan las acciones."""
+
+    def __init__(self, sender_id: str, slots: dict):
+        self.sender_id = sender_id
+        self.slots = slots
+        self.events = []
+        self.latest_message = {"text": ""}
+
+    def get_slot(self, nombre):
+        return self.slots.get(nombre)
+
+
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def preparar_bd(ruta: str, usuarios: int, citas: int, semilla: int) -> None:
+    from bench_backend import poblar_bd
+    from database import ESQUEMA_CITAS, aplicar_migraciones
+
+    with sqlite3.connect(ruta) as conn:
+        conn.execute(
+            "CREATE TABLE usuarios (id_usuario TEXT PRIMARY KEY, telefono INTEGER UNIQUE NOT NULL, "
+            "contrasena TEXT NOT NULL, es_admin INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "CREATE TABLE mecanicos (id_mecanico TEXT PRIMARY KEY, nombre TEXT NOT NULL, "
+            "telefono INTEGER UNIQUE NOT NULL)"
+        )
+        conn.execute(ESQUEMA_CITAS)
+        aplicar_migraciones(conn)
+        poblar_bd(conn, usuarios, citas, 10, semilla)
+
+
+async def conversacion(actions, dispatcher_cls, indice: int, usuarios: int, tiempos: dict) -> None:
+    rnd = random.Random(indice)
+    slots = {}
+    tracker = _Tracker(f"u{rnd.randrange(usuarios):07d}", slots)
+
+    async def medir(nombre, corrutina):
+        inicio = time.perf_counter()
+        resultado = await corrutina
+        tiempos.setdefault(nombre, []).append(time.perf_counter() - inicio)
+        return resultado
+
+    formulario = actions.ValidateAgendarCitaForm()
+    slots.update(await medir(
+        "validate_fecha",
+        formulario.validate_fecha(rnd.choice(FECHAS), dispatcher_cls(), tracker, {}),
+    ))
+    slots.update(await medir(
+        "validate_hora",
+        formulario.validate_hora(rnd.choice(HORAS), dispatcher_cls(), tracker, {}),
+    ))
+    # Fechas lejanas para que las reservas de la simulación casi nunca choquen.
+    slots["servicio"] = "cambio de aceite"
+    slots["fecha"] = (date.today() + timedelta(days=400 + rnd.randrange(3650))).isoformat()
+    slots["hora"] = rnd.choice(sorted(actions.HORARIOS_PERMITIDOS))
+    await medir("agendar", actions.ActionAgendarCita().run(dispatcher_cls(), tracker, {}))
+    await medir("consultar", actions.ActionConsultarCita().run(dispatcher_cls(), tracker, {}))
+    await medir("historial", actions.ActionMostrarHistorial().run(dispatcher_cls(), tracker, {}))
+    await medir("cancelar", actions.ActionCancelarCita().run(dispatcher_cls(), tracker, {}))
+
+
+async def vigilar_bucle(intervalo: float, retrasos: list, fin: asyncio.Event) -> None:
+    """Mide cuánto tarda el bucle en despertar a una tarea que duerme ``intervalo``."""
+    while not fin.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        retrasos.append(time.perf_counter() - inicio - intervalo)
+
+
+async def simular(conversaciones: int, usuarios: int) -> dict:
+    from actions import actions
+    from rasa_sdk.executor import CollectingDispatcher
+
+    # dateparser y la caché de disponibilidad ya calientes, como en producción.
+    actions.parse_fecha_es("dentro de 3 días")
+    actions.obtener_horarios_disponibles(date.today().isoformat())
+
+    tiempos, retrasos, fin = {}, [], asyncio.Event()
+    vigilante = asyncio.create_task(vigilar_bucle(0.005, retrasos, fin))
+    inicio = time.perf_counter()
+    await asyncio.gather(*(
+        conversacion(actions, CollectingDispatcher, i, usuarios, tiempos)
+        for i in range(conversaciones)
+    ))
+    total = time.perf_counter() - inicio
+    fin.set()
+    await vigilante
+    return {
+        "total_s": round(total, 3),
+        "conversaciones_s": round(conversaciones / total, 1),
+        "retraso_bucle_max_ms": round(max(retrasos, default=0) * 1000, 1),
+        "acciones": {
+            nombre: {
+                "p50_ms": round(statistics.median(valores) * 1000, 2),
+                "p95_ms": round(percentil(valores, 95) * 1000, 2),
+            }
+            for nombre, valores in tiempos.items()
+        },
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--conversaciones", type=int, default=100)
+    parser.add_argument("--hilos", type=int, nargs="+", default=[0, 8],
+                        help="valores de ACCIONES_HILOS a comparar")
+    parser.add_argument("--usuarios", type=int, default=10000)
+    parser.add_argument("--citas", type=int, default=200000)
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--hijo", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.hijo:
+        print(json.dumps(asyncio.run(simular(args.conversaciones, args.usuarios))))
+        return 0
+
+    base = os.path.join(tempfile.gettempdir(), f"bench_acciones_{args.usuarios}_{args.citas}.db")
+    if not os.path.exists(base):
+        inicio = time.perf_counter()
+        preparar_bd(base, args.usuarios, args.citas, args.semilla)
+        print(f"Base sintética creada en {time.perf_counter() - inicio:.1f} s: {base}")
+
+    for hilos in args.hilos:
+        # Cada configuración parte de la misma base: agendar y cancelar la modifican.
+        copia = f"{base}.{hilos}.db"
+        shutil.copyfile(base, copia)
+        salida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--hijo",
+             "--conversaciones", str(args.conversaciones), "--usuarios", str(args.usuarios)],
+            cwd=RAIZ,
+            env={**os.environ, "USUARIOS_DB": copia, "ACCIONES_HILOS": str(hilos),
+                 "ACCIONES_PRECALENTAR": "0"},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        os.remove(copia)
+        for sufijo in ("-wal", "-shm"):
+            if os.path.exists(copia + sufijo):
+                os.remove(copia + sufijo)
+        datos = json.loads(salida.stdout.strip().splitlines()[-1])
+        print(
+            f"ACCIONES_HILOS={hilos:<3} {datos['conversaciones_s']:7.1f} conversaciones/s | "
+            f"total {datos['total_s']:6.2f} s | retraso máximo del bucle {datos['retraso_bucle_max_ms']:7.1f} ms"
+        )
+        for nombre, lat in datos["acciones"].items():
+            print(f"    {nombre:<15} p50 {lat['p50_ms']:8.2f} ms   p95 {lat['p95_ms']:8.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
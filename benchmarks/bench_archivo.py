@@ -0,0 +1,147 @@
+"""Latencia de las consultas frecuentes según los años de historial.
+
+Para cada valor de ``--anios`` genera una base sintética con el mismo volumen
+diario (``--citas-dia``) y los próximos días reservados, mide las consultas
+que se ejecutan en cada conversación o en cada carga de panel, archiva las
+citas terminadas con más de ``--retencion`` días y las vuelve a medir::
+
+    python benchmarks/bench_archivo.py --anios 1 3 10 --citas-dia 100 --retencion 90
+
+Sin archivo, las consultas que recorren todas las citas de un mecánico crecen
+con el historial; con archivo deberían mantenerse planas.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_backend import DIAS_FUTUROS, HORARIOS, poblar_bd  # noqa: E402
+from database import ESQUEMA_CITAS, abrir_conexion, aplicar_migraciones, archivar_citas  # noqa: E402
+
+# Las mismas sentencias que usan el backend y las acciones.
+CONSULTAS = {
+    "panel_mecanico": (
+        """
+        SELECT c.id_citas, c.fecha, c.hora, c.estado, u.telefono, c.servicio
+        FROM citas AS c JOIN usuarios AS u ON c.id_usuario = u.id_usuario
+        WHERE c.id_mecanico = ?
+        ORDER BY c.fecha ASC, c.hora ASC
+        """,
+        lambda rnd, args: (f"m{rnd.randrange(args.mecanicos):04d}",),
+    ),
+    "calendario_mes": (
+        """
+        SELECT c.id_citas, c.servicio, c.fecha, c.hora, c.estado, u.telefono
+        FROM citas AS c JOIN usuarios AS u ON u.id_usuario = c.id_usuario
+        WHERE c.fecha BETWEEN ? AND ?
+        ORDER BY c.fecha ASC, c.hora ASC
+        """,
+        lambda rnd, args: (
+            (date.today() - timedelta(days=15)).isoformat(),
+            (date.today() + timedelta(days=15)).isoformat(),
+        ),
+    ),
+    "proxima_cita": (
+        """
+        SELECT id_citas, servicio, fecha, hora FROM citas
+        WHERE id_usuario = ? AND estado IN ('confirmada','reprogramada') AND inicio_ts >= ?
+        ORDER BY inicio_ts ASC LIMIT 1
+        """,
+        lambda rnd, args: (f"u{rnd.randrange(args.usuarios):07d}", int(time.time())),
+    ),
+    "historial": (
+        """
+        SELECT servicio, fecha, hora FROM citas_todas
+        WHERE id_usuario = ? AND estado IN ('confirmada','reprogramada','completada') AND inicio_ts < ?
+        ORDER BY inicio_ts DESC LIMIT 20
+        """,
+        lambda rnd, args: (f"u{rnd.randrange(args.usuarios):07d}", int(time.time())),
+    ),
+}
+
+
+def preparar_bd(ruta: str, args, dias: int) -> None:
+    with sqlite3.connect(ruta) as conn:
+        conn.execute(
+            "CREATE TABLE usuarios (id_usuario TEXT PRIMARY KEY, telefono INTEGER UNIQUE NOT NULL, "
+            "contrasena TEXT NOT NULL, es_admin INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "CREATE TABLE mecanicos (id_mecanico TEXT PRIMARY KEY, nombre TEXT NOT NULL, "
+            "telefono INTEGER UNIQUE NOT NULL)"
+        )
+        conn.execute(ESQUEMA_CITAS)
+        aplicar_migraciones(conn)
+        poblar_bd(
+            conn, args.usuarios, DIAS_FUTUROS * len(HORARIOS) + dias * args.citas_dia, args.mecanicos,
+            args.semilla, dias_pasados=dias,
+        )
+
+
+def medir(conn, args) -> dict:
+    resultados = {}
+    for nombre, (sql, parametros) in CONSULTAS.items():
+        rnd = random.Random(args.semilla)
+        tiempos = []
+        for _ in range(args.repeticiones):
+            valores = parametros(rnd, args)
+            inicio = time.perf_counter()
+            conn.execute(sql, valores).fetchall()
+            tiempos.append(time.perf_counter() - inicio)
+        resultados[nombre] = statistics.median(tiempos) * 1000
+    return resultados
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--anios", type=int, nargs="+", default=[1, 3, 10])
+    parser.add_argument("--citas-dia", type=int, default=100)
+    parser.add_argument("--usuarios", type=int, default=10000)
+    parser.add_argument("--mecanicos", type=int, default=50)
+    parser.add_argument("--retencion", type=int, default=90, help="días de citas terminadas en la tabla caliente")
+    parser.add_argument("--repeticiones", type=int, default=50)
+    parser.add_argument("--semilla", type=int, default=1234)
+    args = parser.parse_args(argv)
+
+    print(f"{'años':>5} {'citas':>9} {'consulta':<16} {'sin archivo':>12} {'con archivo':>12}")
+    for anios in args.anios:
+        ruta = os.path.join(tempfile.gettempdir(), f"bench_archivo_{anios}.db")
+        for sufijo in ("", "-wal", "-shm"):
+            if os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+        preparar_bd(ruta, args, anios * 365)
+
+        conn = abrir_conexion(ruta)
+        citas = conn.execute("SELECT COUNT(*) FROM citas").fetchone()[0]
+        antes = medir(conn, args)
+        inicio = time.perf_counter()
+        archivadas = archivar_citas(conn, retencion_dias=args.retencion)
+        duracion = time.perf_counter() - inicio
+        conn.execute("ANALYZE")
+        despues = medir(conn, args)
+        calientes = conn.execute("SELECT COUNT(*) FROM citas").fetchone()[0]
+        conn.close()
+
+        for nombre in CONSULTAS:
+            print(f"{anios:>5} {citas:>9} {nombre:<16} {antes[nombre]:9.3f} ms {despues[nombre]:9.3f} ms")
+        print(
+            f"{'':>15} {archivadas} citas archivadas en {duracion:.1f} s; "
+            f"quedan {calientes} en la tabla citas"
+        )
+        for sufijo in ("", "-wal", "-shm"):
+            if os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
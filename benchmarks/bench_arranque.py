@@ -0,0 +1,95 @@
+"""Arranque en frío del servidor de acciones.
+
+Lanza varios procesos nuevos que importan ``actions/actions.py`` y ejecutan la
+validación de una fecha, y muestra la mediana del tiempo de importación y de la
+primera acción (una fecha común y otra que necesita dateparser). Se comparan
+dos escenarios: con el precalentamiento en segundo plano y sin él::
+
+    python benchmarks/bench_arranque.py --procesos 7
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Tracker:
+    """Lo mínimo de ``rasa_sdk.Tracker`` que usan los validadores."""
+
+    sender_id = "benchmark"
+
+    def get_slot(self, nombre):
+        return None
+
+
+def hijo(espera: float) -> dict:
+    """Se ejecuta en el proceso nuevo y devuelve sus tiempos en ms."""
+    import asyncio
+
+    inicio = time.perf_counter()
+    from actions import actions
+    from rasa_sdk.executor import CollectingDispatcher
+
+    importacion = time.perf_counter() - inicio
+    if espera:
+        # Simula el tiempo que pasa hasta que llega la primera conversación.
+        time.sleep(espera)
+
+    validador = actions.ValidateAgendarCitaForm()
+    tiempos = {"importacion_ms": importacion * 1000}
+    for clave, texto in (("fecha_comun_ms", "20 de noviembre"), ("fecha_dateparser_ms", "dentro de 3 días")):
+        inicio = time.perf_counter()
+        asyncio.run(validador.validate_fecha(texto, CollectingDispatcher(), _Tracker(), {}))
+        tiempos[clave] = (time.perf_counter() - inicio) * 1000
+    return tiempos
+
+
+def lanzar(procesos: int, entorno: dict, espera: float) -> dict:
+    muestras = []
+    for _ in range(procesos):
+        salida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--hijo", "--espera", str(espera)],
+            cwd=RAIZ,
+            env={**os.environ, **entorno},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        muestras.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+    return {clave: round(statistics.median(m[clave] for m in muestras), 2) for clave in muestras[0]}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--procesos", type=int, default=5)
+    parser.add_argument("--espera", type=float, default=3.0,
+                        help="segundos entre el arranque y la primera acción")
+    parser.add_argument("--hijo", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.hijo:
+        sys.path.insert(0, RAIZ)
+        print(json.dumps(hijo(args.espera)))
+        return 0
+
+    escenarios = {
+        "sin precalentar": {"ACCIONES_PRECALENTAR": "0"},
+        "precalentando": {"ACCIONES_PRECALENTAR": "1"},
+    }
+    for nombre, entorno in escenarios.items():
+        tiempos = lanzar(args.procesos, entorno, args.espera)
+        print(
+            f"{nombre:<16} importación {tiempos['importacion_ms']:8.1f} ms | "
+            f"primera fecha común {tiempos['fecha_comun_ms']:7.1f} ms | "
+            f"primera fecha con dateparser {tiempos['fecha_dateparser_ms']:8.1f} ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+"""Benchmark de carga sintética para las rutas HTTP del backend.
+
+Construye una ``usuarios.db`` sintética del tamaño indicado, la carga en el
+backend (vía ``USUARIOS_DB``) y ejercita las rutas con el cliente de pruebas de
+Flask desde varios hilos concurrentes. Para cada ruta informa throughput y
+latencias p50/p95/p99, y guarda el resultado en JSON para comparar commits::
+
+    python benchmarks/bench_backend.py --usuarios 10000 --citas 500000 --mecanicos 50
+    python benchmarks/bench_backend.py --reusar --comparar benchmarks/resultados/anterior.json
+
+La base se genera una sola vez por tamaño (``--reusar`` evita regenerarla). Las
+rutas que modifican datos trabajan sobre fechas lejanas o citas pasadas, de
+modo que no alteran el reparto de la agenda entre ejecuciones.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HORARIOS = ("08:00", "10:00", "12:00", "14:00", "16:00", "18:00")
+SERVICIOS = ("mantenimiento", "cambio de aceite", "frenos", "diagnostico", "alineacion")
+CONTRASENA = "clave123"
+TELEFONO_BASE_USUARIOS = 60000000
+TELEFONO_BASE_MECANICOS = 70000000
+ADMIN_TELEFONO = "99999999"
+ADMIN_CONTRASENA = "admin123"
+DIAS_FUTUROS = 90
+DIAS_PASADOS = 730
+
+
+def _hash(texto: str) -> str:
+    return hashlib.sha256(texto.encode()).hexdigest()
+
+
+# --- Datos sintéticos ---
+
+def poblar_bd(
+    conn: sqlite3.Connection,
+    usuarios: int,
+    citas: int,
+    mecanicos: int,
+    semilla: int,
+    dias_pasados: int = DIAS_PASADOS,
+) -> None:
+    """Inserta usuarios, mecánicos y citas respetando el índice de bloques activos.
+
+    Los próximos ``DIAS_FUTUROS`` días quedan completamente reservados (citas
+    activas, una por bloque); el resto son citas completadas o canceladas de
+    los últimos ``dias_pasados`` días, repartidas de forma uniforme.
+    """
+    rnd = random.Random(semilla)
+    hoy = date.today()
+    clave = _hash(CONTRASENA)
+
+    conn.executemany(
+        "INSERT INTO usuarios (id_usuario, telefono, contrasena, es_admin) VALUES (?, ?, ?, 0)",
+        ((f"u{i:07d}", TELEFONO_BASE_USUARIOS + i, clave) for i in range(usuarios)),
+    )
+    conn.executemany(
+        "INSERT INTO mecanicos (id_mecanico, nombre, telefono) VALUES (?, ?, ?)",
+        ((f"m{i:04d}", f"Mecanico {i}", TELEFONO_BASE_MECANICOS + i) for i in range(mecanicos)),
+    )
+
+    def generar():
+        n = 0
+        futuras = min(citas, DIAS_FUTUROS * len(HORARIOS))
+        for dia in range(DIAS_FUTUROS):
+            for hora in HORARIOS:
+                if n >= futuras:
+                    return
+                fecha = (hoy + timedelta(days=dia + 1)).isoformat()
+                estado = "reprogramada" if rnd.random() < 0.1 else "confirmada"
+                yield n, fecha, hora, estado
+                n += 1
+        por_bloque = max(1, math.ceil((citas - n) / (dias_pasados * len(HORARIOS))))
+        for dia in range(dias_pasados):
+            fecha = (hoy - timedelta(days=dia + 1)).isoformat()
+            for hora in HORARIOS:
+                for _ in range(por_bloque):
+                    if n >= citas:
+                        return
+                    estado = "cancelada" if rnd.random() < 0.15 else "completada"
+                    yield n, fecha, hora, estado
+                    n += 1
+
+    conn.executemany(
+        "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado, id_mecanico) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                f"c{n:08d}",
+                f"u{rnd.randrange(usuarios):07d}",
+                rnd.choice(SERVICIOS),
+                fecha,
+                hora,
+                estado,
+                f"m{rnd.randrange(mecanicos):04d}" if mecanicos and rnd.random() < 0.9 else None,
+            )
+            for n, fecha, hora, estado in generar()
+        ),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+
+
+# --- Escenarios ---
+
+class Escenarios:
+    """Peticiones de cada ruta; devuelven ``True`` si el código es el esperado."""
+
+    def __init__(self, app, args, ids_citas_pasadas):
+        self.app = app
+        self.args = args
+        self.ids_citas_pasadas = ids_citas_pasadas
+        self._local = threading.local()
+
+    def _cliente(self, rol: str):
+        """Un cliente con sesión por hilo y por rol, autenticado una sola vez."""
+        clientes = self._local.__dict__.setdefault("clientes", {})
+        if rol not in clientes:
+            cliente = self.app.test_client()
+            rnd = self._rnd()
+            if rol == "admin":
+                datos = {"telefono": ADMIN_TELEFONO, "contrasena": ADMIN_CONTRASENA}
+            elif rol == "mecanico":
+                i = rnd.randrange(self.args.mecanicos)
+                datos = {"telefono": str(TELEFONO_BASE_MECANICOS + i), "contrasena": f"Mecanico {i}"}
+            else:
+                i = rnd.randrange(self.args.usuarios)
+                datos = {"telefono": str(TELEFONO_BASE_USUARIOS + i), "contrasena": CONTRASENA}
+            respuesta = cliente.post("/login", json=datos)
+            if respuesta.status_code != 302:
+                raise RuntimeError(f"No se pudo iniciar sesión como {rol}: {respuesta.status_code}")
+            clientes[rol] = cliente
+        return clientes[rol]
+
+    def _rnd(self) -> random.Random:
+        if not hasattr(self._local, "rnd"):
+            self._local.rnd = random.Random(self.args.semilla + threading.get_ident())
+        return self._local.rnd
+
+    def login(self):
+        i = self._rnd().randrange(self.args.usuarios)
+        respuesta = self.app.test_client().post(
+            "/login", json={"telefono": str(TELEFONO_BASE_USUARIOS + i), "contrasena": CONTRASENA}
+        )
+        return respuesta.status_code == 302
+
+    def citas(self):
+        return self._cliente("usuario").get("/citas").status_code == 200
+
+    def admin(self):
+        return self._cliente("admin").get("/admin").status_code == 200
+
+    def admin_api_citas(self):
+        respuesta = self._cliente("admin").get("/admin/api/citas?limite=25&orden=fecha&dir=desc")
+        return respuesta.status_code == 200
+
+    def admin_calendario(self):
+        inicio = date.today().replace(day=1) + timedelta(days=31 * self._rnd().randrange(3))
+        fin = inicio + timedelta(days=42)
+        respuesta = self._cliente("admin").get(
+            f"/admin/calendario?start={inicio.isoformat()}&end={fin.isoformat()}"
+        )
+        return respuesta.status_code == 200
+
+    def mecanico(self):
+        return self._cliente("mecanico").get("/mecanico").status_code == 200
+
+    def agregar_cita(self):
+        rnd = self._rnd()
+        # Fechas lejanas: la mayoría de bloques están libres, algunos chocan (409).
+        fecha = date.today() + timedelta(days=365 + rnd.randrange(3650))
+        respuesta = self._cliente("admin").post("/admin/agregar_cita", data={
+            "id_usuario": f"u{rnd.randrange(self.args.usuarios):07d}",
+            "servicio": rnd.choice(SERVICIOS),
+            "fecha": fecha.isoformat(),
+            "hora": rnd.choice(HORARIOS),
+            "estado": "confirmada",
+            "id_mecanico": "",
+        })
+        return respuesta.status_code in (302, 409)
+
+    def actualizar_cita(self):
+        rnd = self._rnd()
+        id_cita, fecha, hora, estado, id_mecanico = rnd.choice(self.ids_citas_pasadas)
+        respuesta = self._cliente("admin").post(f"/admin/actualizar_cita/{id_cita}", data={
+            "servicio": rnd.choice(SERVICIOS),
+            "fecha": fecha,
+            "hora": hora,
+            "estado": estado,
+            "id_mecanico": id_mecanico or "",
+        })
+        return respuesta.status_code == 302
+
+    def citas_lote(self):
+        rnd = self._rnd()
+        cambios = [
+            {"id_citas": id_cita, "servicio": rnd.choice(SERVICIOS)}
+            for id_cita, *_ in rnd.sample(self.ids_citas_pasadas, 10)
+        ]
+        respuesta = self._cliente("admin").post("/admin/citas/lote", json={"cambios": cambios})
+        return respuesta.status_code == 200
+
+    def mecanico_estado(self):
+        rnd = self._rnd()
+        id_cita = rnd.choice(self.ids_citas_pasadas)[0]
+        # Cambio sobre una cita pasada: si no es del mecánico, la ruta responde 404.
+        respuesta = self._cliente("mecanico").post(
+            f"/mecanico/cita/{id_cita}/estado", json={"estado": "completada"}
+        )
+        return respuesta.status_code in (200, 404)
+
+
+RUTAS = (
+    "login",
+    "citas",
+    "admin",
+    "admin_api_citas",
+    "admin_calendario",
+    "mecanico",
+    "agregar_cita",
+    "actualizar_cita",
+    "citas_lote",
+    "mecanico_estado",
+)
+
+
+# --- Medición ---
+
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    k = (len(valores) - 1) * p / 100
+    inferior, superior = math.floor(k), math.ceil(k)
+    if inferior == superior:
+        return valores[int(k)]
+    return valores[inferior] + (valores[superior] - valores[inferior]) * (k - inferior)
+
+
+def medir_ruta(escenario, peticiones: int, clientes: int) -> dict:
+    latencias = []
+    fallos = [0]
+    lock = threading.Lock()
+
+    def trabajador(cantidad: int):
+        propias = []
+        errores = 0
+        for _ in range(cantidad):
+            inicio = time.perf_counter()
+            try:
+                correcto = escenario()
+            except Exception:
+                correcto = False
+            propias.append(time.perf_counter() - inicio)
+            errores += not correcto
+        with lock:
+            latencias.extend(propias)
+            fallos[0] += errores
+
+    reparto = [peticiones // clientes + (i < peticiones % clientes) for i in range(clientes)]
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clientes) as pool:
+        list(pool.map(trabajador, reparto))
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    ms = [v * 1000 for v in latencias]
+    return {
+        "peticiones": len(latencias),
+        "errores": fallos[0],
+        "duracion_s": round(duracion, 3),
+        "rps": round(len(latencias) / duracion, 1) if duracion else 0.0,
+        "media_ms": round(statistics.fmean(ms), 3) if ms else 0.0,
+        "p50_ms": round(percentil(ms, 50), 3),
+        "p95_ms": round(percentil(ms, 95), 3),
+        "p99_ms": round(percentil(ms, 99), 3),
+        "max_ms": round(ms[-1], 3) if ms else 0.0,
+    }
+
+
+def commit_actual() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def imprimir(resultados: dict, anterior: dict = None) -> None:
+    print(f"{'ruta':<18}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}")
+    for ruta, datos in resultados["rutas"].items():
+        linea = (
+            f"{ruta:<18}{datos['rps']:>9.1f}{datos['p50_ms']:>10.2f}"
+            f"{datos['p95_ms']:>10.2f}{datos['p99_ms']:>10.2f}{datos['errores']:>9}"
+        )
+        previo = (anterior or {}).get("rutas", {}).get(ruta)
+        if previo and previo["p95_ms"]:
+            cambio = (datos["p95_ms"] - previo["p95_ms"]) / previo["p95_ms"] * 100
+            linea += f"   p95 {cambio:+.1f}% vs {anterior.get('commit', '?')}"
+        print(linea)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--usuarios", type=int, default=10000)
+    parser.add_argument("--citas", type=int, default=500000)
+    parser.add_argument("--mecanicos", type=int, default=50)
+    parser.add_argument("--clientes", type=int, default=8, help="hilos concurrentes por ruta")
+    parser.add_argument("--peticiones", type=int, default=500, help="peticiones por ruta")
+    parser.add_argument("--rutas", nargs="+", choices=RUTAS, default=list(RUTAS))
+    parser.add_argument("--db", help="ruta de la base sintética (por defecto, en el directorio temporal)")
+    parser.add_argument("--reusar", action="store_true", help="no regenerar la base si ya existe")
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para mostrar la diferencia")
+    args = parser.parse_args(argv)
+
+    db = args.db or os.path.join(
+        tempfile.gettempdir(), f"bench_usuarios_{args.usuarios}_{args.citas}_{args.mecanicos}.db"
+    )
+    regenerar = not (args.reusar and os.path.exists(db))
+    if regenerar:
+        for sufijo in ("", "-wal", "-shm"):
+            if os.path.exists(db + sufijo):
+                os.remove(db + sufijo)
+
+    # El backend lee la configuración al importarse.
+    os.environ["USUARIOS_DB"] = db
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ["ADMIN_PHONE"] = ADMIN_TELEFONO
+    os.environ["ADMIN_PASS"] = ADMIN_CONTRASENA
+    sys.path.insert(0, RAIZ)
+    import backend
+
+    backend.crear_bd()
+    if regenerar:
+        inicio = time.perf_counter()
+        with sqlite3.connect(db) as conn:
+            poblar_bd(conn, args.usuarios, args.citas, args.mecanicos, args.semilla)
+        print(f"Base sintética creada en {time.perf_counter() - inicio:.1f} s: {db}")
+
+    with sqlite3.connect(db) as conn:
+        ids_citas_pasadas = conn.execute(
+            "SELECT id_citas, fecha, hora, estado, id_mecanico FROM citas "
+            "WHERE fecha < ? ORDER BY random() LIMIT 2000",
+            (date.today().isoformat(),),
+        ).fetchall()
+
+    backend.app.config["TESTING"] = True
+    escenarios = Escenarios(backend.app, args, ids_citas_pasadas)
+    resultados = {
+        "commit": commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "parametros": {
+            "usuarios": args.usuarios,
+            "citas": args.citas,
+            "mecanicos": args.mecanicos,
+            "clientes": args.clientes,
+            "peticiones": args.peticiones,
+        },
+        "rutas": {},
+    }
+    for ruta in args.rutas:
+        escenario = getattr(escenarios, ruta)
+        # Calentamiento: sesiones, caché de plantillas e índices en memoria.
+        for _ in range(min(5, args.peticiones)):
+            escenario()
+        resultados["rutas"][ruta] = medir_ruta(escenario, args.peticiones, args.clientes)
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as fh:
+            anterior = json.load(fh)
+    imprimir(resultados, anterior)
+
+    salida = args.salida or os.path.join(
+        RAIZ, "benchmarks", "resultados",
+        f"backend-{resultados['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json",
+    )
+    os.makedirs(os.path.dirname(salida), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as fh:
+        json.dump(resultados, fh, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Un remitente ruidoso frente a muchos normales, con y sin ``ControlMensajes``.
+
+Simula el servidor de Rasa como un recurso de ``--capacidad`` mensajes a la vez
+que tarda ``--coste-ms`` en contestar cada uno. ``--normales`` remitentes
+envían ``--mensajes`` mensajes, uno por segundo, mientras otro envía
+``--spam`` mensajes seguidos. Sin control, cada mensaje va directo a Rasa (lo
+que hacía ``handle_message``); con control, pasa por
+``control_mensajes.ControlMensajes`` con cada política::
+
+    python benchmarks/bench_control_mensajes.py --normales 50 --spam 2000
+
+Muestra la latencia de las respuestas de los remitentes normales, cuántos
+mensajes del ruidoso llegan a Rasa y cuántos avisos recibe.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+class SalidaFalsa:
+    def __init__(self):
+        self.avisos = 0
+
+    async def send_text_message(self, recipient_id: str, text: str, **kwargs) -> None:
+        self.avisos += 1
+
+
+class MensajeFalso:
+    def __init__(self, texto: str, sender_id: str, salida: SalidaFalsa):
+        self.text = texto
+        self.sender_id = sender_id
+        self.output_channel = salida
+        self.llegada = time.perf_counter()
+
+
+async def simular(politica, args) -> dict:
+    from control_mensajes import ControlMensajes
+
+    rasa = asyncio.Semaphore(args.capacidad)
+    salida = SalidaFalsa()
+    latencias, procesados_spam, pendientes = [], [0], set()
+
+    async def on_new_message(mensaje) -> None:
+        async with rasa:
+            await asyncio.sleep(args.coste_ms / 1000)
+        if mensaje.sender_id == "ruidoso":
+            procesados_spam[0] += 1
+        else:
+            latencias.append(time.perf_counter() - mensaje.llegada)
+
+    if politica is None:
+        async def entrar(mensaje) -> None:
+            await on_new_message(mensaje)
+    else:
+        control = ControlMensajes(politica=politica, concurrencia_max=args.capacidad * 2)
+
+        async def entrar(mensaje) -> None:
+            await control.recibir(mensaje, on_new_message)
+
+    def llega(mensaje) -> None:
+        # python-socketio lanza cada evento en su propia tarea.
+        tarea = asyncio.ensure_future(entrar(mensaje))
+        pendientes.add(tarea)
+        tarea.add_done_callback(pendientes.discard)
+
+    async def normal(i: int) -> None:
+        await asyncio.sleep(i / args.normales)
+        for n in range(args.mensajes):
+            llega(MensajeFalso(f"hola {n}", f"u{i}", salida))
+            await asyncio.sleep(1)
+
+    async def ruidoso() -> None:
+        for n in range(args.spam):
+            llega(MensajeFalso(f"spam {n}", "ruidoso", salida))
+            if n % 50 == 49:
+                await asyncio.sleep(0.05)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(ruidoso(), *(normal(i) for i in range(args.normales)))
+    esperados = args.normales * args.mensajes
+    while len(latencias) < esperados or pendientes:
+        await asyncio.sleep(0.01)
+    return {
+        "p50_ms": statistics.median(latencias) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+        "max_ms": max(latencias) * 1000,
+        "spam_procesados": procesados_spam[0],
+        "avisos": salida.avisos,
+        "duracion_s": time.perf_counter() - inicio,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--normales", type=int, default=50)
+    parser.add_argument("--mensajes", type=int, default=5, help="mensajes de cada remitente normal")
+    parser.add_argument("--spam", type=int, default=2000, help="mensajes del remitente ruidoso")
+    parser.add_argument("--capacidad", type=int, default=8, help="mensajes que Rasa procesa a la vez")
+    parser.add_argument("--coste-ms", type=float, default=20)
+    parser.add_argument("--politicas", nargs="+", default=["sin_control", "descartar", "fusionar", "avisar"])
+    args = parser.parse_args(argv)
+
+    for nombre in args.politicas:
+        datos = asyncio.run(simular(None if nombre == "sin_control" else nombre, args))
+        print(
+            f"{nombre:<12} normales p50 {datos['p50_ms']:8.1f} ms  p95 {datos['p95_ms']:8.1f} ms  "
+            f"máx {datos['max_ms']:8.1f} ms | ruidoso: {datos['spam_procesados']:5d}/{args.spam} a Rasa, "
+            f"{datos['avisos']} avisos | {datos['duracion_s']:.1f} s"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Tasa de acierto y coste de ``parse_fecha_es`` frente a dateparser.
+
+Recorre un corpus de fechas tal como las escriben los clientes y muestra qué
+fracción resuelve la vía rápida, el coste medio por llamada con y sin ella, y
+las entradas en las que la vía rápida y dateparser no coinciden::
+
+    python benchmarks/bench_fecha.py --repeticiones 5
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CORPUS = [
+    "hoy", "mañana", "manana", "Mañana", "pasado mañana", "el lunes", "lunes",
+    "el martes", "este miércoles", "el jueves", "el viernes", "viernes",
+    "el próximo viernes", "el sábado", "sabado", "el lunes que viene",
+    "el viernes por la tarde", "15/11", "20/11", "3/12", "01/12/2026", "5-12",
+    "15/11/25", "20 de noviembre", "20 noviembre", "1 de diciembre",
+    "el 5 de diciembre", "20 de noviembre de 2026", "7 de enero", "20 nov",
+    "viernes 20 de noviembre", "el 20", "el día 25", "2026-11-20", "2026/12/01",
+    # Cola larga: la resuelve (o no) dateparser.
+    "mañana a las 10", "la próxima semana", "dentro de 3 días", "en dos semanas",
+    "fin de mes", "noviembre 20", "el 20 del mes que viene", "next friday",
+]
+
+
+def medir(funcion, entradas, repeticiones: int) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for entrada in entradas:
+            funcion(entrada)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor / len(entradas) * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    from actions import actions
+
+    def solo_dateparser(texto):
+        parsed = actions.parse(
+            texto,
+            languages=["es"],
+            settings={
+                "TIMEZONE": actions.TZ.key,
+                "PREFER_DATES_FROM": "future",
+                "RELATIVE_BASE": datetime.now(actions.TZ),
+            },
+        )
+        return parsed.date() if parsed else None
+
+    hoy = datetime.now(actions.TZ).date()
+    distintas = []
+    for texto in CORPUS:
+        rapida = actions.reconocer_fecha_es(texto, hoy)
+        if rapida is not None:
+            esperada = solo_dateparser(texto)
+            if esperada != rapida:
+                distintas.append((texto, rapida, esperada))
+
+    for clave in actions.ESTADISTICAS_FECHA:
+        actions.ESTADISTICAS_FECHA[clave] = 0
+    for texto in CORPUS:
+        actions.parse_fecha_es(texto)
+    estadisticas = dict(actions.ESTADISTICAS_FECHA)
+    total = sum(estadisticas.values())
+
+    antes = medir(solo_dateparser, CORPUS, args.repeticiones)
+    ahora = medir(actions.parse_fecha_es, CORPUS, args.repeticiones)
+    print(
+        f"Corpus: {total} entradas | vía rápida {estadisticas['rapida']} "
+        f"({estadisticas['rapida'] / total:.0%}), dateparser {estadisticas['dateparser']}, "
+        f"sin reconocer {estadisticas['sin_reconocer']}"
+    )
+    print(f"Solo dateparser: {antes:9.1f} µs/llamada")
+    print(f"parse_fecha_es:  {ahora:9.1f} µs/llamada ({antes / ahora:.1f}x)")
+    if distintas:
+        print("Entradas en las que la vía rápida y dateparser difieren:")
+        for texto, rapida, esperada in distintas:
+            print(f"  {texto!r}: vía rápida={rapida} dateparser={esperada}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Equivalencia y microbenchmark de ``parse_hora_es``.
+
+Compara la implementación actual de ``actions/actions.py`` con la original
+(``parse_hora_referencia.py``) sobre un corpus de horas escritas por clientes
+más combinaciones generadas, y mide el coste por llamada::
+
+    python benchmarks/bench_hora.py
+    python benchmarks/bench_hora.py --generadas 50000 --repeticiones 5
+
+Termina con código 1 si alguna entrada da un resultado distinto.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Lo que escriben los clientes en el formulario de la cita.
+CORPUS_REAL = [
+    "8", "08:00", "10", "10:00", "12", "12:00", "14:00", "16:00", "18:00",
+    "a las 8", "a las 10", "a las 2", "a las 4 de la tarde", "a las 6 pm",
+    "8 am", "8am", "10 a.m.", "2 p.m.", "4 p.m", "6pm", "14 hrs", "16 horas",
+    "18hs", "8h", "10h00", "14 h 00", "las ocho", "a las diez", "doce",
+    "dos de la tarde", "cuatro de la tarde", "seis de la tarde", "a las seis",
+    "mediodía", "mediodia", "al medio dia", "ocho y media", "diez y cuarto",
+    "cuarto para las diez", "2 y media", "a las 8 de la mañana", "por la tarde a las 4",
+    "10 de la mañana", "8:30", "las 2 pm", "A LAS 10", "  16:00  ", "18 h",
+]
+
+PIEZAS = [
+    "8", "08", "10", "12", "14", "16", "18", "6", "4", "2", "13", "25", "8:00",
+    "10:30", "14:15", "8:75", "8h", "8 h 30", "14hs", "16 horas", "a las", "la",
+    "de la tarde", "de la mañana", "de la noche", "pm", "am", "p.m.", "a.m.",
+    "y media", "y cuarto", "cuarto para las", "mediodía", "medianoche", "ocho",
+    "diez", "doce", "dos", "cuatro", "seis", "dieciséis", "dieciocho", "una",
+    "tarde", "noche", "madrugada", "hora", ",", ".", "  ", "​",
+]
+
+
+def construir_corpus(generadas: int, semilla: int):
+    rnd = random.Random(semilla)
+    corpus = set(CORPUS_REAL) | set(PIEZAS)
+    for a, b in itertools.product(PIEZAS, repeat=2):
+        corpus.add(f"{a} {b}")
+    while len(corpus) < len(CORPUS_REAL) + generadas:
+        corpus.add(" ".join(rnd.choice(PIEZAS) for _ in range(rnd.randint(1, 4))))
+    return sorted(corpus)
+
+
+def medir(funcion, entradas, repeticiones: int, antes=None) -> float:
+    """Mejor tiempo por llamada (µs) entre ``repeticiones`` pasadas."""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        if antes:
+            antes()
+        inicio = time.perf_counter()
+        for entrada in entradas:
+            funcion(entrada)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor / len(entradas) * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--generadas", type=int, default=20000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    from actions import actions
+    from parse_hora_referencia import parse_hora_es as referencia
+
+    corpus = construir_corpus(args.generadas, args.semilla)
+    diferencias = [
+        (entrada, esperado, obtenido)
+        for entrada in corpus
+        if (esperado := referencia(entrada)) != (obtenido := actions.parse_hora_es(entrada))
+    ]
+    print(f"Equivalencia: {len(corpus)} entradas, {len(diferencias)} diferencias")
+    for entrada, esperado, obtenido in diferencias[:20]:
+        print(f"  {entrada!r}: referencia={esperado} actual={obtenido}")
+
+    limpiar = actions._parse_hora_normalizada.cache_clear
+    for nombre, entradas in (("corpus real", CORPUS_REAL), ("corpus completo", corpus)):
+        antes = medir(referencia, entradas, args.repeticiones)
+        frio = medir(actions.parse_hora_es, entradas, args.repeticiones, antes=limpiar)
+        caliente = medir(actions.parse_hora_es, entradas, args.repeticiones)
+        print(
+            f"{nombre:<16} referencia {antes:8.2f} µs/llamada | "
+            f"actual sin caché {frio:8.2f} µs ({antes / frio:4.1f}x) | "
+            f"con caché {caliente:6.2f} µs ({antes / caliente:5.1f}x)"
+        )
+    return 1 if diferencias else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
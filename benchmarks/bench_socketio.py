@@ -0,0 +1,211 @@
+"""Varios nodos del canal ``custom_socketio`` compartiendo salas.
+
+Arranca ``--nodos`` procesos con el blueprint de ``channels.CustomSocketIOInput``
+sobre Sanic (en lugar de Rasa, cada mensaje se contesta con un eco a través del
+mismo ``CustomSocketIOOutput``) y un proceso cliente por nodo. Cada conversación
+abre dos sockets con el mismo ``session_id``: el que envía los mensajes se
+conecta a un nodo y el que espera las respuestas al siguiente, así que toda
+respuesta tiene que cruzar de un nodo a otro por el ``client_manager``::
+
+    python benchmarks/bench_socketio.py --nodos 1 2 4 --conversaciones 200 --mensajes 5
+    python benchmarks/bench_socketio.py --manager redis://localhost:6379/0
+    python benchmarks/bench_socketio.py --nodos 2 --manager ""   # sin manager: se pierden
+
+Con ``local://`` (por defecto) el relé de ``AsyncLocalSocketManager`` vive en el
+primer nodo. Muestra sockets conectados, respuestas entregadas al otro nodo,
+mensajes por segundo y la latencia de ida y vuelta.
+
+Lo que comprueba es la entrega entre nodos: con un gestor compartido llegan
+todas las respuestas, y sin él ninguna. No demuestra que el throughput crezca
+con los nodos. Todos los procesos corren en la misma máquina, así que los
+mensajes por segundo solo sirven para comparar nodos si hay al menos un núcleo
+libre por nodo y por cliente. Con menos núcleos, más nodos reparten la misma CPU
+y el throughput baja por el salto extra del relé.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+PUERTO_BASE = 5105
+
+
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def nodo(puerto: int, manager: str) -> None:
+    """Proceso servidor: el canal real, con un eco en lugar del procesador de Rasa."""
+    import logging
+
+    from sanic import Sanic
+
+    from channels import CustomSocketIOInput
+
+    logging.getLogger("channels").setLevel(logging.WARNING)
+    canal = CustomSocketIOInput.from_credentials(
+        {
+            "user_message_evt": "user_uttered",
+            "bot_message_evt": "bot_uttered",
+            "session_persistence": True,
+            "socketio_path": "/socket.io",
+            "client_manager": manager,
+        }
+    )
+
+    async def on_new_message(message) -> None:
+        await message.output_channel.send_text_message(message.sender_id, f"eco {message.text}")
+
+    app = Sanic(f"nodo_{puerto}")
+    app.blueprint(canal.blueprint(on_new_message), url_prefix=canal.url_prefix())
+    app.run(host="127.0.0.1", port=puerto, access_log=False, debug=False)
+
+
+async def clientes(puertos, indice: int, conversaciones: int, mensajes: int) -> dict:
+    """Proceso cliente: ``conversaciones`` pares emisor/receptor en nodos distintos."""
+    import socketio
+
+    origen = f"http://127.0.0.1:{puertos[indice]}"
+    destino = f"http://127.0.0.1:{puertos[(indice + 1) % len(puertos)]}"
+    pendientes = {}
+    latencias = []
+    resultado = {"conectados": 0, "enviados": 0, "recibidos": 0, "errores": 0}
+
+    async def conversacion(numero: int) -> None:
+        session_id = f"n{indice}c{numero}"
+        emisor, receptor = socketio.AsyncClient(), socketio.AsyncClient()
+
+        @receptor.on("bot_uttered")
+        async def respuesta(data) -> None:
+            futuro = pendientes.pop(data.get("text", "")[len("eco "):], None)
+            if futuro is not None and not futuro.done():
+                futuro.set_result(time.perf_counter())
+
+        try:
+            await receptor.connect(f"{destino}?session_id={session_id}", transports=["websocket"])
+            await emisor.connect(f"{origen}?session_id={session_id}", transports=["websocket"])
+            resultado["conectados"] += 2
+            for i in range(mensajes):
+                texto = f"{session_id}-{i}"
+                futuro = asyncio.get_running_loop().create_future()
+                pendientes[texto] = futuro
+                inicio = time.perf_counter()
+                await emisor.emit("user_uttered", {"message": texto})
+                resultado["enviados"] += 1
+                try:
+                    latencias.append(await asyncio.wait_for(futuro, 10) - inicio)
+                    resultado["recibidos"] += 1
+                except asyncio.TimeoutError:
+                    pendientes.pop(texto, None)
+        except Exception:
+            resultado["errores"] += 1
+        finally:
+            await emisor.disconnect()
+            await receptor.disconnect()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(conversacion(n) for n in range(conversaciones)))
+    resultado["duracion_s"] = time.perf_counter() - inicio
+    resultado["latencias"] = latencias
+    return resultado
+
+
+def esperar_puerto(puerto: int, limite_s: float = 30) -> None:
+    import socket
+
+    fin = time.monotonic() + limite_s
+    while time.monotonic() < fin:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", puerto)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"El nodo del puerto {puerto} no arrancó")
+
+
+def medir(nodos: int, args) -> dict:
+    puertos = [PUERTO_BASE + i for i in range(nodos)]
+    script = os.path.abspath(__file__)
+    servidores = [
+        subprocess.Popen(
+            [sys.executable, script, "--nodo", str(puerto), "--manager", args.manager],
+            cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for puerto in puertos
+    ]
+    try:
+        for puerto in puertos:
+            esperar_puerto(puerto)
+        por_nodo = max(1, args.conversaciones // nodos)
+        procesos = [
+            subprocess.Popen(
+                [sys.executable, script, "--cliente", str(i), "--puertos", *map(str, puertos),
+                 "--conversaciones", str(por_nodo), "--mensajes", str(args.mensajes)],
+                cwd=RAIZ, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+            )
+            for i in range(nodos)
+        ]
+        datos = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in procesos]
+    finally:
+        for servidor in servidores:
+            servidor.terminate()
+        for servidor in servidores:
+            servidor.wait()
+
+    latencias = [valor for d in datos for valor in d["latencias"]]
+    duracion = max(d["duracion_s"] for d in datos)
+    recibidos = sum(d["recibidos"] for d in datos)
+    return {
+        "conectados": sum(d["conectados"] for d in datos),
+        "enviados": sum(d["enviados"] for d in datos),
+        "recibidos": recibidos,
+        "errores": sum(d["errores"] for d in datos),
+        "mensajes_s": recibidos / duracion if duracion else 0.0,
+        "p50_ms": statistics.median(latencias) * 1000 if latencias else 0.0,
+        "p95_ms": percentil(latencias, 95) * 1000,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--nodos", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--conversaciones", type=int, default=200, help="en total, repartidas entre los nodos")
+    parser.add_argument("--mensajes", type=int, default=5)
+    parser.add_argument("--manager", default="local://127.0.0.1:6390")
+    parser.add_argument("--nodo", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--cliente", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--puertos", type=int, nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.nodo is not None:
+        nodo(args.nodo, args.manager)
+        return 0
+    if args.cliente is not None:
+        datos = asyncio.run(clientes(args.puertos, args.cliente, args.conversaciones, args.mensajes))
+        print(json.dumps(datos))
+        return 0
+
+    print(f"{os.cpu_count()} núcleos; client_manager {args.manager or 'ninguno'}")
+    for nodos in args.nodos:
+        datos = medir(nodos, args)
+        print(
+            f"{nodos} nodo(s): {datos['conectados']:5d} sockets | "
+            f"{datos['recibidos']}/{datos['enviados']} respuestas entregadas"
+            f"{' (de un nodo a otro)' if nodos > 1 else ''} | "
+            f"{datos['mensajes_s']:7.1f} mensajes/s | p50 {datos['p50_ms']:6.1f} ms  p95 {datos['p95_ms']:6.1f} ms"
+            + (f" | {datos['errores']} conversaciones con error" if datos["errores"] else "")
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
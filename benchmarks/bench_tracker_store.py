@@ -0,0 +1,137 @@
+"""Conversaciones simultáneas contra el tracker store.
+
+Simula ``--conversaciones`` clientes que, a la vez y en el mismo bucle de
+eventos (como el servidor de Rasa), repiten ``--turnos`` veces lo que hace Rasa
+con cada mensaje: recuperar el tracker, añadir el mensaje del usuario, la
+acción y la respuesta del bot, y guardarlo. Compara el ``SQLTrackerStore`` de
+Rasa con ``tracker_store.TrackerStoreSQLite``, cada uno sobre un ``tracker.db``
+nuevo y con ``--historial`` turnos previos por conversación::
+
+    python benchmarks/bench_tracker_store.py --conversaciones 100 300 --turnos 5
+
+Necesita Rasa instalado (se carga ``domain.yml`` del proyecto). Muestra turnos
+por segundo, latencias p50/p95 de ``retrieve`` y ``save`` y el mayor retraso
+observado en el bucle de eventos.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def crear_store(nombre: str, ruta: str, domain):
+    if nombre == "SQLTrackerStore":
+        from rasa.core.tracker_store import SQLTrackerStore
+
+        return SQLTrackerStore(domain, dialect="sqlite", db=ruta)
+    from tracker_store import TrackerStoreSQLite
+
+    return TrackerStoreSQLite(domain, db=ruta)
+
+
+def turno(tracker, texto: str) -> None:
+    from rasa.shared.core.events import ActionExecuted, BotUttered, UserUttered
+
+    tracker.update(UserUttered(texto, {"name": "agendar_cita", "confidence": 0.97}))
+    tracker.update(ActionExecuted("utter_pedir_fecha"))
+    tracker.update(BotUttered(f"respuesta a {texto}"))
+    tracker.update(ActionExecuted("action_listen"))
+
+
+async def conversacion(store, sender_id: str, turnos: int, tiempos: dict) -> None:
+    for i in range(turnos):
+        inicio = time.perf_counter()
+        tracker = await store.get_or_create_tracker(sender_id)
+        tiempos["retrieve"].append(time.perf_counter() - inicio)
+        turno(tracker, f"mensaje {i}")
+        inicio = time.perf_counter()
+        await store.save(tracker)
+        tiempos["save"].append(time.perf_counter() - inicio)
+
+
+async def vigilar_bucle(intervalo: float, retrasos: list, fin: asyncio.Event) -> None:
+    """Mide cuánto tarda el bucle en despertar a una tarea que duerme ``intervalo``."""
+    while not fin.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        retrasos.append(time.perf_counter() - inicio - intervalo)
+
+
+async def simular(nombre: str, domain, conversaciones: int, turnos: int, historial: int) -> dict:
+    ruta = os.path.join(tempfile.gettempdir(), f"bench_tracker_{nombre}_{conversaciones}.db")
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+    store = crear_store(nombre, ruta, domain)
+
+    # Historial previo, sin medir.
+    previos = {"retrieve": [], "save": []}
+    await asyncio.gather(*(
+        conversacion(store, f"u{i:05d}", historial, previos) for i in range(conversaciones)
+    ))
+    if hasattr(store, "_cache"):
+        # Otro proceso de Rasa (o un reinicio): la primera lectura va a la base.
+        store._cache.clear()
+
+    tiempos, retrasos, fin = {"retrieve": [], "save": []}, [], asyncio.Event()
+    vigilante = asyncio.create_task(vigilar_bucle(0.005, retrasos, fin))
+    inicio = time.perf_counter()
+    await asyncio.gather(*(
+        conversacion(store, f"u{i:05d}", turnos, tiempos) for i in range(conversaciones)
+    ))
+    total = time.perf_counter() - inicio
+    fin.set()
+    await vigilante
+    if hasattr(store, "cerrar"):
+        store.cerrar()
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+    return {
+        "turnos_s": conversaciones * turnos / total,
+        "retraso_bucle_max_ms": max(retrasos, default=0) * 1000,
+        "operaciones": {
+            operacion: (statistics.median(valores) * 1000, percentil(valores, 95) * 1000)
+            for operacion, valores in tiempos.items()
+        },
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--conversaciones", type=int, nargs="+", default=[100, 300])
+    parser.add_argument("--turnos", type=int, default=5)
+    parser.add_argument("--historial", type=int, default=10, help="turnos previos por conversación")
+    parser.add_argument("--stores", nargs="+", default=["SQLTrackerStore", "TrackerStoreSQLite"])
+    args = parser.parse_args(argv)
+
+    from rasa.shared.core.domain import Domain
+
+    domain = Domain.load(os.path.join(RAIZ, "domain.yml"))
+    for conversaciones in args.conversaciones:
+        for nombre in args.stores:
+            datos = asyncio.run(simular(nombre, domain, conversaciones, args.turnos, args.historial))
+            print(
+                f"{nombre:<19} {conversaciones:>4} conversaciones | {datos['turnos_s']:8.1f} turnos/s | "
+                f"retraso máximo del bucle {datos['retraso_bucle_max_ms']:8.1f} ms"
+            )
+            for operacion, (p50, p95) in datos["operaciones"].items():
+                print(f"    {operacion:<9} p50 {p50:8.2f} ms   p95 {p95:8.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
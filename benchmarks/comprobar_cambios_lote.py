@@ -0,0 +1,108 @@
+"""Prueba ``/admin/citas/lote`` contra el esquema con ``CHECK`` de estados.
+
+Crea una ``usuarios.db`` temporal con ``ESQUEMA_CITAS`` (el del servidor de
+acciones, que solo admite los estados de ``ESTADOS_CITA``) más el resto de
+tablas y migraciones del backend, y envía lotes con el cliente de pruebas de
+Flask::
+
+    python benchmarks/comprobar_cambios_lote.py
+
+Comprueba que dos citas pueden intercambiar sus horarios, que una cita puede
+ocupar el bloque que otra libera en el mismo lote y que una fila que viola una
+restricción de la base se devuelve como error de ese cambio sin tumbar el
+resto. Termina con código 1 si algo no se cumple.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+FECHA = "2030-03-04"
+
+
+def crear_bd(ruta: str):
+    os.environ["USUARIOS_DB"] = ruta
+    os.environ.setdefault("SECRET_KEY", "comprobacion")
+    from database import ESQUEMA_CITAS
+    import backend
+
+    with sqlite3.connect(ruta) as conn:
+        conn.execute(ESQUEMA_CITAS)
+    backend.crear_bd()
+    with sqlite3.connect(ruta) as conn:
+        conn.execute("INSERT INTO usuarios (id_usuario, telefono, contrasena) VALUES ('u1', 60000001, 'x')")
+        conn.executemany(
+            "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado) VALUES (?, 'u1', 'frenos', ?, ?, 'confirmada')",
+            [("a", FECHA, "08:00"), ("b", FECHA, "10:00"), ("c", FECHA, "12:00"), ("d", FECHA, "14:00")],
+        )
+    return backend
+
+
+def citas(ruta: str) -> dict:
+    with sqlite3.connect(ruta) as conn:
+        return {
+            id_cita: (hora, estado, servicio)
+            for id_cita, hora, estado, servicio in conn.execute("SELECT id_citas, hora, estado, servicio FROM citas")
+        }
+
+
+def main() -> int:
+    ruta = os.path.join(tempfile.gettempdir(), f"comprobar_lote_{os.getpid()}.db")
+    backend = crear_bd(ruta)
+    cliente = backend.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion["es_admin"] = True
+
+    casos = (
+        (
+            "intercambio de dos citas",
+            [{"id_citas": "a", "hora": "10:00"}, {"id_citas": "b", "hora": "08:00"}],
+            {"a": ("10:00", "confirmada", "frenos"), "b": ("08:00", "confirmada", "frenos")},
+            [True, True],
+        ),
+        (
+            "cadena: c pasa al bloque que d libera",
+            [{"id_citas": "c", "hora": "14:00"}, {"id_citas": "d", "hora": "16:00"}],
+            {"c": ("14:00", "confirmada", "frenos"), "d": ("16:00", "confirmada", "frenos")},
+            [True, True],
+        ),
+        (
+            "restricción NOT NULL en un cambio y un intercambio válido en el mismo lote",
+            [
+                {"id_citas": "a", "hora": "08:00"},
+                {"id_citas": "b", "hora": "10:00"},
+                {"id_citas": "c", "servicio": None},
+            ],
+            {"a": ("08:00", "confirmada", "frenos"), "b": ("10:00", "confirmada", "frenos"), "c": ("14:00", "confirmada", "frenos")},
+            [True, True, False],
+        ),
+    )
+
+    fallos = 0
+    for nombre, cambios, esperado, oks in casos:
+        respuesta = cliente.post("/admin/citas/lote", json={"cambios": cambios})
+        datos = respuesta.get_json() or {}
+        obtenidos = [r.get("ok") for r in datos.get("resultados", [])]
+        actuales = citas(ruta)
+        correcto = (
+            respuesta.status_code == 200
+            and obtenidos == oks
+            and all(actuales[id_cita] == valor for id_cita, valor in esperado.items())
+        )
+        fallos += not correcto
+        print(f"{'OK   ' if correcto else 'FALLO'} {nombre}")
+        if not correcto:
+            print(f"        HTTP {respuesta.status_code}: {datos}")
+            print(f"        en la base: {actuales}")
+
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Comprueba que ``/historial`` devuelve lo mismo desde ``tracker.db`` y desde la API de Rasa.
+
+Escribe en un ``tracker.db`` temporal una conversación con dos sesiones y un
+``restart`` entre medias, y levanta un servidor HTTP local que responde como
+``GET /conversations/<id>/tracker?include_events=after_restart`` de Rasa (el
+estado se calcula con ``DialogueStateTracker`` y ``EventVerbosity.AFTER_RESTART``).
+Después pide ``/historial`` con el cliente de pruebas de Flask, primero leyendo
+``tracker.db`` y luego sin él (la ruta de respaldo por HTTP), y exige los
+mismos mensajes en los dos casos::
+
+    python benchmarks/comprobar_historial_alcance.py
+
+Necesita Rasa instalado. Termina con código 1 si las respuestas difieren.
+"""
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+SENDER = "60000001"
+
+
+def eventos():
+    from rasa.shared.core.events import ActionExecuted, BotUttered, Restarted, SessionStarted, UserUttered
+
+    return [
+        ActionExecuted("action_session_start"), SessionStarted(), ActionExecuted("action_listen"),
+        UserUttered("hola, antes del reinicio"), BotUttered("respuesta antes del reinicio"),
+        Restarted(), ActionExecuted("action_listen"),
+        UserUttered("quiero una cita"), BotUttered("¿para qué día?"),
+        ActionExecuted("action_session_start"), SessionStarted(), ActionExecuted("action_listen"),
+        UserUttered("hola de nuevo, otra sesión"), BotUttered("bienvenido otra vez"),
+    ]
+
+
+def crear_tracker_db(ruta: str, lista) -> None:
+    from tracker_store import ESQUEMA_EVENTOS
+
+    with sqlite3.connect(ruta) as conn:
+        for sentencia in ESQUEMA_EVENTOS:
+            conn.execute(sentencia)
+        conn.executemany(
+            "INSERT INTO events (sender_id, type_name, timestamp, data) VALUES (?, ?, ?, ?)",
+            [(SENDER, e.type_name, e.timestamp, json.dumps(e.as_dict())) for e in lista],
+        )
+
+
+def servir_rasa(lista) -> ThreadingHTTPServer:
+    from rasa.shared.core.trackers import DialogueStateTracker, EventVerbosity
+
+    estado = DialogueStateTracker.from_events(SENDER, lista).current_state(EventVerbosity.AFTER_RESTART)
+    cuerpo = json.dumps({"events": estado["events"]}).encode()
+
+    class Rasa(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), Rasa)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def main() -> int:
+    directorio = tempfile.mkdtemp(prefix="comprobar_historial_")
+    lista = eventos()
+    crear_tracker_db(os.path.join(directorio, "tracker.db"), lista)
+    servidor = servir_rasa(lista)
+
+    os.environ["USUARIOS_DB"] = os.path.join(directorio, "usuarios.db")
+    os.environ["TRACKER_DB"] = os.path.join(directorio, "tracker.db")
+    os.environ["RASA_URL"] = f"http://127.0.0.1:{servidor.server_address[1]}"
+    os.environ.setdefault("SECRET_KEY", "comprobacion")
+    import backend
+    from historial_chat import LectorHistorial
+
+    backend.crear_bd()
+    cliente = backend.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion["id_usuario"] = SENDER
+
+    respuesta = cliente.get("/historial")
+    desde_tracker = [(m["sender"], m["text"]) for m in respuesta.get_json()]
+    origen = respuesta.headers.get("X-Historial-Origen")
+    backend.lector_historial = LectorHistorial(os.path.join(directorio, "no_existe.db"))
+    desde_http = [(m["sender"], m["text"]) for m in cliente.get("/historial").get_json()]
+    servidor.shutdown()
+
+    fallos = 0
+    for nombre, correcto in (
+        ("la primera respuesta sale de tracker.db", origen == "tracker_db"),
+        ("tracker.db y la API de Rasa devuelven los mismos mensajes", desde_tracker == desde_http),
+        ("nada anterior al restart", all("antes del reinicio" not in texto for _, texto in desde_tracker)),
+        ("la sesión nueva no corta el historial", ("user", "quiero una cita") in desde_tracker),
+    ):
+        fallos += not correcto
+        print(f"{'OK   ' if correcto else 'FALLO'} {nombre}")
+    if fallos:
+        print(f"        tracker.db: {desde_tracker}")
+        print(f"        HTTP:       {desde_http}")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
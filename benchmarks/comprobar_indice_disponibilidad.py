@@ -0,0 +1,137 @@
+"""Compara ``IndiceDisponibilidad`` con la tabla ``citas`` sobre rangos aleatorios.
+
+Llena una ``usuarios.db`` temporal con citas activas y terminadas y consulta
+el índice con rangos que se solapan, algunos más largos que ``--max-dias``
+para forzar el vaciado de la caché, mientras otra conexión reserva y cancela
+citas (invalidación por ``PRAGMA data_version``). Cada respuesta se compara con
+la ocupación calculada directamente en SQL::
+
+    python benchmarks/comprobar_indice_disponibilidad.py
+    python benchmarks/comprobar_indice_disponibilidad.py --consultas 20000 --max-dias 3
+
+Termina con código 1 ante una diferencia o un error.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from database import (  # noqa: E402
+    BIT_HORARIO,
+    ESQUEMA_CITAS,
+    ESTADOS_ACTIVOS,
+    HORARIOS,
+    IndiceDisponibilidad,
+    abrir_conexion,
+    aplicar_migraciones,
+)
+
+INICIO = date(2030, 1, 1)
+DIAS = 60
+ESTADOS = ("confirmada", "reprogramada", "en progreso", "cancelada", "completada")
+
+
+def crear_bd(ruta: str, rnd: random.Random):
+    conn = abrir_conexion(ruta)
+    conn.execute("CREATE TABLE usuarios (id_usuario TEXT PRIMARY KEY)")
+    conn.execute("CREATE TABLE mecanicos (id_mecanico TEXT PRIMARY KEY)")
+    conn.execute(ESQUEMA_CITAS)
+    conn.commit()
+    aplicar_migraciones(conn)
+    conn.execute("INSERT INTO usuarios VALUES ('u')")
+    filas = []
+    for dia in range(DIAS):
+        for hora in HORARIOS:
+            if rnd.random() < 0.5:
+                estado = rnd.choice(ESTADOS)
+                filas.append((f"c{dia}_{hora}", (INICIO + timedelta(days=dia)).isoformat(), hora, estado))
+    conn.executemany(
+        "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado) VALUES (?, 'u', 'frenos', ?, ?, ?)",
+        filas,
+    )
+    conn.commit()
+    return conn
+
+
+def ocupacion_sql(conn, desde: date, hasta: date) -> dict:
+    esperado = {
+        (desde + timedelta(days=n)).isoformat(): 0 for n in range((hasta - desde).days + 1)
+    }
+    marcadores = ", ".join("?" for _ in ESTADOS_ACTIVOS)
+    for fecha, hora in conn.execute(
+        f"SELECT fecha, hora FROM citas WHERE fecha BETWEEN ? AND ? AND estado IN ({marcadores})",
+        (desde.isoformat(), hasta.isoformat(), *ESTADOS_ACTIVOS),
+    ):
+        esperado[fecha] |= BIT_HORARIO[hora]
+    return esperado
+
+
+def escribir(conn, rnd: random.Random) -> None:
+    """Reserva un bloque libre o cancela una cita activa, como otro proceso."""
+    fecha = (INICIO + timedelta(days=rnd.randrange(DIAS))).isoformat()
+    hora = rnd.choice(HORARIOS)
+    activa = conn.execute(
+        "SELECT id_citas FROM citas WHERE fecha = ? AND hora = ? AND estado IN ('confirmada', 'reprogramada', 'en progreso')",
+        (fecha, hora),
+    ).fetchone()
+    if activa:
+        conn.execute("UPDATE citas SET estado = 'cancelada' WHERE id_citas = ?", (activa[0],))
+    else:
+        conn.execute(
+            "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado) "
+            "VALUES (?, 'u', 'frenos', ?, ?, 'confirmada')",
+            (f"n{rnd.getrandbits(48)}", fecha, hora),
+        )
+    conn.commit()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--consultas", type=int, default=5000)
+    parser.add_argument("--max-dias", type=int, default=5)
+    parser.add_argument("--semilla", type=int, default=1234)
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(args.semilla)
+    ruta = os.path.join(tempfile.gettempdir(), f"comprobar_indice_{os.getpid()}.db")
+    conn = crear_bd(ruta, rnd)
+    indice = IndiceDisponibilidad(ruta, max_dias=args.max_dias)
+
+    # Caso que fallaba: rangos solapados que superan ``max_dias`` entre los dos.
+    rangos = [(INICIO, INICIO + timedelta(days=args.max_dias)), (INICIO, INICIO + timedelta(days=args.max_dias + 2))]
+    for _ in range(args.consultas):
+        desde = INICIO + timedelta(days=rnd.randrange(DIAS))
+        rangos.append((desde, min(desde + timedelta(days=rnd.randrange(2 * args.max_dias)), INICIO + timedelta(days=DIAS - 1))))
+
+    diferencias = errores = 0
+    for numero, (desde, hasta) in enumerate(rangos):
+        if rnd.random() < 0.1:
+            escribir(conn, rnd)
+        try:
+            obtenido = indice.ocupacion(desde, hasta)
+        except Exception as exc:
+            errores += 1
+            if errores <= 5:
+                print(f"ERROR en {desde}..{hasta}: {exc!r}")
+            continue
+        esperado = ocupacion_sql(conn, desde, hasta)
+        if obtenido != esperado:
+            diferencias += 1
+            if diferencias <= 5:
+                print(f"DIFERENCIA en {desde}..{hasta} (consulta {numero})")
+    conn.close()
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+
+    print(f"{len(rangos)} consultas con max_dias={args.max_dias}: {diferencias} diferencias, {errores} errores; {indice.estadisticas()}")
+    return 1 if diferencias or errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Comprueba con ``EXPLAIN QUERY PLAN`` que las consultas calientes de ``citas`` usan índices.
+
+Crea una ``usuarios.db`` sintética (por defecto 100 000 citas) con el esquema
+del backend y sus migraciones, y para cada consulta exige que use uno de sus
+índices (``idx_citas_*`` o el parcial ``ux_citas_bloque_activo``) y que
+ninguna tabla de citas se recorra entera (``SCAN``)::
+
+    python benchmarks/comprobar_planes_citas.py
+    python benchmarks/comprobar_planes_citas.py --citas 500000 --mostrar
+
+Termina con código 1 si alguna consulta no usa su índice.
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+HOY = date.today()
+AHORA_TS = 1_900_000_000
+
+# (nombre, consulta, parámetros, índices admitidos). Copias de las consultas de
+# backend.py, actions/actions.py y database.py; si cambian allí, cambian aquí.
+CONSULTAS = (
+    (
+        "IndiceDisponibilidad._cargar (horarios libres y validate_hora)",
+        """
+        SELECT fecha, hora FROM citas
+        WHERE fecha BETWEEN ? AND ?
+          AND estado IN ('confirmada', 'reprogramada', 'en progreso')
+        """,
+        (HOY.isoformat(), (HOY + timedelta(days=30)).isoformat()),
+        # Índice parcial de bloques activos (fecha, hora): el más pequeño.
+        ("ux_citas_bloque_activo", "idx_citas_fecha_hora"),
+    ),
+    (
+        "ActionConsultarCita / ActionCancelarCita / ActionReprogramarCita (_SQL_PROXIMA_CITA)",
+        """
+        SELECT id_citas, servicio, fecha, hora FROM citas
+        WHERE id_usuario = ?
+          AND estado IN ('confirmada','reprogramada')
+          AND inicio_ts >= ?
+        ORDER BY inicio_ts ASC
+        LIMIT 1
+        """,
+        ("u0000001", AHORA_TS),
+        ("idx_citas_usuario_inicio",),
+    ),
+    (
+        "ActionMostrarHistorial (_historial_citas)",
+        """
+        SELECT servicio, fecha, hora FROM citas_todas
+        WHERE id_usuario = ?
+          AND estado IN ('confirmada','reprogramada','completada')
+          AND inicio_ts < ?
+        ORDER BY inicio_ts DESC
+        LIMIT ?
+        """,
+        ("u0000001", AHORA_TS, 20),
+        ("idx_citas_usuario_inicio",),
+    ),
+    (
+        "backend.obtener_citas",
+        """
+        SELECT id_citas, servicio, fecha, hora, estado, id_mecanico FROM citas_todas
+        WHERE id_usuario = ? ORDER BY fecha ASC, hora ASC
+        """,
+        ("u0000001",),
+        ("idx_citas_usuario", "idx_citas_usuario_inicio"),
+    ),
+    (
+        "backend.admin_calendario",
+        """
+        SELECT c.id_citas, c.servicio, c.fecha, c.hora, c.estado,
+               u.telefono AS telefono_usuario,
+               COALESCE(m.nombre, 'Sin asignar') AS nombre_mecanico
+        FROM citas AS c
+        JOIN usuarios AS u ON u.id_usuario = c.id_usuario
+        LEFT JOIN mecanicos AS m ON m.id_mecanico = c.id_mecanico
+        WHERE c.fecha BETWEEN ? AND ?
+        ORDER BY c.fecha ASC, c.hora ASC
+        """,
+        (HOY.isoformat(), (HOY + timedelta(days=42)).isoformat()),
+        ("idx_citas_agenda", "idx_citas_fecha_hora"),
+    ),
+    (
+        "backend.mecanico_panel",
+        """
+        SELECT c.id_citas, c.fecha, c.hora, c.estado,
+               u.telefono AS telefono_cliente, c.servicio
+        FROM citas AS c
+        JOIN usuarios AS u ON c.id_usuario = u.id_usuario
+        WHERE c.id_mecanico = ?
+        ORDER BY c.fecha ASC, c.hora ASC
+        """,
+        ("m0001",),
+        ("idx_citas_mecanico",),
+    ),
+    (
+        "database.barrer_citas_vencidas",
+        """
+        SELECT rowid FROM citas
+        WHERE estado IN ('confirmada', 'reprogramada') AND inicio_ts < ?
+        ORDER BY inicio_ts
+        LIMIT 500
+        """,
+        (AHORA_TS,),
+        ("idx_citas_pendientes_inicio",),
+    ),
+)
+
+# Recorrido completo de una tabla de citas: "SCAN citas", "SCAN c" o "SCAN
+# citas_archivo", con o sin índice (un SCAN por índice también lee todo).
+SCAN_CITAS = re.compile(r"^SCAN (citas|citas_archivo|c)\b")
+
+
+def crear_bd(ruta: str, citas: int) -> None:
+    os.environ["USUARIOS_DB"] = ruta
+    os.environ.setdefault("SECRET_KEY", "comprobacion")
+    import backend
+    from bench_backend import poblar_bd
+
+    backend.crear_bd()
+    with sqlite3.connect(ruta) as conn:
+        poblar_bd(conn, usuarios=10000, citas=citas, mecanicos=50, semilla=1234)
+
+
+def usa_indice(detalles: list, indices) -> bool:
+    return any(re.search(rf"USING (COVERING )?INDEX {indice}\b", d) for d in detalles for indice in indices)
+
+
+def plan(conn: sqlite3.Connection, sql: str, parametros) -> list:
+    return [fila[3] for fila in conn.execute(f"EXPLAIN QUERY PLAN {sql}", parametros)]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--citas", type=int, default=100000)
+    parser.add_argument("--mostrar", action="store_true", help="imprimir el plan completo de cada consulta")
+    args = parser.parse_args(argv)
+
+    ruta = os.path.join(tempfile.gettempdir(), f"comprobar_planes_{args.citas}.db")
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+    crear_bd(ruta, args.citas)
+
+    fallos = 0
+    with sqlite3.connect(ruta) as conn:
+        total = conn.execute("SELECT COUNT(*) FROM citas").fetchone()[0]
+        print(f"{total} citas en {ruta}")
+        for nombre, sql, parametros, indices in CONSULTAS:
+            detalles = plan(conn, sql, parametros)
+            recorridos = [d for d in detalles if SCAN_CITAS.match(d)]
+            correcto = usa_indice(detalles, indices) and not recorridos
+            fallos += not correcto
+            print(f"{'OK   ' if correcto else 'FALLO'} {nombre}")
+            if not correcto or args.mostrar:
+                for detalle in detalles:
+                    print(f"        {detalle}")
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
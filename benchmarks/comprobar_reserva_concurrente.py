@@ -0,0 +1,156 @@
+"""Varios procesos reservan a la vez el mismo horario: solo uno puede ganar.
+
+Crea una ``usuarios.db`` con el esquema del servidor de acciones (``CHECK`` de
+estados, migraciones e índice ``ux_citas_bloque_activo``) y lanza
+``--procesos`` procesos que, en cada una de las ``--rondas``, esperan en una
+barrera y piden el mismo bloque de fecha y hora. La mitad crea una cita nueva
+(como ``ActionAgendarCita`` o ``/admin/agregar_cita``) y la otra mitad mueve
+su propia cita a ese bloque (como ``ActionReprogramarCita``), siempre con
+``transaccion_inmediata`` + ``guardar_cita``::
+
+    python benchmarks/comprobar_reserva_concurrente.py
+    python benchmarks/comprobar_reserva_concurrente.py --procesos 16 --rondas 50
+
+En cada ronda exige exactamente un ganador, ``HorarioOcupadoError`` para los
+demás y una sola cita activa en el bloque. Termina con código 1 si no es así.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+HORARIOS = ("08:00", "10:00", "12:00", "14:00", "16:00", "18:00")
+
+
+def bloque(ronda: int):
+    """Fecha y hora que se disputan en ``ronda`` (después de las citas propias)."""
+    dia, posicion = divmod(ronda, len(HORARIOS))
+    return (date.today() + timedelta(days=20000 + dia)).isoformat(), HORARIOS[posicion]
+
+
+def crear_bd(ruta: str, procesos: int, rondas: int) -> None:
+    from database import ESQUEMA_CITAS, abrir_conexion, aplicar_migraciones
+
+    conn = abrir_conexion(ruta)
+    try:
+        conn.execute("CREATE TABLE usuarios (id_usuario TEXT PRIMARY KEY, telefono INTEGER UNIQUE NOT NULL)")
+        conn.execute("CREATE TABLE mecanicos (id_mecanico TEXT PRIMARY KEY, nombre TEXT, telefono INTEGER)")
+        conn.execute(ESQUEMA_CITAS)
+        conn.commit()
+        aplicar_migraciones(conn)
+        conn.executemany(
+            "INSERT INTO usuarios (id_usuario, telefono) VALUES (?, ?)",
+            [(f"u{n}", 60000000 + n) for n in range(procesos)],
+        )
+        # Una cita propia por ronda para cada proceso que reprograma, cada una
+        # en su bloque: si la misma cita se moviera en todas las rondas, el
+        # bloque ganado en una ronda quedaría libre en la siguiente.
+        conn.executemany(
+            "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado) "
+            "VALUES (?, ?, 'frenos', ?, '08:00', 'confirmada')",
+            [
+                (f"r{ronda}p{n}", f"u{n}", (date.today() + timedelta(days=1 + ronda * procesos + n)).isoformat())
+                for ronda in range(rondas)
+                for n in range(1, procesos, 2)
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def competidor(numero: int, ruta: str, rondas: int, barrera, resultados) -> None:
+    from database import HorarioOcupadoError, abrir_conexion, guardar_cita, transaccion_inmediata
+
+    conn = abrir_conexion(ruta)
+    try:
+        for ronda in range(rondas):
+            fecha, hora = bloque(ronda)
+            barrera.wait()
+            try:
+                with transaccion_inmediata(conn):
+                    if numero % 2 == 0:
+                        guardar_cita(
+                            conn,
+                            "INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado) "
+                            "VALUES (?, ?, 'frenos', ?, ?, 'confirmada')",
+                            (f"r{ronda}p{numero}", f"u{numero}", fecha, hora),
+                        )
+                    else:
+                        guardar_cita(
+                            conn,
+                            "UPDATE citas SET fecha = ?, hora = ?, estado = 'reprogramada' WHERE id_citas = ?",
+                            (fecha, hora, f"r{ronda}p{numero}"),
+                        )
+                resultado = "gana"
+            except HorarioOcupadoError:
+                resultado = "ocupado"
+            except sqlite3.Error as exc:
+                resultado = f"error: {exc}"
+            resultados.put((ronda, numero, resultado))
+    finally:
+        conn.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--procesos", type=int, default=8)
+    parser.add_argument("--rondas", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    ruta = os.path.join(tempfile.gettempdir(), f"comprobar_reserva_{os.getpid()}.db")
+    crear_bd(ruta, args.procesos, args.rondas)
+
+    barrera = multiprocessing.Barrier(args.procesos)
+    resultados = multiprocessing.Queue()
+    inicio = time.perf_counter()
+    procesos = [
+        multiprocessing.Process(target=competidor, args=(n, ruta, args.rondas, barrera, resultados))
+        for n in range(args.procesos)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    por_ronda = {ronda: Counter() for ronda in range(args.rondas)}
+    for _ in range(args.procesos * args.rondas):
+        ronda, _numero, resultado = resultados.get(timeout=120)
+        por_ronda[ronda][resultado] += 1
+    for proceso in procesos:
+        proceso.join()
+    duracion = time.perf_counter() - inicio
+
+    fallos = 0
+    conn = sqlite3.connect(ruta)
+    try:
+        for ronda, cuenta in por_ronda.items():
+            fecha, hora = bloque(ronda)
+            activas = conn.execute(
+                "SELECT COUNT(*) FROM citas WHERE fecha = ? AND hora = ? "
+                "AND estado IN ('confirmada', 'reprogramada', 'en progreso')",
+                (fecha, hora),
+            ).fetchone()[0]
+            if cuenta["gana"] != 1 or activas != 1 or cuenta["ocupado"] != args.procesos - 1:
+                fallos += 1
+                print(f"FALLO ronda {ronda} ({fecha} {hora}): {dict(cuenta)}, {activas} citas activas")
+    finally:
+        conn.close()
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+
+    print(
+        f"{args.rondas} rondas x {args.procesos} procesos en {duracion:.1f} s: "
+        f"{args.rondas - fallos} con un único ganador y una sola cita activa, {fallos} fallidas"
+    )
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
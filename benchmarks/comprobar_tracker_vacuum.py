@@ -0,0 +1,65 @@
+"""Comprueba que ``TrackerStoreSQLite`` crea ``tracker.db`` con ``auto_vacuum = INCREMENTAL``.
+
+Crea el store sobre un archivo nuevo y sobre un archivo vacío ya en WAL, y
+exige que ``PRAGMA auto_vacuum`` devuelva 2 en los dos. Después llena la tabla
+``events``, borra la mayoría de filas y exige que
+``compactar_tracker.vaciar_incremental`` encoja el archivo::
+
+    python benchmarks/comprobar_tracker_vacuum.py
+
+Necesita Rasa instalado. Termina con código 1 si algo no se cumple.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def main() -> int:
+    from compactar_tracker import vaciar_incremental
+    from database import abrir_conexion
+    from tracker_store import TrackerStoreSQLite
+
+    fallos = 0
+    directorio = tempfile.mkdtemp(prefix="comprobar_tracker_")
+
+    nueva = os.path.join(directorio, "nueva.db")
+    en_wal = os.path.join(directorio, "en_wal.db")
+    conn = sqlite3.connect(en_wal)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+    for nombre, ruta in (("archivo nuevo", nueva), ("archivo vacío en WAL", en_wal)):
+        store = TrackerStoreSQLite(db=ruta)
+        store.cerrar()
+        conn = sqlite3.connect(ruta)
+        modo = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        diario = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.close()
+        correcto = modo == 2
+        fallos += not correcto
+        print(f"{'OK   ' if correcto else 'FALLO'} {nombre}: auto_vacuum={modo}, journal_mode={diario}")
+
+    conn = abrir_conexion(nueva)
+    try:
+        conn.executemany(
+            "INSERT INTO events (sender_id, type_name, timestamp, data) VALUES (?, 'action', 0, ?)",
+            [(f"s{n % 50}", "x" * 500) for n in range(20000)],
+        )
+        conn.commit()
+        conn.execute("DELETE FROM events WHERE sender_id != 's0'")
+        conn.commit()
+        paginas = vaciar_incremental(conn)
+    finally:
+        conn.close()
+    correcto = paginas > 0
+    fallos += not correcto
+    print(f"{'OK   ' if correcto else 'FALLO'} vaciar_incremental tras borrar: {paginas} páginas devueltas")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
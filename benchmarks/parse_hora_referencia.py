@@ -0,0 +1,151 @@
+"""Implementación original de ``parse_hora_es``, congelada como referencia.
+
+``bench_hora.py`` la usa para comprobar que la versión optimizada de
+``actions/actions.py`` devuelve exactamente lo mismo y para medir la mejora.
+No se usa en producción.
+"""
+import re
+import unicodedata
+from datetime import time
+from typing import Dict, Optional, Text
+
+from actions.actions import (
+    AM_INDICATORS,
+    NUMERIC_WORDS,
+    PM_INDICATORS,
+    TZ,
+    parse,
+)
+
+
+def _strip_accents(value: Text) -> Text:
+    return "".join(
+        char
+        for char in unicodedata.normalize("NFD", value)
+        if unicodedata.category(char) != "Mn"
+    )
+
+
+def _texto_a_numero(token: Text) -> Optional[int]:
+    token = _strip_accents(token.lower())
+    return NUMERIC_WORDS.get(token)
+
+
+def _detectar_periodo(texto: Text) -> Dict[str, bool]:
+    texto_normalizado = texto.lower()
+    compacto = re.sub(r"[\s\.]", "", texto_normalizado)
+    indicadores_pm = any(ind in texto_normalizado for ind in PM_INDICATORS) or "pm" in compacto
+    indicadores_am = any(ind in texto_normalizado for ind in AM_INDICATORS) or "am" in compacto
+    return {"pm": indicadores_pm, "am": indicadores_am}
+
+
+def _aplicar_periodo(base_hour: int, minute: int, texto: Text) -> time:
+    periodo = _detectar_periodo(texto)
+    hour = base_hour % 24
+    if periodo["pm"]:
+        if hour < 12:
+            hour = (hour + 12) % 24
+    elif periodo["am"]:
+        if hour == 12:
+            hour = 0
+    else:
+        if hour < 8 and hour + 12 <= 23:
+            hour += 12
+    return time(hour, minute)
+
+
+def _replace_text_numbers(texto: Text) -> Text:
+    def reemplazar(match: re.Match) -> Text:
+        palabra = match.group(0)
+        numero = _texto_a_numero(palabra)
+        if numero is not None:
+            return str(numero)
+        return palabra
+
+    return re.sub(r"\b[\wáéíóúñ]+\b", reemplazar, texto)
+
+
+def parse_hora_es(value: Optional[Text]) -> Optional[time]:
+    if not value:
+        return None
+
+    texto = value.strip().lower()
+    if not texto:
+        return None
+
+    texto = texto.replace("\u200b", "")
+    texto = texto.replace("hrs", "")
+    texto = texto.replace("horas", "")
+    texto = texto.replace("hora", "")
+    texto = texto.replace("hs", "")
+    texto = re.sub(r"(\d{1,2})\s*h\s*(\d{2})", r"\1:\2", texto)
+    texto = re.sub(r"(\d{1,2})\s*h\b", r"\1", texto)
+    texto = texto.replace("p.m.", " pm ")
+    texto = texto.replace("a.m.", " am ")
+    texto = texto.replace("p.m", " pm ")
+    texto = texto.replace("a.m", " am ")
+    texto = re.sub(r"[\.\,]", " ", texto)
+    texto = re.sub(r"\s+", " ", texto).strip()
+
+    if not texto:
+        return None
+
+    texto_sin_acentos = _strip_accents(texto)
+
+    if "medianoche" in texto_sin_acentos or "media noche" in texto_sin_acentos:
+        return time(0, 0)
+    if "mediodia" in texto_sin_acentos or "medio dia" in texto_sin_acentos:
+        return time(12, 0)
+
+    match = re.search(r"cuarto\s+para\s+las?\s+([\wáéíóúñ]+)", texto)
+    if match:
+        objetivo = match.group(1)
+        numero = _texto_a_numero(objetivo) or (int(objetivo) if objetivo.isdigit() else None)
+        if numero is not None:
+            base_hour = (numero - 1) % 24
+            return _aplicar_periodo(base_hour, 45, texto)
+
+    match = re.search(r"([\wáéíóúñ]+)\s+y\s+media", texto)
+    if match:
+        numero = _texto_a_numero(match.group(1))
+        if numero is None and match.group(1).isdigit():
+            numero = int(match.group(1))
+        if numero is not None:
+            return _aplicar_periodo(numero, 30, texto)
+
+    match = re.search(r"([\wáéíóúñ]+)\s+y\s+cuarto", texto)
+    if match:
+        numero = _texto_a_numero(match.group(1))
+        if numero is None and match.group(1).isdigit():
+            numero = int(match.group(1))
+        if numero is not None:
+            return _aplicar_periodo(numero, 15, texto)
+
+    reemplazado = _replace_text_numbers(texto)
+    match = re.search(r"(\d{1,2})(?:[:](\d{1,2}))?", reemplazado)
+    if match:
+        hour = int(match.group(1))
+        minute = int(match.group(2)) if match.group(2) else 0
+        if "y media" in texto:
+            minute = 30
+        elif "y cuarto" in texto:
+            minute = 15
+        if minute >= 60:
+            return None
+        return _aplicar_periodo(hour, minute, texto)
+
+    try:
+        parsed = parse(
+            value,
+            languages=["es"],
+            settings={
+                "TIMEZONE": TZ.key,
+                "RETURN_AS_TIMEZONE_AWARE": False,
+            },
+        )
+        if parsed:
+            return _aplicar_periodo(parsed.hour, parsed.minute, texto)
+    except Exception:
+        return None
+
+    return None
@@ -1,8 +1,10 @@
 from typing import Optional, Text, Dict, Any, Callable, Awaitable
+import asyncio
+import hmac
 import json
 import logging
 import os
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, urlsplit
 
 from sanic.request import Request
 from sanic import response, Blueprint
@@ -13,10 +15,130 @@ from rasa.core.channels.socketio import (
     SocketIOOutput,
     SocketBlueprint,
 )
-from socketio import AsyncServer
+from socketio import AsyncAioPikaManager, AsyncManager, AsyncRedisManager, AsyncServer
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from control_mensajes import ControlMensajes
+from metricas import CONTENT_TYPE, REGISTRO
 
 logger = logging.getLogger(__name__)
 
+
+class AsyncLocalSocketManager(AsyncPubSubManager):
+    """Gestor pub/sub sobre un socket TCP local, para pruebas sin Redis.
+
+    Los nodos se conectan a ``host:port`` y el relé reenvía cada mensaje (una
+    línea JSON) a todos. El primer nodo que no encuentra el relé lo levanta en
+    su propio proceso, así que basta con que todos usen la misma URL
+    ``local://127.0.0.1:6390``. Si ese nodo cae, los demás pierden el bus: no
+    sirve para producción.
+    """
+
+    name = "asynclocalsocket"
+
+    def __init__(self, host: Text, port: int, channel: Text = "socketio", write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.host = host
+        self.port = port
+        self._lector: Optional[asyncio.StreamReader] = None
+        self._escritor: Optional[asyncio.StreamWriter] = None
+        # Se crea dentro del bucle de eventos, en la primera conexión: el
+        # gestor se construye antes de que Sanic arranque su bucle.
+        self._conectando: Optional[asyncio.Lock] = None
+        self._rele = None
+
+    async def _servir_rele(self) -> None:
+        clientes = set()
+
+        async def atender(lector: asyncio.StreamReader, escritor: asyncio.StreamWriter) -> None:
+            clientes.add(escritor)
+            try:
+                while True:
+                    linea = await lector.readline()
+                    if not linea:
+                        break
+                    for cliente in list(clientes):
+                        cliente.write(linea)
+            finally:
+                clientes.discard(escritor)
+                escritor.close()
+
+        self._rele = await asyncio.start_server(atender, self.host, self.port)
+
+    async def _conectar(self) -> None:
+        if self._conectando is None:
+            self._conectando = asyncio.Lock()
+        async with self._conectando:
+            if self._escritor is not None:
+                return
+            try:
+                self._lector, self._escritor = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                try:
+                    await self._servir_rele()
+                except OSError:
+                    pass  # otro nodo lo levantó a la vez
+                self._lector, self._escritor = await asyncio.open_connection(self.host, self.port)
+
+    def _desconectar(self) -> None:
+        if self._escritor is not None:
+            self._escritor.close()
+        self._lector = self._escritor = None
+
+    async def _publish(self, data) -> None:
+        await self._conectar()
+        try:
+            self._escritor.write(json.dumps({"canal": self.channel, "datos": data}).encode() + b"\n")
+            await self._escritor.drain()
+        except OSError:
+            self._desconectar()
+            raise
+
+    async def _listen(self):
+        # python-socketio vuelve a llamar a _listen en cuanto termina: sin la
+        # espera, un relé caído deja el proceso en un bucle sin fin.
+        espera = 1
+        while True:
+            try:
+                await self._conectar()
+                espera = 1
+                while True:
+                    linea = await self._lector.readline()
+                    if not linea:
+                        raise ConnectionError("Se cerró la conexión con el relé local")
+                    mensaje = json.loads(linea)
+                    if mensaje.get("canal") == self.channel:
+                        yield mensaje["datos"]
+            except OSError as exc:
+                # Al reconectar, si nadie sirve el relé, lo levanta este nodo.
+                self._desconectar()
+                logger.warning("[SOCKET] Relé local no disponible (%s); reintento en %s s", exc, espera)
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 60)
+
+
+def crear_client_manager(url: Optional[Text], canal: Text = "socketio") -> Optional[AsyncManager]:
+    """Gestor de clientes de Socket.IO a partir de una URL.
+
+    Sin URL cada proceso solo conoce sus propios sockets (el gestor por
+    defecto). Con ``redis://``/``rediss://`` o ``amqp://`` los nodos comparten
+    salas a través de la cola de mensajes, y una respuesta emitida en un nodo
+    llega al socket del usuario aunque esté conectado a otro.
+    ``local://host:puerto`` usa ``AsyncLocalSocketManager`` (pruebas).
+    """
+    if not url:
+        return None
+    esquema = urlsplit(url).scheme
+    if esquema in ("redis", "rediss"):
+        return AsyncRedisManager(url, channel=canal)
+    if esquema in ("amqp", "amqps"):
+        return AsyncAioPikaManager(url, channel=canal)
+    if esquema == "local":
+        partes = urlsplit(url)
+        return AsyncLocalSocketManager(partes.hostname or "127.0.0.1", partes.port or 6390, channel=canal)
+    raise ValueError(f"Esquema de client_manager no soportado: {url!r}")
+
+
 class CustomSocketIOOutput(SocketIOOutput):
     """Output channel that sends events only to the user's room."""
 
@@ -30,6 +152,15 @@ class CustomSocketIOInput(SocketIOInput):
     def name(cls) -> Text:
         return "custom_socketio"  # importante para evitar conflictos
 
+    @classmethod
+    def from_credentials(cls, credentials: Optional[Dict[Text, Any]]) -> "CustomSocketIOInput":
+        canal = super().from_credentials(credentials)
+        credentials = credentials or {}
+        # SOCKET_MANAGER_URL tiene prioridad sobre credentials.yml.
+        canal.client_manager_url = os.environ.get("SOCKET_MANAGER_URL") or credentials.get("client_manager")
+        canal.client_manager_canal = credentials.get("client_manager_channel", "socketio")
+        return canal
+
     def blueprint(
         self, on_new_message: Callable[[UserMessage], Awaitable[Any]]
     ) -> Blueprint:
@@ -43,17 +174,38 @@ class CustomSocketIOInput(SocketIOInput):
                 cors_list.append(origin)
 
         cors_allowed = cors_list[0] if len(cors_list) == 1 else cors_list
-        sio = AsyncServer(async_mode="sanic", cors_allowed_origins=cors_allowed)
+        manager_url = getattr(self, "client_manager_url", None) or os.environ.get("SOCKET_MANAGER_URL")
+        client_manager = crear_client_manager(
+            manager_url, getattr(self, "client_manager_canal", "socketio")
+        )
+        if client_manager is not None:
+            logger.info("[SOCKET] Salas compartidas entre nodos mediante %s", type(client_manager).__name__)
+        sio = AsyncServer(
+            async_mode="sanic", cors_allowed_origins=cors_allowed, client_manager=client_manager
+        )
 
         socketio_webhook = SocketBlueprint(
             sio, self.socketio_path, "custom_socketio_webhook", __name__
         )
         self.sio = sio
+        # Cola y límite de tasa por remitente y plazas globales (control_mensajes.py).
+        control = self.control_mensajes = ControlMensajes()
 
         @socketio_webhook.route("/health", methods=["GET"])
         async def health(_: Request) -> HTTPResponse:
             return response.json({"status": "ok"})
 
+        @socketio_webhook.route("/metrics", methods=["GET"])
+        async def metrics(request: Request) -> HTTPResponse:
+            # Métricas del proceso de Rasa (p. ej. las del tracker store).
+            token = os.environ.get("METRICAS_TOKEN")
+            autorizacion = request.headers.get("Authorization", "")
+            if not token or not hmac.compare_digest(
+                autorizacion.encode(), f"Bearer {token}".encode()
+            ):
+                return response.json({"error": "No autorizado"}, status=401)
+            return response.text(REGISTRO.exponer(), content_type=CONTENT_TYPE)
+
         @socketio_webhook.route("/", methods=["GET", "POST"])
         async def handle_request(request: Request) -> HTTPResponse:
             result = await sio.handle_request(request)
@@ -150,6 +302,6 @@ class CustomSocketIOInput(SocketIOInput):
                 input_channel=self.name(),
                 metadata=metadata,
             )
-            await on_new_message(message)
+            await control.recibir(message, on_new_message)
 
         return socketio_webhook
\ No newline at end of file
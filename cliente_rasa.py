@@ -0,0 +1,194 @@
+"""Cliente HTTP del servidor de Rasa para el historial de conversaciones.
+
+El backend solo recurre a la API de Rasa cuando ``tracker.db`` no se puede
+leer, pero entonces cada carga de la página del chat pedía el tracker completo
+con un ``requests.get`` suelto: una conexión TCP nueva por llamada y hasta 5 s
+con un hilo de Flask bloqueado si Rasa iba lento. Aquí se comparte una sesión
+con conexiones persistentes, se guarda el historial de cada usuario unos
+segundos y un cortocircuito deja de llamar a Rasa mientras está caído.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RASA_URL = os.environ.get("RASA_URL", "http://localhost:5005")
+RASA_POOL_MAX = int(os.environ.get("RASA_POOL_MAX", "10"))
+RASA_TIMEOUT_CONEXION_S = float(os.environ.get("RASA_TIMEOUT_CONEXION_S", "0.5"))
+RASA_TIMEOUT_LECTURA_S = float(os.environ.get("RASA_TIMEOUT_LECTURA_S", "2"))
+RASA_HISTORIAL_TTL_S = float(os.environ.get("RASA_HISTORIAL_TTL_S", "30"))
+RASA_HISTORIAL_CACHE_MAX = int(os.environ.get("RASA_HISTORIAL_CACHE_MAX", "1000"))
+RASA_CIRCUITO_FALLOS = int(os.environ.get("RASA_CIRCUITO_FALLOS", "5"))
+RASA_CIRCUITO_ESPERA_S = float(os.environ.get("RASA_CIRCUITO_ESPERA_S", "30"))
+
+
+class Circuito:
+    """Cortocircuito de tres estados para las llamadas a Rasa.
+
+    ``cerrado``: las llamadas pasan. Tras ``umbral`` fallos seguidos pasa a
+    ``abierto`` y rechaza todo durante ``espera_s``; después queda
+    ``semiabierto`` y deja pasar una sola llamada de prueba, que lo vuelve a
+    cerrar si sale bien o lo abre otra vez si falla.
+    """
+
+    def __init__(self, umbral: int = RASA_CIRCUITO_FALLOS, espera_s: float = RASA_CIRCUITO_ESPERA_S):
+        self.umbral = max(1, umbral)
+        self.espera_s = espera_s
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_hasta = 0.0
+        self._prueba_en_curso = False
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self._fallos < self.umbral:
+                return "cerrado"
+            if time.monotonic() < self._abierto_hasta:
+                return "abierto"
+            return "semiabierto"
+
+    def permitir(self) -> bool:
+        """``True`` si la llamada puede hacerse ahora."""
+        with self._lock:
+            if self._fallos < self.umbral:
+                return True
+            if time.monotonic() < self._abierto_hasta or self._prueba_en_curso:
+                return False
+            self._prueba_en_curso = True
+            return True
+
+    def exito(self) -> None:
+        with self._lock:
+            self._fallos = 0
+            self._prueba_en_curso = False
+
+    def fallo(self) -> None:
+        with self._lock:
+            self._fallos += 1
+            self._prueba_en_curso = False
+            if self._fallos >= self.umbral:
+                self._abierto_hasta = time.monotonic() + self.espera_s
+
+
+class ClienteRasa:
+    """Historial de conversaciones pedido a Rasa, con caché y cortocircuito.
+
+    ``historial`` devuelve ``(mensajes, origen)``; ``origen`` es ``"cache"``,
+    ``"circuito_abierto"`` (Rasa no se llamó: se sirve la última copia guardada
+    aunque haya caducado, o una lista vacía) o el resultado de la llamada:
+    ``"ok"``, ``"error_http"`` o ``"sin_conexion"``.
+    """
+
+    def __init__(
+        self,
+        url: str = RASA_URL,
+        ttl_s: float = RASA_HISTORIAL_TTL_S,
+        cache_max: int = RASA_HISTORIAL_CACHE_MAX,
+        pool_max: int = RASA_POOL_MAX,
+        timeout: Tuple[float, float] = (RASA_TIMEOUT_CONEXION_S, RASA_TIMEOUT_LECTURA_S),
+        circuito: Optional[Circuito] = None,
+    ):
+        self.url = url.rstrip("/")
+        self.ttl_s = ttl_s
+        self.cache_max = cache_max
+        self.timeout = timeout
+        self.circuito = circuito or Circuito()
+        # Un solo host: un pool con hasta ``pool_max`` conexiones persistentes.
+        # Sin reintentos; de los fallos se encarga el cortocircuito.
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool_max, max_retries=0)
+        self.sesion.mount("http://", adaptador)
+        self.sesion.mount("https://", adaptador)
+        self._cache: "OrderedDict[str, Tuple[float, List[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"aciertos_cache": 0, "fallos_cache": 0, "rechazos_circuito": 0, "invalidaciones": 0}
+
+    def historial(self, id_usuario: str) -> Tuple[List[dict], str]:
+        ahora = time.monotonic()
+        with self._lock:
+            guardado = self._cache.get(id_usuario)
+            if guardado is not None and guardado[0] > ahora:
+                self._cache.move_to_end(id_usuario)
+                self._stats["aciertos_cache"] += 1
+                return guardado[1], "cache"
+
+        if not self.circuito.permitir():
+            with self._lock:
+                self._stats["rechazos_circuito"] += 1
+            return (guardado[1] if guardado is not None else []), "circuito_abierto"
+
+        with self._lock:
+            self._stats["fallos_cache"] += 1
+        mensajes, resultado = self._descargar(id_usuario)
+        if resultado == "ok":
+            self.circuito.exito()
+            self._guardar(id_usuario, mensajes)
+        elif resultado == "sin_conexion" or mensajes is None:
+            self.circuito.fallo()
+            # Mejor la última copia conocida que nada mientras Rasa falla.
+            if guardado is not None:
+                return guardado[1], resultado
+        else:
+            # Un 4xx (p. ej. usuario sin tracker) no indica que Rasa esté caído.
+            self.circuito.exito()
+        return mensajes or [], resultado
+
+    def _descargar(self, id_usuario: str) -> Tuple[Optional[List[dict]], str]:
+        """Mensajes del tracker; ``None`` si Rasa no respondió o respondió con 5xx."""
+        try:
+            resp = self.sesion.get(
+                f"{self.url}/conversations/{id_usuario}/tracker",
+                params={"include_events": "after_restart"},
+                timeout=self.timeout,
+            )
+        except requests.RequestException:
+            return None, "sin_conexion"
+        if resp.status_code != 200:
+            resp.close()
+            return (None if resp.status_code >= 500 else []), "error_http"
+        try:
+            data = resp.json()
+        except ValueError:
+            return None, "error_http"
+        messages = []
+        for ev in data.get("events", []):
+            if ev.get("event") == "user" and ev.get("text"):
+                messages.append({"sender": "user", "text": ev.get("text")})
+            elif ev.get("event") == "bot" and ev.get("text"):
+                messages.append({"sender": "bot", "text": ev.get("text")})
+        return messages, "ok"
+
+    def _guardar(self, id_usuario: str, mensajes: List[dict]) -> None:
+        if self.ttl_s <= 0 or self.cache_max <= 0:
+            return
+        with self._lock:
+            self._cache[id_usuario] = (time.monotonic() + self.ttl_s, mensajes)
+            self._cache.move_to_end(id_usuario)
+            while len(self._cache) > self.cache_max:
+                self._cache.popitem(last=False)
+
+    def invalidar(self, id_usuario: str) -> None:
+        """Marca como caducado el historial del usuario (acaba de escribir).
+
+        La copia se conserva para servirla si el cortocircuito está abierto.
+        """
+        with self._lock:
+            guardado = self._cache.get(id_usuario)
+            if guardado is not None:
+                self._cache[id_usuario] = (0.0, guardado[1])
+            self._stats["invalidaciones"] += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            datos = dict(self._stats)
+            datos["en_cache"] = len(self._cache)
+        datos["circuito"] = self.circuito.estado
+        return datos
+
+    def cerrar(self) -> None:
+        self.sesion.close()
@@ -0,0 +1,312 @@
+"""Compacta el historial antiguo de ``tracker.db``.
+
+Rasa guarda cada evento de cada conversación para siempre. Para cada
+``sender_id``, los eventos anteriores a la ventana de retención (y a su última
+sesión, que es la que Rasa carga y nunca se toca) se reducen a:
+
+- los mensajes del usuario y del bot con texto, que son los que muestra
+  ``/historial``, sin el ranking de intenciones ni los datos del selector de
+  respuestas de cada mensaje del usuario;
+- los ``session_started`` y los ``restart``, para conservar el límite entre
+  sesiones y desde dónde muestra mensajes ``/historial``;
+- una instantánea de los slots: un evento ``slot`` por slot con el valor que
+  tenía al final del tramo compactado, en las mismas posiciones (``id``) que
+  ocupaban los eventos borrados.
+
+Las acciones, los ``slot`` intermedios, los bucles de formularios, etc. se
+borran. Después se devuelven al sistema las páginas que quedan libres con
+``PRAGMA incremental_vacuum``, en pasos cortos (solo si la base tiene
+``auto_vacuum = INCREMENTAL``, como las que crea ``TrackerStoreSQLite``; en
+otra base se avisa y hay que pasar una vez ``--vacuum-completo``), y se informa de los bytes
+recuperados y del tiempo de carga del tracker completo de los remitentes con
+más eventos, antes y después::
+
+    python compactar_tracker.py --retencion-dias 90
+    python compactar_tracker.py --db otra/tracker.db --retencion-dias 30 --muestra 50
+
+Los eventos de todas las conversaciones están intercalados en las páginas, así
+que borrar la mayoría deja páginas a medio llenar más que páginas libres: el
+informe muestra también cuánto ocupan los datos de los eventos. Para devolver
+ese espacio hace falta reconstruir el archivo con ``--vacuum-completo``
+(bloquea las escrituras de Rasa mientras dura; mejor en horas sin tráfico).
+
+Puede ejecutarse con Rasa en marcha: cada remitente se compacta en su propia
+transacción ``BEGIN IMMEDIATE`` y los ``id`` de los mensajes no cambian.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+from database import abrir_conexion, transaccion_inmediata
+from historial_chat import TRACKER_DB
+
+RETENCION_DIAS = int(os.environ.get("TRACKER_RETENCION_DIAS", "90"))
+
+# Eventos que se conservan tal cual (salvo el adelgazamiento de ``user``).
+TIPOS_CONSERVADOS = ("user", "bot", "session_started", "restart")
+# Los que se conservan aunque no tengan texto: marcan límites de la conversación.
+TIPOS_LIMITE = ("session_started", "restart")
+# Eventos que dejan los slots vacíos al reproducir el tracker.
+TIPOS_REINICIO = ("restart", "reset_slots", "session_started")
+# Claves de ``parse_data`` que solo sirven para depurar el NLU.
+CLAVES_NLU_DESCARTADAS = ("intent_ranking", "response_selector")
+
+
+def _adelgazar_usuario(data: dict) -> Optional[dict]:
+    """Copia de un evento ``user`` sin los detalles del NLU, o ``None`` si ya lo está."""
+    parse_data = data.get("parse_data") or {}
+    if not any(clave in parse_data for clave in CLAVES_NLU_DESCARTADAS):
+        return None
+    return {
+        **data,
+        "parse_data": {k: v for k, v in parse_data.items() if k not in CLAVES_NLU_DESCARTADAS},
+    }
+
+
+def compactar_remitente(conn, sender_id: str, limite_ts: float) -> Dict[str, int]:
+    """Compacta los eventos de ``sender_id`` anteriores a ``limite_ts``.
+
+    Solo se procesa el tramo inicial de eventos que son a la vez anteriores a
+    ``limite_ts`` y a la última sesión; el resto queda como está.
+    """
+    resultado = {"borrados": 0, "reescritos": 0, "slots": 0}
+    with transaccion_inmediata(conn):
+        ultima_sesion = conn.execute(
+            "SELECT MAX(id) FROM events WHERE sender_id = ? AND type_name = 'session_started'",
+            (sender_id,),
+        ).fetchone()[0]
+        if ultima_sesion is None:
+            # Una sola sesión: es la que Rasa carga, no se toca.
+            return resultado
+        primero_reciente = conn.execute(
+            "SELECT MIN(id) FROM events WHERE sender_id = ? AND timestamp >= ?",
+            (sender_id, limite_ts),
+        ).fetchone()[0]
+        fin = min(ultima_sesion, primero_reciente or ultima_sesion)
+        filas = conn.execute(
+            "SELECT id, type_name, data FROM events WHERE sender_id = ? AND id < ? ORDER BY id",
+            (sender_id, fin),
+        ).fetchall()
+
+        borrar: List[int] = []
+        reescribir = []
+        slots: Dict[str, object] = {}
+        for id_evento, tipo, data in filas:
+            evento = json.loads(data)
+            if tipo in TIPOS_REINICIO:
+                slots.clear()
+            if tipo == "slot":
+                slots[evento.get("name")] = evento
+            if tipo in TIPOS_CONSERVADOS and (tipo in TIPOS_LIMITE or evento.get("text")):
+                if tipo == "user":
+                    delgado = _adelgazar_usuario(evento)
+                    if delgado is not None:
+                        reescribir.append((json.dumps(delgado), id_evento))
+                continue
+            borrar.append(id_evento)
+
+        # La instantánea va al final del tramo: reutiliza los últimos ``id``
+        # borrados, que son posteriores al último reinicio de los slots.
+        instantanea = list(slots.values())
+        huecos = borrar[len(borrar) - len(instantanea):] if instantanea else []
+        if len(borrar) == len(instantanea) and not reescribir:
+            # Ya compactado: solo quedan los slots de una instantánea anterior.
+            return resultado
+
+        conn.executemany("DELETE FROM events WHERE id = ?", [(i,) for i in borrar])
+        conn.executemany("UPDATE events SET data = ? WHERE id = ?", reescribir)
+        conn.executemany(
+            "INSERT INTO events (id, sender_id, type_name, timestamp, intent_name, action_name, data) "
+            "VALUES (?, ?, 'slot', ?, NULL, ?, ?)",
+            [
+                (id_evento, sender_id, evento.get("timestamp"), evento.get("name"), json.dumps(evento))
+                for id_evento, evento in zip(huecos, instantanea)
+            ],
+        )
+        resultado.update(
+            borrados=len(borrar) - len(instantanea), reescritos=len(reescribir), slots=len(instantanea)
+        )
+    return resultado
+
+
+def compactar(conn, retencion_dias: int = RETENCION_DIAS, ahora: Optional[float] = None) -> Dict[str, int]:
+    """Compacta todos los remitentes con eventos fuera de la ventana."""
+    limite_ts = (ahora if ahora is not None else time.time()) - retencion_dias * 86400
+    remitentes = [
+        fila[0]
+        for fila in conn.execute(
+            "SELECT DISTINCT sender_id FROM events WHERE timestamp < ?", (limite_ts,)
+        ).fetchall()
+    ]
+    totales = {"remitentes": 0, "borrados": 0, "reescritos": 0, "slots": 0}
+    for sender_id in remitentes:
+        resultado = compactar_remitente(conn, sender_id, limite_ts)
+        if resultado["borrados"] or resultado["reescritos"]:
+            totales["remitentes"] += 1
+        for clave, valor in resultado.items():
+            totales[clave] += valor
+    return totales
+
+
+def tamano_bd(conn) -> int:
+    """Bytes que ocupa la base (sin el WAL, que se vuelca antes)."""
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+    return paginas * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+# Valor de ``PRAGMA auto_vacuum`` con el modo incremental activo.
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _paginas(conn) -> int:
+    return conn.execute("PRAGMA page_count").fetchone()[0]
+
+
+def vacuum_incremental_activo(conn) -> bool:
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+
+
+def vaciar_incremental(conn, paginas_por_paso: int = 1000) -> int:
+    """Devuelve al sistema las páginas libres, por pasos para no bloquear a Rasa.
+
+    Solo actúa si la base tiene ``auto_vacuum = INCREMENTAL``; si no, no hace
+    nada (ver ``vacuum_completo``). Devuelve las páginas en que encogió el archivo.
+    """
+    if not vacuum_incremental_activo(conn):
+        return 0
+    antes = _paginas(conn)
+    libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while libres:
+        # ``execute`` solo avanza un paso de la sentencia (una página);
+        # ``executescript`` la ejecuta completa.
+        conn.executescript(f"PRAGMA incremental_vacuum({min(libres, paginas_por_paso)});")
+        quedan = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if quedan >= libres:
+            break
+        libres = quedan
+    return antes - _paginas(conn)
+
+
+def vacuum_completo(conn) -> int:
+    """Reconstruye el archivo con ``VACUUM`` y deja activo ``auto_vacuum = INCREMENTAL``.
+
+    Bloquea las escrituras de Rasa mientras dura. Devuelve las páginas en que
+    encogió el archivo.
+    """
+    antes = _paginas(conn)
+    conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+    conn.execute("VACUUM")
+    return antes - _paginas(conn)
+
+
+def bytes_eventos(conn) -> int:
+    """Bytes de ``data`` de todos los eventos (lo que ocupan los datos en sí)."""
+    return conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM events").fetchone()[0]
+
+
+def remitentes_mayores(conn, cuantos: int) -> List[str]:
+    return [
+        fila[0]
+        for fila in conn.execute(
+            "SELECT sender_id FROM events GROUP BY sender_id ORDER BY COUNT(*) DESC LIMIT ?", (cuantos,)
+        ).fetchall()
+    ]
+
+
+def medir_carga(conn, remitentes: List[str], repeticiones: int = 3) -> float:
+    """Mediana en ms de leer y decodificar el tracker completo de cada remitente.
+
+    Es lo que hace ``retrieve_full_tracker`` (por ejemplo, la API de trackers de
+    Rasa); si Rasa está instalado también se convierten los eventos.
+    """
+    try:
+        from rasa.shared.core.events import deserialise_events
+    except ImportError:
+        deserialise_events = None
+
+    tiempos = []
+    for sender_id in remitentes:
+        mejor = float("inf")
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            eventos = [
+                json.loads(data)
+                for (data,) in conn.execute(
+                    "SELECT data FROM events WHERE sender_id = ? ORDER BY id", (sender_id,)
+                )
+            ]
+            if deserialise_events is not None:
+                deserialise_events(eventos)
+            mejor = min(mejor, time.perf_counter() - inicio)
+        tiempos.append(mejor)
+    return statistics.median(tiempos) * 1000 if tiempos else 0.0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--db", default=TRACKER_DB)
+    parser.add_argument("--retencion-dias", type=int, default=RETENCION_DIAS)
+    parser.add_argument("--paginas-por-paso", type=int, default=1000,
+                        help="páginas liberadas en cada incremental_vacuum")
+    parser.add_argument("--muestra", type=int, default=20,
+                        help="remitentes (los de más eventos) para medir la carga del tracker")
+    parser.add_argument("--vacuum-completo", action="store_true",
+                        help="reconstruir el archivo con VACUUM (bloquea las escrituras mientras dura)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"No existe {args.db}", file=sys.stderr)
+        return 1
+
+    conn = abrir_conexion(args.db)
+    try:
+        muestra = remitentes_mayores(conn, args.muestra)
+        carga_antes = medir_carga(conn, muestra)
+        bytes_antes = tamano_bd(conn)
+        datos_antes = bytes_eventos(conn)
+
+        inicio = time.perf_counter()
+        totales = compactar(conn, args.retencion_dias)
+        duracion = time.perf_counter() - inicio
+        if args.vacuum_completo:
+            paginas = vacuum_completo(conn)
+        elif vacuum_incremental_activo(conn):
+            paginas = vaciar_incremental(conn, args.paginas_por_paso)
+        else:
+            paginas = 0
+            print(
+                f"Aviso: {args.db} no tiene auto_vacuum = INCREMENTAL, así que las páginas libres "
+                "no se devuelven al sistema. Ejecuta una vez con --vacuum-completo (bloquea las "
+                "escrituras de Rasa mientras dura) para activarlo.",
+                file=sys.stderr,
+            )
+        bytes_despues = tamano_bd(conn)
+        datos_despues = bytes_eventos(conn)
+        carga_despues = medir_carga(conn, muestra)
+    finally:
+        conn.close()
+
+    print(
+        f"{totales['remitentes']} remitentes compactados en {duracion:.1f} s: "
+        f"{totales['borrados']} eventos borrados, {totales['reescritos']} mensajes adelgazados, "
+        f"{totales['slots']} slots en instantáneas"
+    )
+    print(
+        f"Tamaño: {bytes_antes / 1e6:.1f} MB -> {bytes_despues / 1e6:.1f} MB "
+        f"({bytes_antes - bytes_despues} bytes recuperados, {paginas} páginas devueltas); "
+        f"datos de los eventos: {datos_antes / 1e6:.1f} MB -> {datos_despues / 1e6:.1f} MB"
+    )
+    print(
+        f"Carga del tracker completo ({len(muestra)} remitentes, mediana): "
+        f"{carga_antes:.2f} ms -> {carga_despues:.2f} ms"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
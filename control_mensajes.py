@@ -0,0 +1,210 @@
+"""Control de flujo de los mensajes que llegan por Socket.IO.
+
+Cada ``user_uttered`` se pasaba a Rasa en cuanto llegaba, sin límite: un cliente
+que envía mensajes en bucle (o que los reenvía al reconectarse) acumulaba
+trabajo sin fin en el agente y en el servidor de acciones, y las demás
+conversaciones esperaban detrás. Aquí cada remitente tiene:
+
+- un cubo de tokens (``SOCKET_RAFAGA`` mensajes de golpe y
+  ``SOCKET_MENSAJES_POR_S`` por segundo después);
+- una cola de como mucho ``SOCKET_COLA_MAX`` mensajes, que se procesan de uno
+  en uno y en orden.
+
+Además, entre todos los remitentes, como mucho ``SOCKET_CONCURRENCIA_MAX``
+mensajes se procesan a la vez. Un remitente ocupa una sola plaza, así que no
+puede acaparar las demás.
+
+Lo que no cabe (sin tokens o con la cola llena) sigue ``SOCKET_POLITICA_SOBRECARGA``:
+
+- ``descartar``: se ignora.
+- ``fusionar``: sustituye al último mensaje de la cola que aún no ha empezado
+  a procesarse (gana el más reciente); sin mensajes pendientes, se ignora.
+- ``avisar``: se ignora y el bot contesta ``SOCKET_AVISO_TEXTO``, como mucho
+  una vez cada ``SOCKET_AVISO_INTERVALO_S`` por remitente.
+
+Los límites son de cada proceso de Rasa.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from metricas import REGISTRO
+
+logger = logging.getLogger(__name__)
+
+SOCKET_MENSAJES_POR_S = float(os.environ.get("SOCKET_MENSAJES_POR_S", "1"))
+SOCKET_RAFAGA = int(os.environ.get("SOCKET_RAFAGA", "5"))
+SOCKET_COLA_MAX = int(os.environ.get("SOCKET_COLA_MAX", "3"))
+SOCKET_CONCURRENCIA_MAX = int(os.environ.get("SOCKET_CONCURRENCIA_MAX", "32"))
+SOCKET_POLITICA_SOBRECARGA = os.environ.get("SOCKET_POLITICA_SOBRECARGA", "avisar")
+SOCKET_AVISO_TEXTO = os.environ.get(
+    "SOCKET_AVISO_TEXTO", "Espera un momento, todavía estoy respondiendo a tus mensajes anteriores."
+)
+SOCKET_AVISO_INTERVALO_S = float(os.environ.get("SOCKET_AVISO_INTERVALO_S", "10"))
+SOCKET_REMITENTES_MAX = int(os.environ.get("SOCKET_REMITENTES_MAX", "10000"))
+
+POLITICAS = ("descartar", "fusionar", "avisar")
+
+metrica_mensajes = REGISTRO.contador(
+    "socket_mensajes_total", "Mensajes de usuario recibidos por Socket.IO, según lo que se hizo con ellos.",
+    ("resultado",),
+)
+metrica_limitados = REGISTRO.contador(
+    "socket_mensajes_limitados_total", "Mensajes que no cupieron, por sin tokens (tasa) o cola llena (cola).",
+    ("motivo",),
+)
+metrica_espera = REGISTRO.histograma(
+    "socket_mensajes_espera_segundos", "Tiempo desde que llega un mensaje hasta que Rasa empieza a procesarlo."
+)
+metrica_en_proceso = REGISTRO.medidor(
+    "socket_mensajes_en_proceso", "Mensajes que Rasa está procesando ahora mismo."
+)
+
+
+class CuboTokens:
+    """Cubo de tokens: ``capacidad`` de golpe y ``recarga_por_s`` tokens por segundo."""
+
+    def __init__(self, capacidad: int, recarga_por_s: float):
+        self.capacidad = max(1, capacidad)
+        self.recarga_por_s = recarga_por_s
+        self.tokens = float(self.capacidad)
+        self._ultimo = time.monotonic()
+
+    def tomar(self) -> bool:
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self._ultimo) * self.recarga_por_s)
+        self._ultimo = ahora
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class _Remitente:
+    __slots__ = ("cubo", "cola", "procesando", "ultimo_aviso")
+
+    def __init__(self, cubo: CuboTokens):
+        self.cubo = cubo
+        self.cola: Deque = deque()
+        self.procesando = False
+        self.ultimo_aviso = float("-inf")
+
+
+class ControlMensajes:
+    """Colas por remitente, cubo de tokens y plazas globales para ``on_new_message``.
+
+    ``recibir`` devuelve enseguida (``aceptado``, ``fusionado``, ``descartado``
+    o ``avisado``); los mensajes aceptados se procesan en una tarea por
+    remitente que vacía su cola.
+    """
+
+    def __init__(
+        self,
+        mensajes_por_s: float = SOCKET_MENSAJES_POR_S,
+        rafaga: int = SOCKET_RAFAGA,
+        cola_max: int = SOCKET_COLA_MAX,
+        concurrencia_max: int = SOCKET_CONCURRENCIA_MAX,
+        politica: str = SOCKET_POLITICA_SOBRECARGA,
+        aviso_texto: str = SOCKET_AVISO_TEXTO,
+        aviso_intervalo_s: float = SOCKET_AVISO_INTERVALO_S,
+        remitentes_max: int = SOCKET_REMITENTES_MAX,
+    ):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de sobrecarga desconocida: {politica!r} (usa una de {POLITICAS})")
+        self.mensajes_por_s = mensajes_por_s
+        self.rafaga = rafaga
+        self.cola_max = max(1, cola_max)
+        self.concurrencia_max = max(1, concurrencia_max)
+        self.politica = politica
+        self.aviso_texto = aviso_texto
+        self.aviso_intervalo_s = aviso_intervalo_s
+        self.remitentes_max = remitentes_max
+        self._remitentes: "OrderedDict[str, _Remitente]" = OrderedDict()
+        # Se crea dentro del bucle de eventos de Rasa, en el primer mensaje.
+        self._plazas: Optional[asyncio.Semaphore] = None
+        self._en_proceso = 0
+        self._stats = {resultado: 0 for resultado in ("aceptado", "fusionado", "descartado", "avisado")}
+        self._stats.update(limitado_tasa=0, limitado_cola=0)
+
+    def _remitente(self, sender_id: str) -> _Remitente:
+        estado = self._remitentes.get(sender_id)
+        if estado is not None:
+            self._remitentes.move_to_end(sender_id)
+            return estado
+        estado = self._remitentes[sender_id] = _Remitente(CuboTokens(self.rafaga, self.mensajes_por_s))
+        if len(self._remitentes) > self.remitentes_max:
+            # Se olvida el remitente inactivo que lleva más tiempo sin escribir.
+            for antiguo, datos in self._remitentes.items():
+                if not datos.procesando and antiguo != sender_id:
+                    del self._remitentes[antiguo]
+                    break
+        return estado
+
+    def _contar(self, resultado: str) -> str:
+        self._stats[resultado] += 1
+        metrica_mensajes.inc(resultado=resultado)
+        return resultado
+
+    async def recibir(self, mensaje: Any, procesar: Callable[[Any], Awaitable[Any]]) -> str:
+        """Encola ``mensaje`` (un ``UserMessage``) o aplica la política de sobrecarga."""
+        estado = self._remitente(mensaje.sender_id)
+        motivo = None
+        # Con la cola llena el mensaje no gasta token.
+        if len(estado.cola) >= self.cola_max:
+            motivo = "cola"
+        elif not estado.cubo.tomar():
+            motivo = "tasa"
+
+        if motivo is None:
+            estado.cola.append((mensaje, time.monotonic()))
+            if not estado.procesando:
+                estado.procesando = True
+                asyncio.ensure_future(self._vaciar(mensaje.sender_id, estado, procesar))
+            return self._contar("aceptado")
+
+        self._stats[f"limitado_{motivo}"] += 1
+        metrica_limitados.inc(motivo=motivo)
+        logger.debug("[SOCKET MESSAGE] Mensaje limitado (%s) para sender_id=%s", motivo, mensaje.sender_id)
+        if self.politica == "fusionar" and estado.cola:
+            estado.cola[-1] = (mensaje, estado.cola[-1][1])
+            return self._contar("fusionado")
+        if self.politica == "avisar":
+            ahora = time.monotonic()
+            if ahora - estado.ultimo_aviso >= self.aviso_intervalo_s:
+                estado.ultimo_aviso = ahora
+                await mensaje.output_channel.send_text_message(mensaje.sender_id, self.aviso_texto)
+                return self._contar("avisado")
+        return self._contar("descartado")
+
+    async def _vaciar(self, sender_id: str, estado: _Remitente, procesar) -> None:
+        if self._plazas is None:
+            self._plazas = asyncio.Semaphore(self.concurrencia_max)
+        try:
+            while estado.cola:
+                # El mensaje se saca al obtener la plaza, no antes: mientras
+                # espera todavía se puede fusionar con los que lleguen.
+                async with self._plazas:
+                    mensaje, llegada = estado.cola.popleft()
+                    metrica_espera.observar(time.monotonic() - llegada)
+                    self._en_proceso += 1
+                    metrica_en_proceso.set(self._en_proceso)
+                    try:
+                        await procesar(mensaje)
+                    except Exception:
+                        logger.exception("[SOCKET MESSAGE] Error al procesar el mensaje de sender_id=%s", sender_id)
+                    finally:
+                        self._en_proceso -= 1
+                        metrica_en_proceso.set(self._en_proceso)
+        finally:
+            estado.procesando = False
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "en_proceso": self._en_proceso,
+            "en_cola": sum(len(estado.cola) for estado in self._remitentes.values()),
+            "remitentes": len(self._remitentes),
+        }
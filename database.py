@@ -0,0 +1,751 @@
+"""Acceso compartido a la base de datos SQLite ``usuarios.db``.
+
+El backend de Flask y las acciones de Rasa trabajan sobre el mismo archivo,
+por lo que la configuración de las conexiones vive en un único lugar.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# USUARIOS_DB permite apuntar a otra base (por ejemplo, la sintética de los benchmarks).
+DB_PATH = os.environ.get("USUARIOS_DB") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "usuarios.db"
+)
+
+# Parámetros ajustables desde el entorno para dimensionar cada despliegue.
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_KB", "16384"))
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_BYTES", str(64 * 1024 * 1024)))
+
+
+def configurar_conexion(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Aplica los PRAGMA de rendimiento y de integridad a una conexión."""
+    # WAL permite que los lectores no bloqueen al escritor (y viceversa);
+    # con WAL, synchronous=NORMAL sigue siendo seguro ante caídas del proceso.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # Un valor negativo indica el tamaño de la caché en KiB.
+    conn.execute(f"PRAGMA cache_size = {-CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+# Funciones ``(sql, segundos, cursor)`` que se llaman tras cada sentencia.
+# ``set_trace_callback`` de sqlite3 solo entrega el texto de la sentencia, sin
+# su duración, así que la medición se hace envolviendo ``execute``.
+_observadores_consultas: List[Callable] = []
+
+
+def observar_consultas(funcion: Callable) -> Callable:
+    """Registra ``funcion`` para que reciba cada sentencia ejecutada."""
+    _observadores_consultas.append(funcion)
+    return funcion
+
+
+def _notificar(sql: str, segundos: float, cursor: sqlite3.Cursor) -> None:
+    for funcion in _observadores_consultas:
+        funcion(sql, segundos, cursor)
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que informa a los observadores de la duración de cada sentencia.
+
+    El tiempo incluye la preparación y el primer paso de la sentencia; las
+    filas que se recorren después con ``fetch*`` no se cuentan.
+    """
+
+    def execute(self, sql, parametros=()):
+        if not _observadores_consultas:
+            return super().execute(sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            _notificar(sql, time.perf_counter() - inicio, self)
+
+    def executemany(self, sql, parametros):
+        if not _observadores_consultas:
+            return super().executemany(sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            _notificar(sql, time.perf_counter() - inicio, self)
+
+
+class ConexionMedida(sqlite3.Connection):
+    """Conexión cuyos cursores (también los implícitos) son ``CursorMedido``."""
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+
+_fabrica_conexion = ConexionMedida
+
+
+def establecer_fabrica_conexion(fabrica) -> None:
+    """Cambia la clase de las conexiones que se abran a partir de ahora."""
+    global _fabrica_conexion
+    _fabrica_conexion = fabrica
+
+
+def abrir_conexion(path: str = DB_PATH) -> sqlite3.Connection:
+    """Abre una conexión configurada que puede compartirse entre hilos."""
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        factory=_fabrica_conexion,
+    )
+    conn.row_factory = sqlite3.Row
+    return configurar_conexion(conn)
+
+
+class PoolConexiones:
+    """Pool acotado de conexiones SQLite reutilizables.
+
+    Las conexiones se crean bajo demanda hasta ``tamano`` y se devuelven a una
+    cola al terminar cada petición. Las estadísticas permiten dimensionar el
+    pool: ``aciertos`` son conexiones reutilizadas, ``creadas`` las abiertas
+    desde cero y ``esperas`` las veces que una petición tuvo que aguardar a que
+    otra liberara su conexión.
+    """
+
+    def __init__(self, path: str = DB_PATH, tamano: int = 8, timeout: float = 10.0):
+        self.path = path
+        self.tamano = max(1, tamano)
+        self.timeout = timeout
+        self._libres: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._creadas = 0
+        self._stats = {
+            "aciertos": 0,
+            "creadas": 0,
+            "esperas": 0,
+            "tiempo_espera_s": 0.0,
+            "agotado": 0,
+        }
+
+    def adquirir(self) -> sqlite3.Connection:
+        """Entrega una conexión libre, creando una nueva si hay cupo."""
+        try:
+            conn = self._libres.get_nowait()
+        except queue.Empty:
+            conn = None
+        if conn is not None:
+            with self._lock:
+                self._stats["aciertos"] += 1
+            return conn
+
+        with self._lock:
+            crear = self._creadas < self.tamano
+            if crear:
+                self._creadas += 1
+                self._stats["creadas"] += 1
+        if crear:
+            try:
+                return abrir_conexion(self.path)
+            except Exception:
+                with self._lock:
+                    self._creadas -= 1
+                raise
+
+        inicio = time.perf_counter()
+        try:
+            conn = self._libres.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats["agotado"] += 1
+            raise RuntimeError("No hay conexiones libres a la base de datos")
+        with self._lock:
+            self._stats["esperas"] += 1
+            self._stats["tiempo_espera_s"] += time.perf_counter() - inicio
+        return conn
+
+    def liberar(self, conn: sqlite3.Connection) -> None:
+        """Devuelve la conexión al pool descartando transacciones abiertas."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Una conexión en mal estado no vuelve al pool.
+            with self._lock:
+                self._creadas -= 1
+            conn.close()
+            return
+        self._libres.put(conn)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            datos = dict(self._stats)
+            datos["abiertas"] = self._creadas
+        datos["libres"] = self._libres.qsize()
+        datos["tamano"] = self.tamano
+        return datos
+
+    def cerrar(self) -> None:
+        """Cierra las conexiones libres; las que estén en uso se cierran al volver."""
+        while True:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._creadas -= 1
+            conn.close()
+
+
+# Estados que ocupan un bloque de la agenda.
+ESTADOS_ACTIVOS = ("confirmada", "reprogramada", "en progreso")
+
+# Bloques de atención en orden; la posición define el bit de cada horario.
+HORARIOS = ("08:00", "10:00", "12:00", "14:00", "16:00", "18:00")
+BIT_HORARIO = {hora: 1 << posicion for posicion, hora in enumerate(HORARIOS)}
+
+
+class HorarioOcupadoError(Exception):
+    """El bloque de fecha y hora ya está tomado por otra cita activa."""
+
+
+def _resolver_bloques_duplicados(conn: sqlite3.Connection) -> List[tuple]:
+    """Deja una sola cita activa por bloque antes de crear ``ux_citas_bloque_activo``.
+
+    En cada bloque con varias citas activas se conserva la más antigua (la de
+    menor ``rowid``) y las demás pasan a ``cancelada``; cada caso queda en el
+    log para poder avisar a los clientes. El estado se compara normalizado,
+    como hacía la comprobación de choques anterior, así que ``'Confirmada '``
+    cuenta como activa. Devuelve ``(fecha, hora, conservada, canceladas)``.
+    """
+    marcadores = ", ".join("?" for _ in ESTADOS_ACTIVOS)
+    filas = conn.execute(
+        f"""
+        SELECT id_citas, fecha, hora FROM citas
+        WHERE lower(trim(estado)) IN ({marcadores})
+          AND (fecha, hora) IN (
+              SELECT fecha, hora FROM citas
+              WHERE lower(trim(estado)) IN ({marcadores})
+              GROUP BY fecha, hora
+              HAVING COUNT(*) > 1
+          )
+        ORDER BY fecha, hora, rowid
+        """,
+        ESTADOS_ACTIVOS * 2,
+    ).fetchall()
+    bloques: Dict[tuple, List[str]] = {}
+    for id_cita, fecha, hora in filas:
+        bloques.setdefault((fecha, hora), []).append(id_cita)
+    resueltos = []
+    for (fecha, hora), ids in bloques.items():
+        conservada, canceladas = ids[0], ids[1:]
+        conn.executemany("UPDATE citas SET estado = 'cancelada' WHERE id_citas = ?", [(i,) for i in canceladas])
+        logger.warning(
+            "Bloque %s %s con %d citas activas: se conserva %s y se cancelan %s",
+            fecha, hora, len(ids), conservada, ", ".join(canceladas),
+        )
+        resueltos.append((fecha, hora, conservada, canceladas))
+    return resueltos
+
+
+def _normalizar_estados(conn: sqlite3.Connection) -> None:
+    """Guarda ``estado`` en minúsculas y sin espacios, como lo compara el índice parcial."""
+    conn.execute("UPDATE citas SET estado = lower(trim(estado)) WHERE estado != lower(trim(estado))")
+
+
+ESQUEMA_CITAS = """
+    CREATE TABLE citas (
+        id_citas TEXT PRIMARY KEY,
+        id_usuario TEXT NOT NULL,
+        servicio TEXT NOT NULL,
+        fecha TEXT NOT NULL,
+        hora TEXT NOT NULL,
+        estado TEXT NOT NULL CHECK (
+            estado IN ('confirmada','reprogramada','en progreso','cancelada','completada')
+        ),
+        id_mecanico TEXT,
+        inicio_ts INTEGER,
+        FOREIGN KEY(id_usuario) REFERENCES usuarios(id_usuario),
+        FOREIGN KEY(id_mecanico) REFERENCES mecanicos(id_mecanico)
+    )
+"""
+
+
+def _reconstruir_citas_legado(conn: sqlite3.Connection) -> None:
+    """Rehace ``citas`` si su CHECK de estados es anterior a 'en progreso'.
+
+    SQLite no permite modificar un CHECK, así que la tabla se copia a una nueva.
+    Los índices desaparecen con la tabla anterior y se vuelven a crear.
+    """
+    fila = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='citas'").fetchone()
+    esquema = fila[0] if fila else ""
+    if "estado IN" not in esquema or "en progreso" in esquema:
+        return
+    columnas = [c[1] for c in conn.execute("PRAGMA table_info(citas)").fetchall()]
+    id_mecanico = "id_mecanico" if "id_mecanico" in columnas else "NULL"
+    conn.execute("ALTER TABLE citas RENAME TO citas_old")
+    conn.execute(ESQUEMA_CITAS)
+    conn.execute(
+        f"""
+        INSERT INTO citas (id_citas, id_usuario, servicio, fecha, hora, estado, id_mecanico)
+        SELECT id_citas, id_usuario, servicio, fecha, hora, estado, {id_mecanico}
+        FROM citas_old
+        """
+    )
+    conn.execute("DROP TABLE citas_old")
+    for numero, pasos in MIGRACIONES:
+        if numero >= 4:
+            break
+        for paso in pasos:
+            paso(conn) if callable(paso) else conn.execute(paso)
+
+
+COLUMNAS_CITAS = (
+    "id_citas", "id_usuario", "servicio", "fecha", "hora", "estado", "id_mecanico", "inicio_ts",
+)
+
+# ``citas.inicio_ts``: inicio de la cita en segundos desde la época. America/La_Paz
+# está en UTC-4 todo el año (no tiene horario de verano), así que basta con
+# interpretar fecha y hora como UTC y sumar el desfase. Los disparadores lo
+# mantienen en cada escritura, venga del backend, de las acciones o de una
+# importación.
+DESFASE_UTC_S = 4 * 3600
+
+
+def _sql_inicio_ts(prefijo: str = "") -> str:
+    return (
+        f"CAST(strftime('%s', {prefijo}fecha || ' ' || {prefijo}hora) AS INTEGER)"
+        f" + {DESFASE_UTC_S}"
+    )
+
+
+def _agregar_inicio_ts(conn: sqlite3.Connection) -> None:
+    columnas = [c[1] for c in conn.execute("PRAGMA table_info(citas)").fetchall()]
+    if "inicio_ts" not in columnas:
+        conn.execute("ALTER TABLE citas ADD COLUMN inicio_ts INTEGER")
+    conn.execute(f"UPDATE citas SET inicio_ts = {_sql_inicio_ts()}")
+
+
+# Migraciones del esquema, identificadas por ``PRAGMA user_version``. Cada
+# paso es una lista de sentencias SQL (o funciones que reciben la conexión)
+# y se aplica una sola vez, en orden, dentro de una transacción.
+MIGRACIONES = (
+    (
+        1,
+        (
+            # Choques de horario y disponibilidad por fecha (y rangos del calendario).
+            "CREATE INDEX IF NOT EXISTS idx_citas_fecha_hora ON citas (fecha, hora, estado)",
+            # Citas del usuario: próxima cita, cancelación, historial y /citas.
+            "CREATE INDEX IF NOT EXISTS idx_citas_usuario ON citas (id_usuario, estado, fecha, hora)",
+            # Agenda del panel de mecánicos ordenada por fecha y hora.
+            "CREATE INDEX IF NOT EXISTS idx_citas_mecanico ON citas (id_mecanico, fecha, hora)",
+        ),
+    ),
+    (
+        2,
+        (
+            _resolver_bloques_duplicados,
+            _normalizar_estados,
+            # La base de datos garantiza que un bloque tenga una sola cita activa.
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_citas_bloque_activo
+            ON citas (fecha, hora)
+            WHERE estado IN ('confirmada', 'reprogramada', 'en progreso')
+            """,
+        ),
+    ),
+    (
+        3,
+        (
+            # Recorrido por páginas de la agenda del panel (orden fecha, hora, id).
+            "CREATE INDEX IF NOT EXISTS idx_citas_agenda ON citas (fecha, hora, id_citas)",
+        ),
+    ),
+    (
+        4,
+        (
+            # Antes lo hacía el servidor de acciones en cada arranque.
+            _reconstruir_citas_legado,
+        ),
+    ),
+    (
+        5,
+        (
+            _agregar_inicio_ts,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_citas_inicio_ts_insert
+            AFTER INSERT ON citas
+            BEGIN
+                UPDATE citas SET inicio_ts = {_sql_inicio_ts("NEW.")} WHERE rowid = NEW.rowid;
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_citas_inicio_ts_update
+            AFTER UPDATE OF fecha, hora ON citas
+            BEGIN
+                UPDATE citas SET inicio_ts = {_sql_inicio_ts("NEW.")} WHERE rowid = NEW.rowid;
+            END
+            """,
+            # Próxima cita, historial y cita activa del usuario con un único
+            # recorrido acotado del índice. El estado va al final para filtrarse
+            # dentro del índice sin perder el orden por inicio_ts (sin ORDER BY
+            # en memoria).
+            "CREATE INDEX IF NOT EXISTS idx_citas_usuario_inicio ON citas (id_usuario, inicio_ts, estado)",
+        ),
+    ),
+    (
+        6,
+        (
+            # Barrido de citas vencidas: solo indexa las que siguen pendientes,
+            # que tras cada pasada son pocas.
+            """
+            CREATE INDEX IF NOT EXISTS idx_citas_pendientes_inicio
+            ON citas (inicio_ts)
+            WHERE estado IN ('confirmada', 'reprogramada')
+            """,
+        ),
+    ),
+    (
+        7,
+        (
+            # Citas terminadas que superan la retención (ver ``archivar_citas``).
+            # Sin CHECK ni disparadores: las filas llegan ya completas desde citas.
+            """
+            CREATE TABLE IF NOT EXISTS citas_archivo (
+                id_citas TEXT PRIMARY KEY,
+                id_usuario TEXT NOT NULL,
+                servicio TEXT NOT NULL,
+                fecha TEXT NOT NULL,
+                hora TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                id_mecanico TEXT,
+                inicio_ts INTEGER,
+                FOREIGN KEY(id_usuario) REFERENCES usuarios(id_usuario) ON DELETE CASCADE,
+                FOREIGN KEY(id_mecanico) REFERENCES mecanicos(id_mecanico) ON DELETE SET NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_citas_archivo_usuario ON citas_archivo (id_usuario, inicio_ts, estado)",
+            "CREATE INDEX IF NOT EXISTS idx_citas_archivo_fecha ON citas_archivo (fecha, hora, id_citas)",
+            # Historial completo para las lecturas que deben ver ambas tablas.
+            f"""
+            CREATE VIEW IF NOT EXISTS citas_todas AS
+            SELECT {", ".join(COLUMNAS_CITAS)} FROM citas
+            UNION ALL
+            SELECT {", ".join(COLUMNAS_CITAS)} FROM citas_archivo
+            """,
+        ),
+    ),
+    (
+        8,
+        (
+            # Bases que ya tenían el índice del paso 2: las citas con el estado
+            # escrito de otra forma ('Confirmada ') quedaban fuera de él.
+            _resolver_bloques_duplicados,
+            _normalizar_estados,
+        ),
+    ),
+)
+
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
+
+
+def version_esquema(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def aplicar_migraciones(conn: sqlite3.Connection) -> int:
+    """Lleva el esquema de ``citas`` a ``VERSION_ESQUEMA`` y devuelve la versión.
+
+    Backend y servidor de acciones pueden arrancar a la vez, por eso la versión
+    se vuelve a leer tras ``BEGIN IMMEDIATE``: solo un proceso aplica cada paso.
+    """
+    if version_esquema(conn) >= VERSION_ESQUEMA:
+        return version_esquema(conn)
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = version_esquema(conn)
+        for numero, pasos in MIGRACIONES:
+            if numero <= version:
+                continue
+            for paso in pasos:
+                if callable(paso):
+                    paso(conn)
+                else:
+                    conn.execute(paso)
+            conn.execute(f"PRAGMA user_version = {numero}")
+            version = numero
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
+
+
+@contextmanager
+def transaccion_inmediata(conn: sqlite3.Connection):
+    """Abre una transacción que toma el bloqueo de escritura desde el inicio.
+
+    Así la lectura previa (por ejemplo, buscar la cita a reprogramar) y la
+    escritura posterior ocurren sin que otro proceso escriba entre ambas.
+
+    Si quien llama ya tiene una transacción abierta, no se confirma a sus
+    espaldas: el bloque se anida en un ``SAVEPOINT`` (deshecho si falla) y la
+    confirmación queda a cargo de quien abrió la transacción.
+    """
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT transaccion_inmediata")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO transaccion_inmediata")
+            conn.execute("RELEASE transaccion_inmediata")
+            raise
+        conn.execute("RELEASE transaccion_inmediata")
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def guardar_cita(
+    conn: sqlite3.Connection, sql: str, parametros, muchos: bool = False
+) -> sqlite3.Cursor:
+    """Ejecuta un INSERT/UPDATE sobre ``citas`` detectando choques de horario.
+
+    El índice ``ux_citas_bloque_activo`` rechaza una segunda cita activa en el
+    mismo bloque; ese error se traduce a ``HorarioOcupadoError``. Con
+    ``muchos=True`` ``parametros`` es una secuencia de filas (``executemany``).
+    """
+    try:
+        if muchos:
+            return conn.executemany(sql, parametros)
+        return conn.execute(sql, parametros)
+    except sqlite3.IntegrityError as exc:
+        if "citas.fecha, citas.hora" in str(exc):
+            raise HorarioOcupadoError(str(exc)) from exc
+        raise
+
+
+# Duración de un bloque de la agenda: una cita se da por terminada cuando pasa
+# este tiempo desde su inicio.
+DURACION_BLOQUE_S = 2 * 3600
+
+
+def barrer_citas_vencidas(
+    conn: sqlite3.Connection,
+    margen_s: int = DURACION_BLOQUE_S,
+    lote: int = 500,
+    ahora_ts: Optional[int] = None,
+) -> int:
+    """Pasa a ``completada`` las citas pendientes que terminaron hace tiempo.
+
+    Son las ``confirmada``/``reprogramada`` que empezaron hace más de
+    ``margen_s`` segundos. Se actualizan en lotes de ``lote`` filas, cada uno en
+    su propia transacción, para no retener el bloqueo de escritura mientras
+    hay reservas en curso. Devuelve cuántas citas se actualizaron.
+    """
+    limite = (int(time.time()) if ahora_ts is None else ahora_ts) - margen_s
+    total = 0
+    while True:
+        with transaccion_inmediata(conn):
+            actualizadas = conn.execute(
+                """
+                UPDATE citas SET estado = 'completada'
+                WHERE rowid IN (
+                    SELECT rowid FROM citas
+                    WHERE estado IN ('confirmada', 'reprogramada')
+                      AND inicio_ts < ?
+                    LIMIT ?
+                )
+                """,
+                (limite, lote),
+            ).rowcount
+        total += actualizadas
+        if actualizadas < lote:
+            return total
+
+
+# Estados que ya no cambian: solo estas citas pasan al archivo.
+ESTADOS_TERMINALES = ("cancelada", "completada")
+
+
+def archivar_citas(
+    conn: sqlite3.Connection,
+    retencion_dias: int = 365,
+    lote: int = 2000,
+    hoy: Optional[date] = None,
+) -> int:
+    """Mueve a ``citas_archivo`` las citas terminadas de hace más de ``retencion_dias``.
+
+    Cada lote de ``lote`` filas se copia y se borra de ``citas`` en una misma
+    transacción, así una lectura de ``citas_todas`` nunca ve una cita dos veces
+    ni ninguna. Devuelve cuántas citas se archivaron.
+    """
+    limite = ((hoy or date.today()) - timedelta(days=retencion_dias)).isoformat()
+    columnas = ", ".join(COLUMNAS_CITAS)
+    marcadores = ", ".join("?" for _ in ESTADOS_TERMINALES)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archivar_lote (fila INTEGER PRIMARY KEY)")
+    total = 0
+    while True:
+        with transaccion_inmediata(conn):
+            conn.execute("DELETE FROM temp.archivar_lote")
+            movidas = conn.execute(
+                f"""
+                INSERT INTO temp.archivar_lote
+                SELECT rowid FROM citas
+                WHERE fecha < ? AND estado IN ({marcadores})
+                LIMIT ?
+                """,
+                (limite, *ESTADOS_TERMINALES, lote),
+            ).rowcount
+            if movidas:
+                # OR REPLACE: una cita reimportada con el mismo id ya archivado.
+                conn.execute(
+                    f"""
+                    INSERT OR REPLACE INTO citas_archivo ({columnas})
+                    SELECT {columnas} FROM citas
+                    WHERE rowid IN (SELECT fila FROM temp.archivar_lote)
+                    """
+                )
+                conn.execute("DELETE FROM citas WHERE rowid IN (SELECT fila FROM temp.archivar_lote)")
+        total += movidas
+        if movidas < lote:
+            return total
+
+
+class IndiceDisponibilidad:
+    """Ocupación de la agenda en memoria, como una máscara de bits por día.
+
+    Cada fecha ``YYYY-MM-DD`` se asocia a un entero cuyo bit ``i`` indica que el
+    horario ``HORARIOS[i]`` tiene una cita activa. Los días se cargan de forma
+    perezosa por rangos y las consultas posteriores no tocan la tabla ``citas``.
+
+    Para invalidar se usa ``PRAGMA data_version`` sobre una conexión propia que
+    nunca escribe: su valor cambia cuando cualquier otra conexión (del pool del
+    backend, de otro hilo o de otro proceso como el servidor de acciones)
+    confirma cambios, y en ese caso se descartan todas las máscaras.
+    """
+
+    def __init__(self, path: str = DB_PATH, max_dias: int = 3660):
+        self.path = path
+        self.max_dias = max_dias
+        self.version = 0
+        self._conn = None
+        self._data_version = None
+        self._mascaras: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"aciertos": 0, "cargas": 0, "invalidaciones": 0}
+
+    def _sincronizar(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = abrir_conexion(self.path)
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            if self._data_version is not None:
+                self._descartar()
+            self._data_version = data_version
+        return self._conn
+
+    def _descartar(self) -> None:
+        self._mascaras.clear()
+        self.version += 1
+        self._stats["invalidaciones"] += 1
+
+    def _cargar(self, conn: sqlite3.Connection, desde: date, hasta: date) -> None:
+        dia = desde
+        while dia <= hasta:
+            self._mascaras[dia.isoformat()] = 0
+            dia += timedelta(days=1)
+
+        marcadores = ", ".join("?" for _ in ESTADOS_ACTIVOS)
+        filas = conn.execute(
+            f"""
+            SELECT fecha, hora FROM citas
+            WHERE fecha BETWEEN ? AND ?
+              AND estado IN ({marcadores})
+            """,
+            (desde.isoformat(), hasta.isoformat(), *ESTADOS_ACTIVOS),
+        ).fetchall()
+        for fecha, hora in filas:
+            if fecha in self._mascaras:
+                self._mascaras[fecha] |= BIT_HORARIO.get(hora, 0)
+        self._stats["cargas"] += 1
+
+    def ocupacion(
+        self, fecha_inicio: Union[date, str], fecha_fin: Union[date, str]
+    ) -> Dict[str, int]:
+        """Devuelve la máscara de ocupación de cada día del rango (inclusive)."""
+        if isinstance(fecha_inicio, str):
+            fecha_inicio = date.fromisoformat(fecha_inicio)
+        if isinstance(fecha_fin, str):
+            fecha_fin = date.fromisoformat(fecha_fin)
+        dias = [
+            (fecha_inicio + timedelta(days=n)).isoformat()
+            for n in range((fecha_fin - fecha_inicio).days + 1)
+        ]
+
+        with self._lock:
+            conn = self._sincronizar()
+            if len(self._mascaras) + len(dias) > self.max_dias:
+                # Se vacía antes de calcular qué falta: así el rango completo
+                # se vuelve a cargar y no se pierden días ya contados como
+                # presentes.
+                self._mascaras.clear()
+            faltantes = [dia for dia in dias if dia not in self._mascaras]
+            if faltantes:
+                self._cargar(
+                    conn, date.fromisoformat(faltantes[0]), date.fromisoformat(faltantes[-1])
+                )
+            else:
+                self._stats["aciertos"] += 1
+            return {dia: self._mascaras[dia] for dia in dias}
+
+    def mascara(self, fecha: Union[date, str]) -> int:
+        return self.ocupacion(fecha, fecha).popitem()[1]
+
+    def horarios_libres(self, fecha: Union[date, str]) -> List[str]:
+        ocupados = self.mascara(fecha)
+        return [hora for hora in HORARIOS if not ocupados & BIT_HORARIO[hora]]
+
+    def esta_ocupado(self, fecha: Union[date, str], hora: str) -> bool:
+        return bool(self.mascara(fecha) & BIT_HORARIO.get(hora, 0))
+
+    def version_actual(self) -> int:
+        """Versión de los datos; cambia cada vez que se descartan las máscaras."""
+        with self._lock:
+            self._sincronizar()
+            return self.version
+
+    def invalidar(self) -> None:
+        """Descarta todas las máscaras; la próxima consulta vuelve a la base."""
+        with self._lock:
+            self._descartar()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            datos = dict(self._stats)
+            datos["dias_en_memoria"] = len(self._mascaras)
+            datos["version"] = self.version
+        return datos
@@ -0,0 +1,147 @@
+"""Lectura del historial del chat directamente desde ``tracker.db``.
+
+Rasa guarda cada evento de la conversación en la tabla ``events`` del tracker
+store SQL configurado en ``endpoints.yml`` (una fila por evento, con el JSON
+completo en ``data``). En lugar de descargar el tracker entero por la API HTTP,
+aquí se consultan solo los mensajes de texto del usuario y del bot, con una
+conexión de solo lectura y por páginas.
+
+El alcance es el mismo que el de la API HTTP con ``include_events=after_restart``
+(la ruta de respaldo de ``/historial``): solo los mensajes posteriores al
+último ``restart`` de la conversación. Las sesiones nuevas no lo cortan.
+
+``id`` es la clave primaria entera de ``events`` (el ``rowid``), así que el
+índice de Rasa sobre ``sender_id`` ya lleva las filas de cada conversación en
+orden de llegada: las consultas acotadas por ``id`` recorren un rango de ese
+índice sin tener que escribir nada en ``tracker.db``.
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterator, Optional
+
+TRACKER_DB = os.environ.get("TRACKER_DB") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tracker.db"
+)
+
+HISTORIAL_LIMITE = int(os.environ.get("HISTORIAL_LIMITE", "200"))
+HISTORIAL_LIMITE_MAX = int(os.environ.get("HISTORIAL_LIMITE_MAX", "1000"))
+
+_LOTE = 100
+
+
+class LectorHistorial:
+    """Mensajes de texto de una conversación, leídos de ``events``.
+
+    Cada hilo mantiene su propia conexión en modo de solo lectura
+    (``mode=ro`` y ``query_only``); Rasa sigue siendo el único que escribe.
+    """
+
+    def __init__(self, path: str = TRACKER_DB, busy_timeout_ms: int = 2000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+    def _conexion(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro",
+                uri=True,
+                timeout=self.busy_timeout_ms / 1000,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA query_only = ON")
+            self._local.conn = conn
+        return conn
+
+    def disponible(self) -> bool:
+        """``True`` si existe ``tracker.db`` y tiene la tabla de eventos de Rasa."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            fila = self._conexion().execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'"
+            ).fetchone()
+        except sqlite3.Error:
+            self.cerrar()
+            return False
+        return fila is not None
+
+    def mensajes(
+        self,
+        sender_id: str,
+        limite: int = HISTORIAL_LIMITE,
+        antes_de: Optional[int] = None,
+        desde: Optional[int] = None,
+    ) -> Iterator[dict]:
+        """Mensajes posteriores al último ``restart``, en orden cronológico.
+
+        Sin ``desde`` devuelve los ``limite`` últimos (anteriores a ``antes_de``
+        si se indica); con ``desde`` devuelve los ``limite`` primeros posteriores
+        a ese ``id``, para seguir una conversación de forma incremental. La
+        consulta se ejecuta al llamar (los errores de SQLite salen aquí) y las
+        filas se leen por lotes a medida que se recorre el resultado.
+        """
+        condiciones = [
+            "sender_id = ?",
+            "type_name IN ('user', 'bot')",
+            "json_extract(data, '$.text') <> ''",
+            # Como ``after_restart`` de Rasa: nada anterior al último reinicio.
+            "id > COALESCE((SELECT MAX(id) FROM events WHERE sender_id = ? AND type_name = 'restart'), 0)",
+        ]
+        parametros = [sender_id, sender_id]
+        if antes_de is not None:
+            condiciones.append("id < ?")
+            parametros.append(antes_de)
+        if desde is not None:
+            condiciones.append("id > ?")
+            parametros.append(desde)
+        # Los últimos N se buscan hacia atrás y se devuelven en orden cronológico.
+        orden = "ASC" if desde is not None else "DESC"
+        sql = f"""
+            SELECT id, type_name, texto, timestamp FROM (
+                SELECT id, type_name, json_extract(data, '$.text') AS texto, timestamp
+                FROM events
+                WHERE {" AND ".join(condiciones)}
+                ORDER BY id {orden}
+                LIMIT ?
+            )
+            ORDER BY id ASC
+        """
+        parametros.append(limite)
+
+        return self._recorrer(self._conexion().execute(sql, parametros))
+
+    @staticmethod
+    def _recorrer(cursor: sqlite3.Cursor) -> Iterator[dict]:
+        try:
+            while True:
+                lote = cursor.fetchmany(_LOTE)
+                if not lote:
+                    break
+                for id_evento, tipo, texto, momento in lote:
+                    yield {"id": id_evento, "sender": tipo, "text": texto, "timestamp": momento}
+        finally:
+            cursor.close()
+
+    def cerrar(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+
+def historial_json(mensajes: Iterator[dict]) -> Iterator[str]:
+    """Serializa los mensajes como un arreglo JSON, en fragmentos para streaming."""
+    partes = []
+    separador = "["
+    for mensaje in mensajes:
+        partes.append(separador + json.dumps(mensaje, ensure_ascii=False))
+        separador = ","
+        if len(partes) >= _LOTE:
+            yield "".join(partes)
+            partes.clear()
+    partes.append("[]" if separador == "[" else "]")
+    yield "".join(partes)
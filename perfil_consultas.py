@@ -0,0 +1,270 @@
+"""Perfilador opcional de las consultas a ``usuarios.db``.
+
+Se activa con ``PERFIL_CONSULTAS=1`` y cubre tanto el backend como las
+acciones de Rasa, porque ambos abren sus conexiones con
+``database.abrir_conexion``. Para cada sentencia (normalizada, sin literales)
+acumula llamadas, tiempo y filas; las que superan ``PERFIL_UMBRAL_MS`` se
+guardan junto con su ``EXPLAIN QUERY PLAN``, y cada unidad de trabajo (una
+petición HTTP o una acción) que ejecuta más de ``PERFIL_MAX_CONSULTAS``
+sentencias se marca como posible N+1. El informe se reescribe cada
+``PERFIL_INTERVALO_S`` segundos en ``perfil_consultas-<proceso>.json``.
+"""
+import atexit
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Optional
+
+from database import (
+    ConexionMedida,
+    CursorMedido,
+    establecer_fabrica_conexion,
+    observar_consultas,
+)
+
+logger = logging.getLogger(__name__)
+
+_RE_CADENA = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_ESPACIOS = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalizar_sql(sql: str) -> str:
+    """Quita literales y espacios para agrupar sentencias equivalentes."""
+    sql = _RE_CADENA.sub("?", sql)
+    sql = _RE_NUMERO.sub("?", sql)
+    sql = _RE_ESPACIOS.sub(" ", sql).strip()
+    return _RE_LISTA.sub("(...)", sql)
+
+
+class CursorPerfilado(CursorMedido):
+    """Cursor que además cuenta las filas leídas para el perfilador."""
+
+    _perfil_destinos = ()
+
+    def _sumar_filas(self, cantidad: int) -> None:
+        for destino in self._perfil_destinos:
+            destino["filas"] += cantidad
+
+    def fetchone(self):
+        fila = super().fetchone()
+        if fila is not None:
+            self._sumar_filas(1)
+        return fila
+
+    def fetchmany(self, *args, **kwargs):
+        filas = super().fetchmany(*args, **kwargs)
+        self._sumar_filas(len(filas))
+        return filas
+
+    def fetchall(self):
+        filas = super().fetchall()
+        self._sumar_filas(len(filas))
+        return filas
+
+    def __next__(self):
+        fila = super().__next__()
+        self._sumar_filas(1)
+        return fila
+
+
+class ConexionPerfilada(ConexionMedida):
+    def cursor(self, factory=CursorPerfilado):
+        return super().cursor(factory)
+
+
+class PerfilConsultas:
+    """Acumula estadísticas por sentencia y escribe el informe periódico."""
+
+    def __init__(
+        self,
+        archivo: str,
+        umbral_s: float = 0.05,
+        max_consultas: int = 20,
+        intervalo_s: float = 60.0,
+        max_registros: int = 100,
+    ):
+        self.archivo = archivo
+        self.umbral_s = umbral_s
+        self.max_consultas = max_consultas
+        self.intervalo_s = intervalo_s
+        self._lock = threading.Lock()
+        self._sentencias = {}
+        self._lentas = deque(maxlen=max_registros)
+        self._unidades_sospechosas = deque(maxlen=max_registros)
+        self._unidad: ContextVar[Optional[dict]] = ContextVar("unidad_perfil", default=None)
+        self._ultimo_informe = time.monotonic()
+
+    # --- Captura ---
+
+    def observar(self, sql: str, segundos: float, cursor: sqlite3.Cursor) -> None:
+        normalizada = normalizar_sql(sql)
+        filas = max(cursor.rowcount, 0)
+        with self._lock:
+            entrada = self._sentencias.get(normalizada)
+            if entrada is None:
+                entrada = self._sentencias[normalizada] = {
+                    "llamadas": 0, "total_s": 0.0, "max_s": 0.0, "filas": 0,
+                }
+            entrada["llamadas"] += 1
+            entrada["total_s"] += segundos
+            entrada["max_s"] = max(entrada["max_s"], segundos)
+            entrada["filas"] += filas
+
+        destinos = [entrada]
+        unidad = self._unidad.get()
+        if unidad is not None:
+            unidad["consultas"][normalizada] += 1
+
+        if segundos >= self.umbral_s:
+            lenta = {
+                "sql": normalizada,
+                "duracion_ms": round(segundos * 1000, 3),
+                "filas": filas,
+                "unidad": unidad["nombre"] if unidad else None,
+                "momento": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "plan": self._plan(cursor.connection, sql),
+            }
+            destinos.append(lenta)
+            with self._lock:
+                self._lentas.append(lenta)
+
+        if isinstance(cursor, CursorPerfilado):
+            cursor._perfil_destinos = destinos
+        if time.monotonic() - self._ultimo_informe >= self.intervalo_s:
+            self.escribir_informe()
+
+    @staticmethod
+    def _plan(conn: sqlite3.Connection, sql: str):
+        """``EXPLAIN QUERY PLAN`` con parámetros nulos; el plan no depende de los valores."""
+        palabras = sql.split(None, 1)
+        if not palabras or palabras[0].upper() not in {"SELECT", "UPDATE", "DELETE", "INSERT", "WITH"}:
+            return None
+        try:
+            # Un cursor base no pasa por los observadores: el EXPLAIN no se perfila.
+            cursor = sqlite3.Cursor(conn)
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count("?"))
+            return [fila[-1] for fila in cursor.fetchall()]
+        except sqlite3.Error:
+            return None
+
+    # --- Unidades de trabajo (peticiones o acciones) ---
+
+    def iniciar_unidad(self, nombre: str):
+        return self._unidad.set({"nombre": nombre, "consultas": Counter()})
+
+    def cerrar_unidad(self, token) -> None:
+        unidad = self._unidad.get()
+        self._unidad.reset(token)
+        if unidad is None:
+            return
+        total = sum(unidad["consultas"].values())
+        if total > self.max_consultas:
+            repetidas = [
+                {"sql": sql, "veces": veces}
+                for sql, veces in unidad["consultas"].most_common(5)
+                if veces > 1
+            ]
+            logger.warning("%s ejecutó %d consultas", unidad["nombre"], total)
+            with self._lock:
+                self._unidades_sospechosas.append({
+                    "unidad": unidad["nombre"],
+                    "consultas": total,
+                    "repetidas": repetidas,
+                    "momento": time.strftime("%Y-%m-%d %H:%M:%S"),
+                })
+
+    def unidad(self, nombre: Optional[str] = None):
+        """Decorador que trata cada llamada de la función como una unidad."""
+
+        def decorador(funcion):
+            etiqueta = nombre or funcion.__qualname__
+
+            if inspect.iscoroutinefunction(funcion):
+                @functools.wraps(funcion)
+                async def envoltura_async(*args, **kwargs):
+                    token = self.iniciar_unidad(etiqueta)
+                    try:
+                        return await funcion(*args, **kwargs)
+                    finally:
+                        self.cerrar_unidad(token)
+                return envoltura_async
+
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                token = self.iniciar_unidad(etiqueta)
+                try:
+                    return funcion(*args, **kwargs)
+                finally:
+                    self.cerrar_unidad(token)
+            return envoltura
+
+        return decorador
+
+    # --- Informe ---
+
+    def informe(self) -> dict:
+        with self._lock:
+            sentencias = [
+                {"sql": sql, **{k: round(v, 6) if isinstance(v, float) else v for k, v in datos.items()}}
+                for sql, datos in self._sentencias.items()
+            ]
+            lentas = list(self._lentas)
+            sospechosas = list(self._unidades_sospechosas)
+        sentencias.sort(key=lambda s: s["total_s"], reverse=True)
+        return {
+            "generado": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "umbral_ms": self.umbral_s * 1000,
+            "max_consultas_por_unidad": self.max_consultas,
+            "sentencias": sentencias,
+            "lentas": lentas,
+            "posibles_n_mas_1": sospechosas,
+        }
+
+    def escribir_informe(self) -> None:
+        self._ultimo_informe = time.monotonic()
+        temporal = f"{self.archivo}.tmp"
+        try:
+            with open(temporal, "w", encoding="utf-8") as fh:
+                json.dump(self.informe(), fh, ensure_ascii=False, indent=2)
+            os.replace(temporal, self.archivo)
+        except OSError as exc:
+            logger.error("No se pudo escribir el perfil de consultas: %s", exc)
+
+
+def activar_desde_entorno(proceso: str) -> Optional[PerfilConsultas]:
+    """Activa el perfilador si ``PERFIL_CONSULTAS`` está definido.
+
+    Debe llamarse antes de abrir las conexiones que se quieran perfilar.
+    """
+    if os.environ.get("PERFIL_CONSULTAS", "").lower() not in {"1", "true", "si", "sí"}:
+        return None
+    directorio = os.environ.get("PERFIL_DIRECTORIO", os.path.dirname(os.path.abspath(__file__)))
+    perfil = PerfilConsultas(
+        archivo=os.path.join(directorio, f"perfil_consultas-{proceso}.json"),
+        umbral_s=float(os.environ.get("PERFIL_UMBRAL_MS", "50")) / 1000,
+        max_consultas=int(os.environ.get("PERFIL_MAX_CONSULTAS", "20")),
+        intervalo_s=float(os.environ.get("PERFIL_INTERVALO_S", "60")),
+    )
+    establecer_fabrica_conexion(ConexionPerfilada)
+    observar_consultas(perfil.observar)
+    atexit.register(perfil.escribir_informe)
+    logger.info("Perfil de consultas activo; informe en %s", perfil.archivo)
+    return perfil
+
+
+def unidad_perfil(perfil: Optional[PerfilConsultas], nombre: Optional[str] = None):
+    """Como ``perfil.unidad`` pero sin efecto cuando el perfilador está apagado."""
+    if perfil is None:
+        return lambda funcion: funcion
+    return perfil.unidad(nombre)
@@ -0,0 +1,380 @@
+"""Tracker store de Rasa sobre SQLite pensado para muchas conversaciones a la vez.
+
+El ``SQLTrackerStore`` de Rasa abre una sesión de SQLAlchemy por operación,
+cuenta en cada ``save`` los eventos ya guardados de la sesión para saber cuáles
+son nuevos, confirma una transacción por conversación y trabaja dentro del
+bucle de eventos, de modo que todas las conversaciones esperan en fila al
+mismo archivo. Este store usa la misma tabla ``events`` (y el mismo
+``tracker.db``, así que ``historial_chat.py`` sigue leyéndolo) pero:
+
+- guarda en memoria, en un LRU acotado, los eventos ya deserializados de la
+  última sesión de las conversaciones activas junto con el ``id`` del último
+  evento escrito: ``retrieve`` y ``save`` solo comprueban con ``MAX(id)`` (una
+  búsqueda en el índice) que ningún otro proceso escribió en la conversación,
+  sin volver a convertir JSON en eventos (lo que más CPU consume en Rasa);
+- solo añade filas nuevas, y un hilo escritor agrupa en un único ``COMMIT``
+  los eventos que llegan mientras se confirma el lote anterior (WAL);
+- las lecturas que no están en memoria van a hilos aparte, fuera del bucle;
+- publica latencias y aciertos de caché en ``metricas.REGISTRO`` (``/metrics``
+  del canal ``custom_socketio``).
+
+Se activa en ``endpoints.yml`` con ``type: tracker_store.TrackerStoreSQLite``.
+"""
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+from rasa.core.brokers.broker import EventBroker
+from rasa.core.tracker_store import SerializedTrackerAsText, TrackerStore
+from rasa.shared.core.domain import Domain
+from rasa.shared.core.events import Event, SessionStarted, deserialise_events
+from rasa.shared.core.trackers import DialogueStateTracker
+from rasa.shared.nlu.constants import INTENT_NAME_KEY
+
+from database import abrir_conexion, transaccion_inmediata
+from metricas import REGISTRO
+
+logger = logging.getLogger(__name__)
+
+TRACKER_CACHE_MAX = int(os.environ.get("TRACKER_CACHE_MAX", "1000"))
+TRACKER_LOTE_MAX = int(os.environ.get("TRACKER_LOTE_MAX", "500"))
+TRACKER_HILOS = int(os.environ.get("TRACKER_HILOS", "4"))
+
+# Mismo esquema que crea ``SQLTrackerStore``; el índice extra localiza el
+# último ``session_started`` de una conversación sin recorrer todos sus eventos.
+ESQUEMA_EVENTOS = (
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER NOT NULL PRIMARY KEY,
+        sender_id VARCHAR(255) NOT NULL,
+        type_name VARCHAR(255) NOT NULL,
+        timestamp FLOAT,
+        intent_name VARCHAR(255),
+        action_name VARCHAR(255),
+        data TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_events_sender_id ON events (sender_id)",
+    "CREATE INDEX IF NOT EXISTS idx_events_sender_tipo ON events (sender_id, type_name)",
+)
+
+_SQL_INSERTAR = (
+    "INSERT INTO events (sender_id, type_name, timestamp, intent_name, action_name, data) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+# Eventos desde el último ``session_started`` (o todos si no hay ninguno). Rasa
+# los ordena por ``id``; aquí también se usa ``id`` para el corte de sesión.
+_SQL_ULTIMA_SESION = """
+    SELECT id, data FROM events
+    WHERE sender_id = ? AND id >= COALESCE(
+        (SELECT MAX(id) FROM events WHERE sender_id = ? AND type_name = ?), 0
+    )
+    ORDER BY id
+"""
+_SQL_TODOS = "SELECT id, data FROM events WHERE sender_id = ? ORDER BY id"
+_SQL_ULTIMO_ID = "SELECT MAX(id) FROM events WHERE sender_id = ?"
+
+metrica_duracion = REGISTRO.histograma(
+    "tracker_store_duracion_segundos", "Duración de las operaciones del tracker store.",
+    ("operacion",),
+)
+metrica_cache = REGISTRO.contador(
+    "tracker_store_cache_total",
+    "Trackers servidos desde memoria o leídos de tracker.db (fallo: no estaba; obsoleto: otro proceso escribió).",
+    ("resultado",),
+)
+metrica_lote = REGISTRO.histograma(
+    "tracker_store_eventos_por_commit", "Eventos confirmados en cada COMMIT del escritor.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+metrica_en_memoria = REGISTRO.medidor(
+    "tracker_store_conversaciones_en_memoria", "Conversaciones con su última sesión en el LRU."
+)
+
+
+def activar_vacuum_incremental(path: str) -> None:
+    """Deja ``auto_vacuum = INCREMENTAL`` en una base que aún no tiene tablas.
+
+    Permite que compactar_tracker.py devuelva espacio con
+    ``incremental_vacuum`` sin un VACUUM completo. Hay que hacerlo antes de
+    crear la primera tabla: después SQLite ignora el PRAGMA. El ``VACUUM`` de
+    un archivo vacío es instantáneo y aplica el modo aunque el archivo ya esté
+    en WAL (que es lo primero que hace ``abrir_conexion``).
+    """
+    conn = sqlite3.connect(path)
+    try:
+        vacia = conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+        if vacia and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+class _Escritor(threading.Thread):
+    """Hilo único que escribe en ``tracker.db`` agrupando commits.
+
+    Cada ``save`` encola sus filas con un ``Future``. El hilo toma todo lo que
+    esté en cola (hasta ``lote_max`` filas), lo inserta en una transacción y
+    resuelve cada futuro con el ``id`` de su última fila; mientras confirma,
+    los siguientes ``save`` se acumulan para el próximo lote. Con una sola
+    conversación no añade espera.
+    """
+
+    def __init__(self, path: str, lote_max: int):
+        super().__init__(name="tracker-escritor", daemon=True)
+        self.path = path
+        self.lote_max = max(1, lote_max)
+        self.cola: "queue.Queue" = queue.Queue()
+
+    def encolar(self, filas: List[tuple]) -> concurrent.futures.Future:
+        futuro = concurrent.futures.Future()
+        self.cola.put((filas, futuro))
+        return futuro
+
+    def detener(self) -> None:
+        self.cola.put(None)
+        self.join()
+
+    def run(self) -> None:
+        conn = abrir_conexion(self.path)
+        try:
+            while True:
+                elemento = self.cola.get()
+                if elemento is None:
+                    return
+                pendientes = [elemento]
+                total = len(elemento[0])
+                while total < self.lote_max:
+                    try:
+                        elemento = self.cola.get_nowait()
+                    except queue.Empty:
+                        break
+                    if elemento is None:
+                        self.cola.put(None)
+                        break
+                    pendientes.append(elemento)
+                    total += len(elemento[0])
+                self._confirmar(conn, pendientes, total)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _confirmar(conn, pendientes: List[tuple], total: int) -> None:
+        inicio = time.perf_counter()
+        ultimos = []
+        try:
+            with transaccion_inmediata(conn):
+                for filas, _ in pendientes:
+                    conn.executemany(_SQL_INSERTAR, filas)
+                    ultimos.append(conn.execute("SELECT last_insert_rowid()").fetchone()[0])
+        except Exception as error:
+            for _, futuro in pendientes:
+                futuro.set_exception(error)
+            return
+        metrica_duracion.observar(time.perf_counter() - inicio, operacion="commit")
+        metrica_lote.observar(total)
+        for (_, futuro), ultimo in zip(pendientes, ultimos):
+            futuro.set_result(ultimo)
+
+
+class TrackerStoreSQLite(TrackerStore, SerializedTrackerAsText):
+    """Eventos en ``tracker.db`` con LRU en memoria y escritura agrupada."""
+
+    def __init__(
+        self,
+        domain: Optional[Domain] = None,
+        db: Text = "tracker.db",
+        event_broker: Optional[EventBroker] = None,
+        cache_max: int = TRACKER_CACHE_MAX,
+        lote_max: int = TRACKER_LOTE_MAX,
+        hilos: int = TRACKER_HILOS,
+        **kwargs: Dict[Text, Any],
+    ) -> None:
+        # ``host``, ``dialect``, ``session_persistence``... de la configuración
+        # del SQLTrackerStore se aceptan y se ignoran.
+        kwargs.pop("host", None)
+        self.path = db
+        self.cache_max = max(0, int(cache_max))
+        activar_vacuum_incremental(self.path)
+        conn = abrir_conexion(self.path)
+        try:
+            for sentencia in ESQUEMA_EVENTOS:
+                conn.execute(sentencia)
+            conn.commit()
+        finally:
+            conn.close()
+
+        # sender_id -> (eventos de la última sesión ya escritos, ``id`` del
+        # último). Los ``Event`` se comparten entre trackers, como hace Rasa al
+        # separar sesiones.
+        self._cache: "OrderedDict[str, Tuple[List[Event], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._lectores = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, int(hilos)), thread_name_prefix="tracker-lector"
+        )
+        self._escritor = _Escritor(self.path, int(lote_max))
+        self._escritor.start()
+        super().__init__(domain, event_broker, **kwargs)
+
+    # --- caché ---
+
+    def _de_cache(self, sender_id: Text) -> Optional[Tuple[List[Event], int]]:
+        with self._lock:
+            guardado = self._cache.get(sender_id)
+            if guardado is not None:
+                self._cache.move_to_end(sender_id)
+            return guardado
+
+    def _a_cache(self, sender_id: Text, eventos: List[Event], ultimo_id: int) -> None:
+        if not self.cache_max:
+            return
+        with self._lock:
+            self._cache[sender_id] = (eventos, ultimo_id)
+            self._cache.move_to_end(sender_id)
+            while len(self._cache) > self.cache_max:
+                self._cache.popitem(last=False)
+            metrica_en_memoria.set(len(self._cache))
+
+    def _descartar(self, sender_id: Text) -> None:
+        with self._lock:
+            self._cache.pop(sender_id, None)
+
+    # --- lectura ---
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = abrir_conexion(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _leer(self, sender_id: Text, todas_las_sesiones: bool) -> Tuple[List[Event], Optional[int]]:
+        """Eventos de la conversación y ``id`` del último (``None`` si no hay)."""
+        if todas_las_sesiones:
+            filas = self._conexion().execute(_SQL_TODOS, (sender_id,)).fetchall()
+        else:
+            filas = self._conexion().execute(
+                _SQL_ULTIMA_SESION, (sender_id, sender_id, SessionStarted.type_name)
+            ).fetchall()
+        eventos = deserialise_events([json.loads(data) for (_, data) in filas])
+        return eventos, (filas[-1][0] if filas else None)
+
+    def _leer_si_cambio(self, sender_id: Text, ultimo_id: int) -> Optional[Tuple[List[Event], Optional[int]]]:
+        """``None`` si el último evento escrito sigue siendo ``ultimo_id``; si no, la última sesión."""
+        (actual,) = self._conexion().execute(_SQL_ULTIMO_ID, (sender_id,)).fetchone()
+        if actual == ultimo_id:
+            return None
+        return self._leer(sender_id, False)
+
+    async def _eventos_ultima_sesion(self, sender_id: Text) -> List[Event]:
+        loop = asyncio.get_running_loop()
+        guardado = self._de_cache(sender_id)
+        if guardado is None:
+            metrica_cache.inc(resultado="fallo")
+            eventos, ultimo_id = await loop.run_in_executor(self._lectores, self._leer, sender_id, False)
+        else:
+            # La caché es de este proceso: si otro nodo de Rasa escribió en la
+            # conversación, ``MAX(id)`` (una búsqueda en ``ix_events_sender_id``)
+            # ya no coincide y se vuelve a leer en la misma visita al hilo.
+            leido = await loop.run_in_executor(self._lectores, self._leer_si_cambio, sender_id, guardado[1])
+            if leido is None:
+                metrica_cache.inc(resultado="acierto")
+                return guardado[0]
+            metrica_cache.inc(resultado="obsoleto")
+            self._descartar(sender_id)
+            eventos, ultimo_id = leido
+        if eventos:
+            self._a_cache(sender_id, eventos, ultimo_id)
+        return eventos
+
+    def _tracker(self, sender_id: Text, eventos: List[Event]) -> Optional[DialogueStateTracker]:
+        if self.domain and eventos:
+            return DialogueStateTracker.from_events(sender_id, eventos, self.domain.slots)
+        return None
+
+    async def retrieve(self, sender_id: Text) -> Optional[DialogueStateTracker]:
+        """Tracker con los eventos de la última sesión de la conversación."""
+        inicio = time.perf_counter()
+        eventos = await self._eventos_ultima_sesion(sender_id)
+        tracker = self._tracker(sender_id, eventos)
+        metrica_duracion.observar(time.perf_counter() - inicio, operacion="retrieve")
+        return tracker
+
+    async def retrieve_full_tracker(self, conversation_id: Text) -> Optional[DialogueStateTracker]:
+        """Tracker con todas las sesiones; siempre se lee de la base."""
+        inicio = time.perf_counter()
+        eventos, _ = await asyncio.get_running_loop().run_in_executor(
+            self._lectores, self._leer, conversation_id, True
+        )
+        tracker = self._tracker(conversation_id, eventos)
+        metrica_duracion.observar(time.perf_counter() - inicio, operacion="retrieve_full")
+        return tracker
+
+    async def keys(self) -> Iterable[Text]:
+        filas = await asyncio.get_running_loop().run_in_executor(
+            self._lectores,
+            lambda: self._conexion().execute("SELECT DISTINCT sender_id FROM events").fetchall(),
+        )
+        return [sender_id for (sender_id,) in filas]
+
+    # --- escritura ---
+
+    async def save(self, tracker: DialogueStateTracker) -> None:
+        """Añade los eventos del tracker que aún no están en ``tracker.db``.
+
+        Igual que ``SQLTrackerStore``, los eventos escritos de la última sesión
+        marcan desde qué posición de ``tracker.events`` hay eventos nuevos; aquí
+        ese número sale de la caché (comprobada con ``MAX(id)``) en vez de un
+        ``COUNT``.
+        """
+        inicio = time.perf_counter()
+        sender_id = tracker.sender_id
+        guardados = await self._eventos_ultima_sesion(sender_id)
+        nuevos = list(tracker.events)[len(guardados):]
+        if not nuevos:
+            return
+
+        filas = []
+        for evento in nuevos:
+            data = evento.as_dict()
+            filas.append(
+                (
+                    sender_id,
+                    evento.type_name,
+                    data.get("timestamp"),
+                    data.get("parse_data", {}).get("intent", {}).get(INTENT_NAME_KEY),
+                    data.get("name"),
+                    json.dumps(data),
+                )
+            )
+        try:
+            ultimo_id = await asyncio.wrap_future(self._escritor.encolar(filas))
+        except Exception:
+            self._descartar(sender_id)
+            raise
+
+        # La próxima sesión empieza en el último ``session_started`` escrito.
+        eventos = guardados + nuevos
+        for posicion in range(len(eventos) - 1, len(guardados) - 1, -1):
+            if isinstance(eventos[posicion], SessionStarted):
+                eventos = eventos[posicion:]
+                break
+        self._a_cache(sender_id, eventos, ultimo_id)
+        if self.event_broker is not None:
+            await self._stream_new_events(self.event_broker, nuevos, sender_id)
+        metrica_duracion.observar(time.perf_counter() - inicio, operacion="save")
+
+    def cerrar(self) -> None:
+        """Termina de escribir lo encolado y libera los hilos."""
+        self._escritor.detener()
+        self._lectores.shutdown(wait=True)